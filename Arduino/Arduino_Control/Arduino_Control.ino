@@ -36,10 +36,71 @@ uint8_t *myTSensors[] = {
 // Declare number of sensors in global scope
 int numSensors = 9;
 
+// Temperature conversions run in the background: loop() starts one and
+// collects the readings when it is done, so a dump never waits ~750 ms for
+// the DS18B20s. Dumps send the latest valid reading of every sensor along
+// with its age in milliseconds.
+float tempCache[sizeof(myTSensors) / sizeof(myTSensors[0])];
+unsigned long tempReadAt[sizeof(myTSensors) / sizeof(myTSensors[0])];
+bool conversionRunning = false;
+unsigned long conversionStart = 0;
+unsigned long conversionTime = 750;
+
 // Strings used to send and receive through serial
 String readString;
 String pinStatus;
 
+// Pins reported in every dump. Change these for boards with more pins
+// (e.g. a Mega); pin numbers in config.txt are per board.
+const byte NUM_ANALOG_PINS = 6;
+const byte FIRST_DIGITAL_PIN = 2;
+const byte NUM_DIGITAL_PINS = 8;
+
+// Binary frames (see arduino_protocol.py). Python sends 'B' to switch
+// to binary frames and 'A' to go back to text lines.
+// Frame layout (little endian):
+//   0xCC 0xBC, version, temp count, analog count, digital count,
+//   command sequence number (uint16), dump sequence number (uint16),
+//   temp entries (8 byte address + int16 temperature in 1/100 F
+//                 + uint16 age of the reading in milliseconds),
+//   analog entries (uint8 pin + uint16 reading),
+//   digital entries (uint8 pin + uint8 value),
+//   CRC-CCITT (init 0xFFFF) of everything from version to the last entry
+bool binaryMode = false;
+const byte FRAME_MAGIC_1 = 0xCC;
+const byte FRAME_MAGIC_2 = 0xBC;
+const byte FRAME_VERSION = 4;
+uint16_t frameCrc;
+
+// Streaming: Python sends "<milliseconds>S" to have the data pushed
+// every so many milliseconds without asking, and "0S" to stop
+unsigned long streamInterval = 0;
+unsigned long lastStream = 0;
+
+// Counts the dumps (text and binary). Python uses it to spot lost or
+// partial dumps, and asks for a keyframe when one went missing.
+unsigned int dumpSequence = 0;
+
+// Sequence number of the last command from Python ("X!" polls and
+// "X=ON@N#" pin commands). Echoed in every dump, so Python can tell
+// which of its commands the dump already reflects.
+unsigned int commandSequence = 0;
+
+// Delta reporting: Python sends "N,T,AD" to only report the readings that
+// moved more than T hundredths of a degree F (temperatures) or A counts
+// (analog pins) since they were last reported, and the digital pins that
+// changed, with a full report (keyframe) every N dumps. "0D" goes back to
+// full reports, and "K" asks for a keyframe in the next dump.
+bool deltaMode = false;
+unsigned int keyframeInterval = 0;
+int tempDeadband = 0;
+int analogDeadband = 0;
+unsigned int dumpsSinceKeyframe = 0;
+bool keyframe = true;
+int16_t lastTemps[sizeof(myTSensors) / sizeof(myTSensors[0])];
+int lastAnalog[NUM_ANALOG_PINS];
+byte lastDigital[NUM_DIGITAL_PINS];
+
 void setup()
 {
   // Set pins 2-13 as output
@@ -84,7 +145,13 @@ void setup()
     Serial.println();
     delay(10); 
   }
+
+  // Conversions are collected by updateTemperatures() instead of waiting for them
+  sensors.setWaitForConversion(false);
+  conversionTime = sensors.millisToWaitForConversion(sensors.getResolution());
   Serial.println();
+  // Tell the host it can start sending commands
+  Serial.println("ready");
 }
 
 // function to print a device address
@@ -103,16 +170,79 @@ void setPinStatus(String string) {
   // Pin number is everything before that
   String pinNum = readString.substring(0, equalssign_index);
   int pin_num = pinNum.toInt();
-  // Status is the string after = and before #
+  // Status is the string after = and before @ (or # without a sequence number)
   int poundsign_index = readString.indexOf("#");
-  String pinStatus = readString.substring(equalssign_index + 1, poundsign_index); 
+  int at_index = readString.indexOf("@");
+  if (at_index < 0) {
+    at_index = poundsign_index;
+  }
+  else {
+    commandSequence = readString.substring(at_index + 1, poundsign_index).toInt();
+  }
+  String pinStatus = readString.substring(equalssign_index + 1, at_index);
   setSwitchOnOff(pin_num, pinStatus);
 }
 
+void setDeltaMode(String string) {
+  // N,T,AD (see deltaMode)
+  keyframeInterval = string.toInt();
+  deltaMode = keyframeInterval > 0;
+  int comma_index = string.indexOf(",");
+  tempDeadband = string.substring(comma_index + 1).toInt();
+  comma_index = string.indexOf(",", comma_index + 1);
+  analogDeadband = string.substring(comma_index + 1).toInt();
+  keyframe = true;
+}
+
+void beginDump() {
+  // Every dump is a keyframe unless delta reporting is on
+  if (!deltaMode || dumpsSinceKeyframe >= keyframeInterval) {
+    keyframe = true;
+  }
+  if (keyframe) {
+    dumpsSinceKeyframe = 0;
+  }
+  dumpsSinceKeyframe++;
+}
+
+void endDump() {
+  keyframe = false;
+  dumpSequence++;
+}
+
+bool reportTemp(int i, float tempF) {
+  // Returns true if the reading goes in this dump, and remembers it
+  int16_t hundredths = (int16_t)(tempF * 100 + 0.5);
+  if (!keyframe && abs(hundredths - lastTemps[i]) <= tempDeadband) {
+    return false;
+  }
+  lastTemps[i] = hundredths;
+  return true;
+}
+
+bool reportAnalog(byte i, int val) {
+  if (!keyframe && abs(val - lastAnalog[i]) <= analogDeadband) {
+    return false;
+  }
+  lastAnalog[i] = val;
+  return true;
+}
+
+bool reportDigital(byte i, byte val) {
+  if (!keyframe && val == lastDigital[i - FIRST_DIGITAL_PIN]) {
+    return false;
+  }
+  lastDigital[i - FIRST_DIGITAL_PIN] = val;
+  return true;
+}
+
 void readAnalogPins() {
   int val = 0;
-  for (int i=0; i < 6; i++) {
+  for (int i=0; i < NUM_ANALOG_PINS; i++) {
     val = analogRead(i);
+    if (!reportAnalog(i, val)) {
+      continue;
+    }
     Serial.print("analogpin:");
     Serial.print("name=");
     Serial.print("Pin");
@@ -126,8 +256,11 @@ void readAnalogPins() {
 
 void readDigitalPins() {
   int val = 0;
-  for (int i=2; i < 10; i++) {
+  for (int i=FIRST_DIGITAL_PIN; i < FIRST_DIGITAL_PIN + NUM_DIGITAL_PINS; i++) {
     val = digitalRead(i);
+    if (!reportDigital(i, val)) {
+      continue;
+    }
     Serial.print("digitalpin:");
     Serial.print("name=");
     Serial.print("Pin");
@@ -139,9 +272,149 @@ void readDigitalPins() {
   }
 }
 
+void crcUpdate(byte b) {
+  // CRC-CCITT, polynomial 0x1021
+  frameCrc ^= (uint16_t)b << 8;
+  for (byte i = 0; i < 8; i++) {
+    if (frameCrc & 0x8000) {
+      frameCrc = (frameCrc << 1) ^ 0x1021;
+    }
+    else {
+      frameCrc = frameCrc << 1;
+    }
+  }
+}
+
+void updateTemperatures() {
+  // Starts a conversion, or stores its readings once it is done
+  if (!conversionRunning) {
+    sensors.requestTemperatures();
+    conversionStart = millis();
+    conversionRunning = true;
+    return;
+  }
+  if (millis() - conversionStart < conversionTime) {
+    return;
+  }
+  for (int i = 0; i < numSensors; i++)
+    {
+    float tempF = sensors.getTempFByIndex(i);
+    // Keep the last valid reading (its age keeps growing) if this one failed
+    if (tempF > 32)
+      {
+      tempCache[i] = tempF;
+      tempReadAt[i] = millis();
+      }
+    }
+  conversionRunning = false;
+}
+
+unsigned int tempAge(int i) {
+  // Milliseconds since the reading was taken, capped to fit in 16 bits
+  unsigned long age = millis() - tempReadAt[i];
+  if (age > 65535) {
+    age = 65535;
+  }
+  return age;
+}
+
+void writeFrameByte(byte b) {
+  Serial.write(b);
+  crcUpdate(b);
+}
+
+void writeFrameInt(uint16_t val) {
+  writeFrameByte(val & 0xFF);
+  writeFrameByte((val >> 8) & 0xFF);
+}
+
+void returnAllInfoBinary() {
+  beginDump();
+
+  // The header holds the number of readings sent, so read them all first.
+  // Readings left out of this dump are marked with 0 / -1 / 255.
+  float temps[sizeof(myTSensors) / sizeof(myTSensors[0])];
+  byte validTemps = 0;
+  for (int i = 0; i < numSensors; i++)
+    {
+    temps[i] = tempCache[i];
+    if (temps[i] > 32 && reportTemp(i, temps[i]))
+      {
+      validTemps++;
+      }
+    else
+      {
+      temps[i] = 0;
+      }
+    }
+  int analogs[NUM_ANALOG_PINS];
+  byte analogCount = 0;
+  for (byte i = 0; i < NUM_ANALOG_PINS; i++) {
+    analogs[i] = analogRead(i);
+    if (reportAnalog(i, analogs[i])) {
+      analogCount++;
+    }
+    else {
+      analogs[i] = -1;
+    }
+  }
+  byte digitals[NUM_DIGITAL_PINS];
+  byte digitalCount = 0;
+  for (byte i = 0; i < NUM_DIGITAL_PINS; i++) {
+    digitals[i] = digitalRead(FIRST_DIGITAL_PIN + i);
+    if (reportDigital(FIRST_DIGITAL_PIN + i, digitals[i])) {
+      digitalCount++;
+    }
+    else {
+      digitals[i] = 255;
+    }
+  }
+
+  Serial.write(FRAME_MAGIC_1);
+  Serial.write(FRAME_MAGIC_2);
+  frameCrc = 0xFFFF;
+  writeFrameByte(FRAME_VERSION);
+  writeFrameByte(validTemps);
+  writeFrameByte(analogCount);
+  writeFrameByte(digitalCount);
+  writeFrameInt(commandSequence);
+  writeFrameInt(dumpSequence);
+
+  for (int i = 0; i < numSensors; i++)
+    {
+    // Only include valid temperature readings
+    if (temps[i] > 32)
+      {
+      for (byte j = 0; j < 8; j++)
+        {
+        writeFrameByte(myTSensors[i][j]);
+        }
+      writeFrameInt((int16_t)(temps[i] * 100 + 0.5));
+      writeFrameInt(tempAge(i));
+      }
+    }
+  for (byte i = 0; i < NUM_ANALOG_PINS; i++) {
+    if (analogs[i] >= 0) {
+      writeFrameByte(i);
+      writeFrameInt(analogs[i]);
+    }
+  }
+  for (byte i = 0; i < NUM_DIGITAL_PINS; i++) {
+    if (digitals[i] != 255) {
+      writeFrameByte(FIRST_DIGITAL_PIN + i);
+      writeFrameByte(digitals[i]);
+    }
+  }
+
+  // The CRC itself is not part of the CRC
+  uint16_t crc = frameCrc;
+  Serial.write(crc & 0xFF);
+  Serial.write((crc >> 8) & 0xFF);
+  endDump();
+}
+
 void returnAllInfo() {
-  // Update the temperature readings
-  sensors.requestTemperatures();
+  beginDump();
     
   // Send temperature information through serial
   /* IMPORTANT!!!
@@ -155,15 +428,21 @@ void returnAllInfo() {
      Serial number (e.g., serial_num="28FF4A778016477")
      Value of the parameter (e.g., value=108.5)
      Units of the parameter (e.g., units=F)
+     Age of the reading in milliseconds (e.g., age=420)
      An example, using two temperature probes:
-     name=Temp1,serial_num=blahblah1,value=55.55,units=F
-     name=Temp2,serial_num=blahblah2,value=69.69,units=F
+     name=Temp1,serial_num=blahblah1,value=55.55,units=F,age=420
+     name=Temp2,serial_num=blahblah2,value=69.69,units=F,age=420
+     Every dump ends with an end line holding a sequence number, so the python
+     script knows the dump is complete without waiting for a timeout, and the
+     sequence number of the last command it received and whether it holds
+     every reading (key=1) or only the ones that changed (key=0, delta mode):
+     end:seq=42,ack=17,key=1
      If you change this format here, change it in the python script as well! */
   for (int i = 0; i < numSensors; i++)
     {
-    float tempF = sensors.getTempFByIndex(i);
+    float tempF = tempCache[i];
     // Only include valid temperature readings
-    if (tempF > 32)
+    if (tempF > 32 && reportTemp(i, tempF))
       {
       Serial.print("tempsensor:");
       Serial.print("name=Temp");
@@ -172,16 +451,40 @@ void returnAllInfo() {
       printAddress(myTSensors[i]);
       Serial.print(",value=");
       Serial.print(tempF);
-      Serial.println(",units=F");      
+      Serial.print(",units=F");
+      Serial.print(",age=");
+      Serial.println(tempAge(i));
       }
     }
   readAnalogPins();
   readDigitalPins();
+  Serial.print("end:seq=");
+  Serial.print(dumpSequence);
+  Serial.print(",ack=");
+  Serial.print(commandSequence);
+  Serial.print(",key=");
+  Serial.println(keyframe ? 1 : 0);
+  endDump();
+}
+
+void sendAllInfo() {
+  if (binaryMode) {
+    returnAllInfoBinary();
+  }
+  else {
+    returnAllInfo();
+  }
 }
 
 void loop() 
 {
-  while(!Serial.available()) {}
+  // Keep the temperature readings fresh without blocking
+  updateTemperatures();
+  // Push the information on our own when streaming
+  if (streamInterval > 0 && millis() - lastStream >= streamInterval) {
+    lastStream = millis();
+    sendAllInfo();
+  }
   // serial read section
   while(Serial.available())
   {
@@ -191,18 +494,56 @@ void loop()
       // Read the input from Python, which are
       // in the following format:
       // Switching pin statuses
-      //   X=OFF or X=ON
-      // where X is the pin number
+      //   X=OFF@N# or X=ON@N#
+      // where X is the pin number and N the command sequence number
       // Returning all information
-      //   !
+      //   N!
+      // Switching to binary frames or text lines
+      //   B or A
+      // Streaming every X milliseconds (0 stops it)
+      //   XS
+      // Delta reporting (see deltaMode) and keyframe requests
+      //   N,T,AD and K
       char ch = Serial.read();
       readString += ch;
       // The character # is used to stop reading from serial
       if (ch == '!') 
         {
-        returnAllInfo();
+        // A plain ! (without a sequence number) leaves it alone
+        if (readString.length() > 1) {
+          commandSequence = readString.toInt();
+        }
+        sendAllInfo();
         readString="";
         }     
+      if (ch == 'S')
+        {
+          streamInterval = readString.toInt();
+          lastStream = millis();
+          readString="";
+        }
+      if (ch == 'D')
+        {
+          setDeltaMode(readString);
+          readString="";
+        }
+      if (ch == 'K')
+        {
+          keyframe = true;
+          readString="";
+        }
+      if (ch == 'B')
+        {
+          binaryMode = true;
+          Serial.println("protocol:binary");
+          readString="";
+        }
+      if (ch == 'A')
+        {
+          binaryMode = false;
+          Serial.println("protocol:text");
+          readString="";
+        }
       if (ch == '#')
         {
           setPinStatus(readString);
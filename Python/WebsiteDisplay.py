@@ -3,6 +3,11 @@
 # Import standard Python files
 import os
 import io
+import json
+
+# Import local modules
+from shared_state import merge_changes
+from heartbeat import timed
 
 # Make the json print functionality work with both Python 2 and 3
 try:
@@ -17,6 +22,9 @@ except NameError:
 # TODO: make this an if statement
 html_dir = os.path.join("C:", "xampp", "htdocs", "CCBC")
 
+# Longest time (seconds) between two heartbeats of the json writer
+HEARTBEAT_INTERVAL = 1.0
+
 
 class WebsiteUpdate(object):
     """ Contains functionality related to the website"""
@@ -31,3 +39,29 @@ class WebsiteUpdate(object):
                               separators=(',', ': '), ensure_ascii=False)
             outfile.write(to_unicode(str_))
         return str_
+
+    @staticmethod
+    def write_json_on_change(ard_dict, directory=html_dir, heartbeats=None, ready=None):
+        """ Rewrites the json file every time the brewery data changes. Runs forever.
+
+        Meant to be the target of its own process; it sleeps on the change feed
+        instead of polling the shared dictionary. With a Heartbeats block, it
+        publishes how long every write takes, and beats at least every
+        HEARTBEAT_INTERVAL seconds while nothing changes. ready is an optional
+        multiprocessing Event, set once the first file is written.
+        """
+        heartbeat = None
+        if heartbeats is not None:
+            heartbeat = heartbeats.heartbeat("Website", period=HEARTBEAT_INTERVAL)
+        # Changes from here on are merged into the snapshot (one made in between is merged twice)
+        subscription = ard_dict.subscribe(ard_dict.version())
+        data = ard_dict.snapshot()
+        WebsiteUpdate.write_json_file(directory, data)
+        if ready is not None:
+            ready.set()
+        while True:
+            changes = subscription.wait(HEARTBEAT_INTERVAL)
+            with timed(heartbeat):
+                if changes:
+                    merge_changes(data, changes)
+                    WebsiteUpdate.write_json_file(directory, data)
@@ -0,0 +1,416 @@
+#!/usr/bin/env python3
+
+""" Arduino emulator
+
+    Pretends to be an Arduino running Arduino_Control.ino on one end of a
+    pseudo-terminal, so ArdControl (or AsyncArdControl) can be run against
+    it unchanged, without any hardware:
+
+        emulator = ArduinoEmulator(serials)
+        emulator.start()
+        ard_process = ArdControl(ard_dict, serial_port=emulator.port)
+
+    It understands the same commands as the sketch (N!, X=ON@N#/X=OFF@N#, B/A,
+    XS streaming, N,T,AD delta reporting and K keyframes) and answers with
+    the same text lines or binary frames, echoing the command sequence
+    numbers N.
+    The serial speed can be imitated (pacing the output at the baud rate),
+    and noise, the DS18B20 conversion time, reply latency and cut-off dumps
+    can be injected.
+
+    Run it as a script to get a port to point ArdControl at, or with
+    --benchmark to measure how many dumps per second ArdControl gets through.
+    --boards spreads the configuration over several emulated Arduinos, each
+    with its own ArdControl process.
+
+    """
+
+# Import standard Python modules
+import argparse
+import os
+import random
+import re
+import select
+import tempfile
+import time
+import tty
+from multiprocessing import Event
+from threading import Thread
+
+# Import third-party libraries
+
+# Import relative files
+import arduino_protocol
+import setup_configuration
+
+# Text the sketch prints when it starts up
+BANNER = "Coulson Craft Brewery Control"
+# Longest wait (seconds) for the benchmarked ArdControls to find their Arduino ready
+READY_TIMEOUT = 30.0
+
+
+class ArduinoEmulator(Thread):
+    """ Emulated Arduino on a pseudo-terminal.
+
+    serials: temperature sensor serial numbers (hex strings) to report
+    analog_pins: number of analog pins reported (A0 and up)
+    digital_pins: digital pins reported
+    baudrate: output is paced to this serial speed (None to send at full speed)
+    conversion_time: seconds a DS18B20 conversion takes; like the sketch, conversions run
+        in the background and the dumps report the latest readings with their age
+    latency: seconds to wait before answering a '!' (e.g. a slow USB-serial adapter, or a
+        sketch that still blocks on its conversions)
+    noise: standard deviation added to every temperature and analog reading
+    drop_rate: chance (0-1) that a text dump is cut off before its end line, or a binary frame is lost
+    """
+
+    def __init__(self, serials, analog_pins=6, digital_pins=range(2, 10), baudrate=9600,
+                 conversion_time=0.75, latency=0.0, noise=0.0, drop_rate=0.0, temperature=150.0, analog_value=512):
+        Thread.__init__(self, daemon=True)
+        self.temperature = temperature
+        self.set_sensors(serials)
+        self.analog_values = [analog_value] * analog_pins
+        self.digital_pins = list(digital_pins)
+        self.pin_values = {pin: 0 for pin in range(2, 14)}
+        self.baudrate = baudrate
+        self.conversion_time = conversion_time
+        self.conversion_start = None
+        self.latency = latency
+        self.noise = noise
+        self.drop_rate = drop_rate
+
+        self.binary_mode = False
+        self.stream_interval = 0
+        self.last_stream = 0.0
+        self.dump_sequence = 0
+        self.command_sequence = 0
+
+        # Delta reporting (see the sketch)
+        self.keyframe_interval = 0
+        self.temp_deadband = 0
+        self.analog_deadband = 0
+        self.dumps_since_keyframe = 0
+        self.keyframe = True
+        self.last_reported = {}
+        self.read_string = ''
+        self.running = True
+
+        # Statistics
+        self.dumps_sent = 0
+        self.bytes_sent = 0
+        self.pin_commands = 0
+
+        self.master, self.slave = os.openpty()
+        tty.setraw(self.slave)
+        self.port = os.ttyname(self.slave)
+
+    def run(self):
+        self.send_line(BANNER)
+        self.send_line(arduino_protocol.READY_LINE.decode())
+        while self.running:
+            self.update_temperatures()
+            timeout = max(0.0, self.conversion_start + self.conversion_time - time.monotonic())
+            if self.stream_interval:
+                timeout = min(timeout, max(0.0, self.last_stream + self.stream_interval - time.monotonic()))
+            readable, _, _ = select.select([self.master], [], [], timeout)
+            if readable:
+                try:
+                    data = os.read(self.master, 1024)
+                except OSError:
+                    # The other end is closed
+                    time.sleep(0.1)
+                    continue
+                for ch in data.decode('latin-1'):
+                    self.handle_char(ch)
+            if self.stream_interval and time.monotonic() - self.last_stream >= self.stream_interval:
+                self.last_stream = time.monotonic()
+                self.send_all_info()
+
+    def stop(self):
+        self.running = False
+
+    def set_sensors(self, serials):
+        """ Replaces the temperature sensors reported (serial numbers as hex strings)"""
+        self.serials = list(serials)
+        self.addresses = [arduino_protocol.serial_to_address(serial_num) or bytes(8)
+                          for serial_num in self.serials]
+        self.temperatures = [self.temperature] * len(self.serials)
+        # Latest reading of every sensor (None until the first conversion) and when it was taken
+        self.readings = [None] * len(self.serials)
+        self.read_at = [0.0] * len(self.serials)
+
+    def handle_char(self, ch):
+        """ Same command handling as loop() in the sketch"""
+        self.read_string += ch
+        if ch == '!':
+            if len(self.read_string) > 1:
+                self.command_sequence = int(self.read_string[:-1].strip() or 0) % arduino_protocol.SEQUENCE_MODULUS
+            if self.latency:
+                time.sleep(self.latency)
+            self.send_all_info()
+            self.read_string = ''
+        if ch == 'S':
+            match = re.match(r'\s*(\d+)', self.read_string)
+            self.stream_interval = int(match.group(1)) / 1000.0 if match else 0
+            self.last_stream = time.monotonic()
+            self.read_string = ''
+        if ch == 'D':
+            values = [int(value or 0) for value in self.read_string[:-1].strip().split(',')] + [0, 0]
+            self.keyframe_interval, self.temp_deadband, self.analog_deadband = values[:3]
+            self.keyframe = True
+            self.read_string = ''
+        if ch == 'K':
+            self.keyframe = True
+            self.read_string = ''
+        if ch == 'B':
+            self.binary_mode = True
+            self.send_line("protocol:binary")
+            self.read_string = ''
+        if ch == 'A':
+            self.binary_mode = False
+            self.send_line("protocol:text")
+            self.read_string = ''
+        if ch == '#':
+            self.set_pin_status(self.read_string)
+            self.read_string = ''
+
+    def set_pin_status(self, command):
+        """ Handles X=ON@N# / X=OFF@N#"""
+        pin_num, _, status = command.rstrip('#').partition('=')
+        status, _, seq = status.partition('@')
+        if seq:
+            self.command_sequence = int(seq) % arduino_protocol.SEQUENCE_MODULUS
+        try:
+            pin_num = int(pin_num)
+        except ValueError:
+            return
+        self.pin_values[pin_num] = 1 if status == 'ON' else 0
+        self.pin_commands += 1
+
+    def update_temperatures(self):
+        """ Starts a conversion, or stores its readings once it is done (updateTemperatures in the sketch)"""
+        now = time.monotonic()
+        if self.conversion_start is None:
+            self.conversion_start = now
+            return
+        if now - self.conversion_start < self.conversion_time:
+            return
+        for i, temperature in enumerate(self.temperatures):
+            self.readings[i] = temperature + random.gauss(0, self.noise) if self.noise else temperature
+            self.read_at[i] = now
+        # The next conversion starts right away
+        self.conversion_start = now
+
+    def read_temperatures(self):
+        """ Returns the latest reading of every sensor (0 if there is none yet) and its age in ms"""
+        now = time.monotonic()
+        return [(reading, int((now - read_at) * 1000)) if reading is not None else (0.0, 0)
+                for reading, read_at in zip(self.readings, self.read_at)]
+
+    def read_analog_pins(self):
+        return [min(1023, max(0, int(round(value + random.gauss(0, self.noise))))) if self.noise else value
+                for value in self.analog_values]
+
+    def send_all_info(self):
+        # Every dump is a keyframe unless delta reporting is on
+        if not self.keyframe_interval or self.dumps_since_keyframe >= self.keyframe_interval:
+            self.keyframe = True
+        if self.keyframe:
+            self.dumps_since_keyframe = 0
+        self.dumps_since_keyframe += 1
+
+        if self.binary_mode:
+            self.send_binary_frame()
+        else:
+            self.send_text_dump()
+        self.keyframe = False
+        self.dumps_sent += 1
+
+    def report(self, key, value, deadband):
+        """ Returns True if the reading goes in this dump, and remembers it"""
+        if not self.keyframe and key in self.last_reported and abs(value - self.last_reported[key]) <= deadband:
+            return False
+        self.last_reported[key] = value
+        return True
+
+    def send_text_dump(self):
+        lines = []
+        for i, (serial_num, (temperature, age)) in enumerate(zip(self.serials, self.read_temperatures())):
+            # Only include valid temperature readings
+            if temperature > 32 and self.report(serial_num, int(temperature * 100 + 0.5), self.temp_deadband):
+                lines.append("tempsensor:name=Temp{},serial_num={},value={:.2f},units=F,age={}".format(
+                    i, serial_num, temperature, age))
+        for pin_num, value in enumerate(self.read_analog_pins()):
+            if not self.report(('analog', pin_num), value, self.analog_deadband):
+                continue
+            lines.append("analogpin:name=Pin{0},pin_num={0},value={1}".format(pin_num, value))
+        for pin_num in self.digital_pins:
+            if not self.report(('digital', pin_num), self.pin_values[pin_num], 0):
+                continue
+            lines.append("digitalpin:name=Pin{0},pin_num={0},value={1}".format(pin_num, self.pin_values[pin_num]))
+
+        if self.drop_rate and random.random() < self.drop_rate:
+            # Cut the dump off somewhere, losing its end line
+            lines = lines[:random.randrange(len(lines) + 1)]
+        else:
+            lines.append("{}:seq={},ack={},key={}".format(arduino_protocol.END_OF_DUMP,
+                                                          self.dump_sequence % arduino_protocol.SEQUENCE_MODULUS,
+                                                          self.command_sequence, int(self.keyframe)))
+        self.dump_sequence += 1
+        self.send("".join(line + "\r\n" for line in lines).encode())
+
+    def send_binary_frame(self):
+        temps = [(address, int(temperature * 100 + 0.5), age)
+                 for address, (temperature, age) in zip(self.addresses, self.read_temperatures())
+                 if temperature > 32]
+        temps = [(address, hundredths, age) for address, hundredths, age in temps
+                 if self.report(address.hex().upper(), hundredths, self.temp_deadband)]
+        analogs = [(pin_num, value) for pin_num, value in enumerate(self.read_analog_pins())
+                   if self.report(('analog', pin_num), value, self.analog_deadband)]
+        digitals = [(pin_num, self.pin_values[pin_num]) for pin_num in self.digital_pins
+                    if self.report(('digital', pin_num), self.pin_values[pin_num], 0)]
+        frame = arduino_protocol.encode_frame(temps, analogs, digitals, self.command_sequence, self.dump_sequence)
+        self.dump_sequence += 1
+        if self.drop_rate and random.random() < self.drop_rate:
+            return
+        self.send(frame)
+
+    def send_line(self, line):
+        self.send((line + "\r\n").encode())
+
+    def send(self, data):
+        """ Writes to the serial line, taking as long as the real one would"""
+        if self.baudrate:
+            # 10 bits per byte (start, 8 data, stop)
+            time.sleep(len(data) * 10.0 / self.baudrate)
+        os.write(self.master, data)
+        self.bytes_sent += len(data)
+
+
+def serials_from_config(config_file=setup_configuration.CONFIG_FILE):
+    """ Returns the temperature sensor serial numbers listed in a configuration file"""
+    serials = []
+    with open(config_file) as fileobj:
+        for line in fileobj:
+            if line.startswith("TemperatureSensor"):
+                serial_num = line.split(',')[2].strip()
+                if serial_num:
+                    serials.append(serial_num)
+    return serials
+
+
+def sharded_config(config_file, ports):
+    """ Writes a copy of a configuration file with its components dealt out over one board per port.
+
+    Returns the name of the new file and the temperature sensor serial numbers on each board.
+    """
+    boards = ["Board {}".format(i + 1) for i in range(len(ports))]
+    serials = [[] for port in ports]
+    counts = {}
+    lines = ["Board,{},{}\n".format(board, port) for board, port in zip(boards, ports)]
+    with open(config_file) as fileobj:
+        for line in fileobj:
+            split_line = [entry.strip() for entry in line.split(',')]
+            if line.startswith('#') or len(split_line) < 3 or split_line[0] == 'Board':
+                continue
+            i = counts.get(split_line[0], 0) % len(ports)
+            counts[split_line[0]] = i + 1
+            if split_line[0] == 'TemperatureSensor' and split_line[2]:
+                serials[i].append(split_line[2])
+            lines.append(",".join(split_line[:3] + [boards[i]]) + "\n")
+
+    fileobj = tempfile.NamedTemporaryFile('w', suffix='.txt', delete=False)
+    with fileobj:
+        fileobj.writelines(lines)
+    return fileobj.name, serials
+
+
+def benchmark(emulators, config_file, seconds, **control_args):
+    """ Runs one ArdControl per emulator and prints the dump rate they achieve together.
+
+    config_file has to list one board per emulator (see sharded_config).
+    """
+    from ccbc_control import ArdControl
+
+    (ard_shm, ard_dict,
+     tsensor_names, psensor_names,
+     heater_names, pump_names) = setup_configuration.return_configuration(config_file)
+    # One Event per board, set once its ArdControl found the Arduino ready and started its loop
+    ready = {board: Event() for board in ard_dict['boards'].keys()}
+    ard_processes = [ArdControl(ard_dict, board=board, ready=ready[board], **control_args) for board in ready]
+    for ard_process in ard_processes:
+        ard_process.start()
+    try:
+        for board, event in ready.items():
+            if not event.wait(READY_TIMEOUT):
+                raise SystemExit("The ArdControl of {} was not ready within {} s".format(board, READY_TIMEOUT))
+        dumps = sum(emulator.dumps_sent for emulator in emulators)
+        data = sum(emulator.bytes_sent for emulator in emulators)
+        version = ard_dict.version()
+        time.sleep(seconds)
+        dumps = sum(emulator.dumps_sent for emulator in emulators) - dumps
+        data = sum(emulator.bytes_sent for emulator in emulators) - data
+        version = ard_dict.version() - version
+        print("{} board(s): {:.1f} dumps/s, {:.0f} bytes/s, {:.1f} state updates/s over {} s".format(
+            len(emulators), dumps / seconds, data / seconds, version / seconds, seconds))
+    finally:
+        for ard_process in ard_processes:
+            ard_process.terminate()
+        ard_dict.close()
+        ard_dict.unlink()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Emulated Arduino_Control.ino on a pseudo-terminal")
+    parser.add_argument('--config', default=setup_configuration.CONFIG_FILE,
+                        help="configuration file with the temperature sensor serial numbers")
+    parser.add_argument('--temps', type=int, default=None,
+                        help="number of temperature sensors (extra ones get made-up serial numbers)")
+    parser.add_argument('--analog', type=int, default=6, help="number of analog pins")
+    parser.add_argument('--baud', type=int, default=9600, help="serial speed to imitate (0 for full speed)")
+    parser.add_argument('--conversion', type=float, default=0.75, help="seconds per DS18B20 conversion")
+    parser.add_argument('--latency', type=float, default=0.0, help="seconds before answering a '!'")
+    parser.add_argument('--noise', type=float, default=0.0, help="standard deviation of the readings")
+    parser.add_argument('--drop-rate', type=float, default=0.0,
+                        help="chance of cutting off a text dump or losing a binary frame")
+    parser.add_argument('--benchmark', type=float, default=0,
+                        help="run ArdControl against the emulator for this many seconds")
+    parser.add_argument('--text', action='store_true', help="benchmark with the text protocol")
+    parser.add_argument('--stream', type=int, default=0, help="benchmark with streaming every X ms")
+    parser.add_argument('--delta', action='store_true', help="benchmark with delta reporting")
+    parser.add_argument('--boards', type=int, default=1,
+                        help="number of emulated Arduinos to spread the benchmark configuration over")
+    args = parser.parse_args()
+
+    serials = serials_from_config(args.config)
+    if args.temps is not None:
+        serials = serials[:args.temps]
+        while len(serials) < args.temps:
+            serials.append("28{:014X}".format(random.getrandbits(56)))
+
+    emulator_args = dict(analog_pins=args.analog, baudrate=args.baud or None,
+                         conversion_time=args.conversion, latency=args.latency, noise=args.noise,
+                         drop_rate=args.drop_rate)
+
+    if args.benchmark:
+        emulators = [ArduinoEmulator([], **emulator_args) for i in range(args.boards)]
+        config_file, board_serials = sharded_config(args.config, [emulator.port for emulator in emulators])
+        if args.temps is not None and args.boards == 1:
+            board_serials = [serials]
+        for emulator, serials in zip(emulators, board_serials):
+            emulator.set_sensors(serials)
+            emulator.start()
+        try:
+            benchmark(emulators, config_file, args.benchmark,
+                      use_binary=not args.text, stream_interval=args.stream,
+                      delta_reporting=args.delta)
+        finally:
+            os.remove(config_file)
+    else:
+        emulator = ArduinoEmulator(serials, **emulator_args)
+        emulator.start()
+        print("Emulated Arduino on {}".format(emulator.port))
+        while True:
+            time.sleep(60)
+            print("{} dumps, {} bytes, {} pin commands".format(emulator.dumps_sent, emulator.bytes_sent,
+                                                             emulator.pin_commands))
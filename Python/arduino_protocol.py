@@ -0,0 +1,307 @@
+#!/usr/bin/env python3
+
+""" Arduino serial protocol
+
+    Encodes and decodes the compact binary frames sent by Arduino_Control.ino,
+    and parses the plain text protocol (tempsensor:/analogpin:/digitalpin:/end:
+    lines), which is used whenever the Arduino does not acknowledge the binary
+    mode.
+
+    Binary frame layout (little endian):
+        magic           2 bytes   0xCC 0xBC
+        version         uint8
+        temp count      uint8
+        analog count    uint8
+        digital count   uint8
+        command seq     uint16, sequence number of the last command received
+        dump seq        uint16, counts the dumps (text and binary) and wraps at
+                        SEQUENCE_MODULUS, so a lost frame shows as a gap
+        temp entries    8 byte sensor address + int16 temperature in 1/100 F
+                        + uint16 age of the reading in milliseconds
+        analog entries  uint8 pin + uint16 raw reading
+        digital entries uint8 pin + uint8 value (0/1)
+                        (in delta mode, only the readings that changed are sent)
+        crc             uint16, CRC-CCITT (init 0xFFFF) of everything
+                        from version up to the last entry
+
+    """
+
+# Import standard Python modules
+import re
+import struct
+from binascii import crc_hqx, unhexlify
+
+# Import third-party libraries
+
+# Import relative files
+
+# Commands understood by the Arduino to switch protocols and the acknowledgement it sends back
+BINARY_MODE_COMMAND = b'B'
+ASCII_MODE_COMMAND = b'A'
+BINARY_MODE_ACK = b'protocol:binary'
+
+# Line the sketch prints at the end of setup(), once it is ready for commands
+READY_LINE = b'ready'
+
+# Last line of every text dump: "end:seq=X,ack=Y", where X counts up and wraps at SEQUENCE_MODULUS
+# and Y is the sequence number of the last command received (both numbers are in every frame too)
+END_OF_DUMP = 'end'
+SEQUENCE_MODULUS = 65536
+
+# Commands are tagged with a sequence number: "N!" polls, "X=ON@N#" / "X=OFF@N#" switch pin X
+POLL_COMMAND = '!'
+PIN_COMMAND = '#'
+
+# Streaming: "<milliseconds>S" makes the Arduino push its data on its own, "0S" stops it
+STREAM_COMMAND = 'S'
+
+# Delta reporting: "N,T,AD" makes the Arduino only report the readings that moved more than
+# T hundredths of F (temperatures) or A counts (analog pins), with a full report (keyframe)
+# every N dumps. "0D" turns it off, and "K" asks for a keyframe in the next dump.
+DELTA_COMMAND = 'D'
+KEYFRAME_COMMAND = b'K'
+
+FRAME_MAGIC = b'\xcc\xbc'
+FRAME_VERSION = 4
+FRAME_HEADER = struct.Struct('<BBBBHH')
+TEMP_ENTRY = struct.Struct('<8shH')
+ANALOG_ENTRY = struct.Struct('<BH')
+DIGITAL_ENTRY = struct.Struct('<BB')
+FRAME_CRC = struct.Struct('<H')
+CRC_INIT = 0xFFFF
+
+
+# Kinds of records produced by LineParser
+TEMP = 'tempsensor'
+ANALOG = 'analogpin'
+DIGITAL = 'digitalpin'
+END = END_OF_DUMP
+PROTOCOL = 'protocol'
+READY = 'ready'
+
+# Every line of the text protocol. Only the values are captured; which group matched last tells the kind.
+LINE_PATTERN = re.compile(
+    rb'^(?:'
+    rb'tempsensor:name=[^,\r\n]*,serial_num=([0-9A-Fa-f]{16}),value=(-?\d+(?:\.\d*)?)'
+    rb',units=[^,\r\n]*(?:,age=(\d+))?'
+    rb'|analogpin:name=[^,\r\n]*,pin_num=(\d+),value=(\d+)'
+    rb'|digitalpin:name=[^,\r\n]*,pin_num=(\d+),value=(\d+)'
+    rb'|end:seq=(\d+)(?:,ack=(\d+))?(?:,key=(\d))?'
+    rb'|protocol:(\w+)'
+    rb'|(ready)'
+    rb')\r?$', re.MULTILINE)
+
+
+class FrameError(ValueError):
+    """ Raised when a binary frame is truncated or corrupted"""
+    pass
+
+
+def frame_crc(data):
+    """ CRC-CCITT used by the Arduino sketch"""
+    return crc_hqx(data, CRC_INIT)
+
+
+def body_length(header):
+    """ Returns the number of bytes following the header (entries and crc)"""
+    version, temp_count, analog_count, digital_count, command_seq, dump_seq = FRAME_HEADER.unpack_from(header)
+    if version != FRAME_VERSION:
+        raise FrameError("Unsupported frame version {}".format(version))
+    return (temp_count * TEMP_ENTRY.size + analog_count * ANALOG_ENTRY.size +
+            digital_count * DIGITAL_ENTRY.size + FRAME_CRC.size)
+
+
+def decode_frame(frame):
+    """ Decodes a frame (everything after the magic bytes).
+
+    Returns three lists: (address, hundredths of F, age in ms) for the temperature sensors,
+    (pin, raw reading) for the analog pins and (pin, value) for the digital pins,
+    the sequence number of the last command the Arduino received and the dump sequence number.
+    Sensor addresses are read-only memoryviews, which hash and compare like bytes.
+    """
+    # The addresses are only hashable if the view is backed by bytes
+    view = memoryview(frame if isinstance(frame, bytes) else bytes(frame))
+    if len(view) < FRAME_HEADER.size + FRAME_CRC.size:
+        raise FrameError("Frame too short ({} bytes)".format(len(view)))
+    length = FRAME_HEADER.size + body_length(view)
+    if len(view) < length:
+        raise FrameError("Frame truncated ({} of {} bytes)".format(len(view), length))
+
+    crc_offset = length - FRAME_CRC.size
+    if FRAME_CRC.unpack_from(view, crc_offset)[0] != frame_crc(view[:crc_offset]):
+        raise FrameError("Frame CRC mismatch")
+
+    version, temp_count, analog_count, digital_count, command_seq, dump_seq = FRAME_HEADER.unpack_from(view)
+    offset = FRAME_HEADER.size
+
+    temps = []
+    for i in range(temp_count):
+        temps.append((view[offset:offset + 8],) + TEMP_ENTRY.unpack_from(view, offset)[1:])
+        offset += TEMP_ENTRY.size
+
+    end = offset + analog_count * ANALOG_ENTRY.size
+    analogs = list(ANALOG_ENTRY.iter_unpack(view[offset:end]))
+    offset = end
+
+    end = offset + digital_count * DIGITAL_ENTRY.size
+    digitals = list(DIGITAL_ENTRY.iter_unpack(view[offset:end]))
+
+    return temps, analogs, digitals, command_seq, dump_seq
+
+
+def encode_frame(temps, analogs, digitals, command_seq=0, dump_seq=0):
+    """ Builds a complete frame (magic included), the same way the Arduino does.
+
+    temps holds (8 byte address, hundredths of F, age in ms), analogs (pin, raw reading)
+    and digitals (pin, value).
+    """
+    body = bytearray(FRAME_HEADER.pack(FRAME_VERSION, len(temps), len(analogs), len(digitals), command_seq,
+                                       dump_seq % SEQUENCE_MODULUS))
+    for address, hundredths, age in temps:
+        body += TEMP_ENTRY.pack(bytes(address), hundredths, min(age, 0xFFFF))
+    for pin, value in analogs:
+        body += ANALOG_ENTRY.pack(pin, value)
+    for pin, value in digitals:
+        body += DIGITAL_ENTRY.pack(pin, value)
+    body += FRAME_CRC.pack(frame_crc(body))
+    return FRAME_MAGIC + bytes(body)
+
+
+class LineParser(object):
+    """ Parses text lines straight from the bytes received, without decoding them.
+
+    Each complete line becomes a (kind, key, value, extra) tuple:
+        TEMP      8 byte sensor address, degrees F (float), age of the reading in ms (0 if not sent)
+        ANALOG    pin number, raw reading, None
+        DIGITAL   pin number, value (0/1), None
+        END       dump sequence number, sequence number of the last command (None if not sent),
+                  keyframe (1/0, None if not sent)
+        PROTOCOL  None, protocol name (bytes), None
+        READY     None, None, None
+    Lines that do not match are skipped. The bytes of a line still arriving stay in the buffer.
+    """
+
+    def __init__(self):
+        self.buffer = bytearray()
+
+    def feed(self, data):
+        """ Adds received bytes and returns the records of the lines they completed"""
+        buffer = self.buffer
+        buffer += data
+        end = buffer.rfind(b'\n') + 1
+        if not end:
+            return []
+
+        records = []
+        for match in LINE_PATTERN.finditer(buffer, 0, end):
+            last = match.lastindex
+            if last <= 3:
+                serial_num, value, age = match.group(1, 2, 3)
+                records.append((TEMP, unhexlify(serial_num), float(value), int(age) if age else 0))
+            elif last <= 5:
+                records.append((ANALOG, int(match.group(4)), int(match.group(5)), None))
+            elif last <= 7:
+                records.append((DIGITAL, int(match.group(6)), int(match.group(7)), None))
+            elif last <= 10:
+                seq, ack, key = match.group(8, 9, 10)
+                records.append((END, int(seq), int(ack) if ack else None, int(key) if key else None))
+            elif last == 11:
+                records.append((PROTOCOL, None, match.group(11), None))
+            else:
+                records.append((READY, None, None, None))
+        del buffer[:end]
+        return records
+
+
+class FrameAssembler(object):
+    """ Splits bytes received in arbitrary pieces into complete binary frames.
+
+    The frames are returned without their magic bytes, ready for decode_frame.
+    """
+
+    def __init__(self):
+        self.buffer = bytearray()
+
+    def feed(self, data):
+        """ Adds received bytes and returns the frames they completed"""
+        self.buffer += data
+        frames = []
+        header_end = len(FRAME_MAGIC) + FRAME_HEADER.size
+        while True:
+            start = self.buffer.find(FRAME_MAGIC)
+            if start < 0:
+                # Keep the last byte; it may be the first half of the next magic
+                del self.buffer[:-1]
+                break
+            del self.buffer[:start]
+            if len(self.buffer) < header_end:
+                break
+            try:
+                length = header_end + body_length(self.buffer[len(FRAME_MAGIC):header_end])
+            except FrameError:
+                # Not a real frame start; look for the next one
+                del self.buffer[:len(FRAME_MAGIC)]
+                continue
+            if len(self.buffer) < length:
+                break
+            frames.append(bytes(self.buffer[len(FRAME_MAGIC):length]))
+            del self.buffer[:length]
+        return frames
+
+
+def stream_command(interval_ms):
+    """ Returns the command asking the Arduino to push its data every interval_ms"""
+    return "{}{}".format(int(interval_ms), STREAM_COMMAND).encode()
+
+
+def delta_command(keyframe_interval, temp_deadband, analog_deadband):
+    """ Returns the command turning on delta reporting (temp_deadband is in degrees F)"""
+    return "{},{},{}{}".format(int(keyframe_interval), int(round(temp_deadband * 100)),
+                               int(analog_deadband), DELTA_COMMAND).encode()
+
+
+def probe_command(seq):
+    """ Returns the command checking that the Arduino answers, which first puts it back
+    in its default modes (text lines, no streaming, no delta reporting)
+    """
+    return (ASCII_MODE_COMMAND + stream_command(0) + "0{}".format(DELTA_COMMAND).encode() +
+            poll_command(seq))
+
+
+def poll_command(seq):
+    """ Returns the command asking the Arduino for all of its data"""
+    return "{}{}".format(seq, POLL_COMMAND).encode()
+
+
+def pin_command(pin_num, status, seq):
+    """ Returns the command switching a digital pin ON or OFF"""
+    return "{}={}@{}{}".format(pin_num, status, seq, PIN_COMMAND).encode()
+
+
+def next_sequence(seq):
+    """ Returns the sequence number following seq"""
+    return (seq + 1) % SEQUENCE_MODULUS
+
+
+def sequence_reached(latest, seq):
+    """ Returns True if seq is latest or older, allowing for the wrap around"""
+    return (latest - seq) % SEQUENCE_MODULUS < SEQUENCE_MODULUS // 2
+
+
+def serial_to_address(serial_num):
+    """ Converts a serial number string (e.g. 28FF4A7780160477) to the 8 address bytes"""
+    try:
+        address = bytes.fromhex(serial_num)
+    except ValueError:
+        return None
+    if len(address) != 8:
+        return None
+    return address
+
+
+if __name__ == "__main__":
+    frame = encode_frame([(serial_to_address('28FF4A7780160477'), 15250, 420)],
+                         [(0, 512)],
+                         [(5, 1)],
+                         command_seq=17, dump_seq=42)
+    print(len(frame), decode_frame(frame[len(FRAME_MAGIC):]))
@@ -0,0 +1,289 @@
+#!/usr/bin/python3
+
+""" Brewery Control on an asyncio event loop
+
+    Same job as ArdControl (read the Arduino, check the setpoints, switch
+    the pins), but everything runs as coroutines on one event loop in the
+    control process:
+
+    1) The serial port is non-blocking and the event loop calls us back
+       when bytes arrive, so an idle brewery uses next to no CPU.
+    2) Polls, setpoint checks and pin writes are coroutines instead of
+       a busy loop, a lock and helper threads.
+    3) Optionally, a small HTTP server on the same loop answers status
+       requests (GET /status or /ccbc.json) with JSON.
+
+    """
+
+# Import the python libraries needed
+import asyncio
+import json
+import os
+
+import serial
+
+from ccbc_control import ArdControl, SerialWriter, coalesce_commands
+import arduino_protocol
+
+
+class AsyncSerialWriter(object):
+    """ Event loop version of the SerialWriter thread.
+
+    Has the same request_data/set_pin/request_keyframe interface, so
+    ArdControl.check_pins and request_arduino_data work unchanged. Writes go
+    straight to the non-blocking file descriptor of the port: what it cannot
+    take right away is kept and written by the event loop once it can, and
+    the commands queued meanwhile are coalesced into the next write.
+    """
+
+    def __init__(self, ser, loop):
+        self.ser = ser
+        self.loop = loop
+        self.fd = ser.fileno()
+        os.set_blocking(self.fd, False)
+        self.commands = asyncio.Queue()
+        # Bytes the port could not take yet, and an Event set while there are none
+        self.buffer = bytearray()
+        self.drained = asyncio.Event()
+        self.drained.set()
+
+    def request_data(self, seq):
+        """ Queues a request for all of the Arduino data"""
+        self.commands.put_nowait((SerialWriter.POLL, seq))
+
+    def set_pin(self, pin_num, status, seq):
+        """ Queues a command to turn a digital pin ON or OFF"""
+        self.commands.put_nowait((SerialWriter.PIN, (pin_num, status, seq)))
+
+    def request_keyframe(self):
+        """ Queues a request for every reading in the next dump (delta reporting)"""
+        self.commands.put_nowait((SerialWriter.KEYFRAME, None))
+
+    def send(self, msg):
+        """ Writes raw bytes right away (protocol and streaming commands)"""
+        self.write(msg)
+
+    def write(self, msg):
+        """ Writes msg without blocking; the rest goes out from on_writable"""
+        if not self.buffer:
+            try:
+                sent = os.write(self.fd, msg)
+            except BlockingIOError:
+                sent = 0
+            except OSError as e:
+                print("Could not write to the Arduino: {}".format(e))
+                return
+            msg = msg[sent:]
+            if not msg:
+                return
+            self.drained.clear()
+            self.loop.add_writer(self.fd, self.on_writable)
+        self.buffer += msg
+
+    def on_writable(self):
+        """ Called by the event loop when the serial port can take more bytes"""
+        try:
+            sent = os.write(self.fd, self.buffer)
+        except BlockingIOError:
+            return
+        except OSError as e:
+            print("Could not write to the Arduino: {}".format(e))
+            sent = len(self.buffer)
+        del self.buffer[:sent]
+        if not self.buffer:
+            self.loop.remove_writer(self.fd)
+            self.drained.set()
+
+    async def run(self):
+        """ Writes whatever was queued, coalesced into one write"""
+        while True:
+            pending = [await self.commands.get()]
+            # Let the port take the last write first; what is queued meanwhile goes out together
+            await self.drained.wait()
+            while not self.commands.empty():
+                pending.append(self.commands.get_nowait())
+            msg = coalesce_commands(pending)
+            if msg:
+                self.write(msg)
+
+
+class AsyncArdControl(ArdControl):
+    """ ArdControl running on an asyncio event loop.
+
+    poll_interval is the pause (seconds) between the end of one cycle and the next
+    poll. status_address is an optional (host, port) for the HTTP status server.
+    """
+
+    # Longest wait (seconds) for a dump before the setpoints are checked anyway
+    DUMP_TIMEOUT = 1.0
+    # Longest wait (seconds) for the Arduino to acknowledge the binary protocol
+    NEGOTIATION_TIMEOUT = 0.5
+
+    def __init__(self, ard_data, serial_port=None, use_binary=True, stream_interval=0, board=None,
+                 delta_reporting=False, poll_interval=0.0, status_address=None, ready=None, heartbeats=None):
+        ArdControl.__init__(self, ard_data, serial_port, use_binary, stream_interval, board, delta_reporting,
+                            ready=ready, heartbeats=heartbeats)
+        self.poll_interval = poll_interval
+        self.status_address = status_address
+        # Reads never block; the event loop tells us when there is data
+        self.ser.timeout = 0
+        self.loop = None
+        self.frames = None
+        self.dump_received = None
+        self.protocol_ack = None
+        self.arduino_ready = None
+
+    def run(self):
+        """ Opens the serial port and runs the event loop forever"""
+        asyncio.run(self.main())
+
+    async def main(self):
+        self.loop = asyncio.get_running_loop()
+        self.frames = arduino_protocol.FrameAssembler()
+        self.dump_received = asyncio.Event()
+        self.protocol_ack = asyncio.Event()
+        self.arduino_ready = asyncio.Event()
+
+        self.startSerial()
+        self.writer = AsyncSerialWriter(self.ser, self.loop)
+        self.loop.add_reader(self.ser.fileno(), self.on_serial_readable)
+        if not await self.wait_for_arduino_async():
+            # Exits with an error, so a supervisor treats it as a failed start
+            raise SystemExit(1)
+        await self.negotiate_protocol_async()
+        if self.delta_reporting:
+            self.writer.send(arduino_protocol.delta_command(self.KEYFRAME_INTERVAL, self.TEMP_DEADBAND,
+                                                            self.ANALOG_DEADBAND))
+        if self.stream_interval:
+            self.writer.send(arduino_protocol.stream_command(self.stream_interval))
+
+        if self.heartbeats is not None:
+            # A cycle ends with a dump or after DUMP_TIMEOUT, then waits poll_interval
+            self.heartbeat = self.heartbeats.heartbeat(self.name, period=self.DUMP_TIMEOUT + self.poll_interval)
+        if self.ready is not None:
+            self.ready.set()
+
+        tasks = [self.writer.run(), self.control_loop()]
+        if self.status_address is not None:
+            server = await asyncio.start_server(self.handle_status_request, *self.status_address)
+            tasks.append(server.serve_forever())
+        await asyncio.gather(*tasks)
+
+    async def wait_for_arduino_async(self):
+        """ Same as ArdControl.wait_for_arduino, with on_serial_readable spotting the answer"""
+        start = self.loop.time()
+        while self.loop.time() - start < self.STARTUP_TIMEOUT:
+            try:
+                await asyncio.wait_for(self.arduino_ready.wait(), self.PROBE_INTERVAL)
+            except asyncio.TimeoutError:
+                self.writer.send(arduino_protocol.probe_command(self.next_command_seq()))
+                continue
+            print("Arduino on {} ready after {:.1f} s".format(self.SERIAL_PORT, self.loop.time() - start))
+            return True
+
+        print("Arduino on {} did not answer within {} s".format(self.SERIAL_PORT, self.STARTUP_TIMEOUT))
+        return False
+
+    async def negotiate_protocol_async(self):
+        """ Asks the Arduino for binary frames and falls back to text lines if it does not answer"""
+        self.binary_protocol = False
+        if self.use_binary:
+            self.writer.send(arduino_protocol.BINARY_MODE_COMMAND)
+            try:
+                await asyncio.wait_for(self.protocol_ack.wait(), self.NEGOTIATION_TIMEOUT)
+            except asyncio.TimeoutError:
+                pass
+
+        print("Arduino protocol: {}".format("binary" if self.binary_protocol else "text"))
+
+    def on_serial_readable(self):
+        """ Called by the event loop when the serial port has data"""
+        try:
+            data = self.ser.read(self.ser.in_waiting or 1)
+        except serial.SerialException as e:
+            print("Could not read from the Arduino: {}".format(e))
+            return
+
+        if self.binary_protocol:
+            for frame in self.frames.feed(data):
+                self.process_binary_frame(frame)
+                self.dump_received.set()
+            return
+
+        if arduino_protocol.FRAME_MAGIC in data and not self.arduino_ready.is_set():
+            # Still streaming frames for a previous process: it is running, so probe it now
+            self.writer.send(arduino_protocol.probe_command(self.next_command_seq()))
+
+        records = self.line_parser.feed(data)
+        if not records:
+            return
+        self.process_records(records)
+        for kind, key, value, extra in records:
+            if kind == arduino_protocol.PROTOCOL and value == b'binary':
+                self.binary_protocol = True
+                self.protocol_ack.set()
+            if kind == arduino_protocol.END:
+                self.dump_received.set()
+            if kind in (arduino_protocol.READY, arduino_protocol.END):
+                self.arduino_ready.set()
+
+    async def control_loop(self):
+        """ Polls the Arduino (unless it streams) and checks the setpoints after every dump"""
+        while True:
+            cycle_start = self.loop.time()
+            self.dump_received.clear()
+            if not self.stream_interval:
+                # Only asks again once the last request has been answered
+                self.poll_arduino()
+            try:
+                await asyncio.wait_for(self.dump_received.wait(), self.DUMP_TIMEOUT)
+            except asyncio.TimeoutError:
+                pass
+
+            # Pick up any new settings from the GUI
+            self.sync_from_state()
+
+            # Check setpoints against all controllers
+            self.check_setpoints()
+
+            # Queue any new commands as necessary
+            self.check_pins()
+
+            # Publish the results of this cycle
+            self.sync_to_state()
+            self.publish_heartbeat(self.loop.time() - cycle_start)
+
+            if self.poll_interval:
+                await asyncio.sleep(self.poll_interval)
+
+    def status(self):
+        """ Returns the information served on /status"""
+        return {'board': self.board,
+                'protocol': "binary" if self.binary_protocol else "text",
+                'dropped_dumps': self.dropped_dumps,
+                'partial_dumps': self.partial_dumps,
+                'keyframes_requested': self.keyframes_requested,
+                'heartbeats': self.heartbeats.read() if self.heartbeats is not None else {},
+                'brewery': self.ard_data.snapshot()}
+
+    async def handle_status_request(self, reader, writer):
+        """ Answers a single HTTP request with JSON"""
+        request_line = await reader.readline()
+        # Skip the headers
+        while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+            pass
+
+        parts = request_line.decode('latin-1').split()
+        path = parts[1] if len(parts) > 1 else '/'
+        if path in ('/', '/status'):
+            status, body = '200 OK', self.status()
+        elif path == '/ccbc.json':
+            status, body = '200 OK', self.ard_data.snapshot()
+        else:
+            status, body = '404 Not Found', {'error': 'not found'}
+
+        body = json.dumps(body).encode()
+        writer.write("HTTP/1.0 {}\r\nContent-Type: application/json\r\nContent-Length: {}\r\n\r\n".format(
+            status, len(body)).encode() + body)
+        await writer.drain()
+        writer.close()
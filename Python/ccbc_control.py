@@ -19,33 +19,224 @@ import io
 import os
 import time
 import serial
+from collections import deque
+from queue import Queue, Empty
 from threading import Thread, Lock
 from multiprocessing import Process
 from multiprocessing.pool import ThreadPool
 
+from components import build_components
+import arduino_protocol
+from scheduler import FixedRateScheduler
+from setpoints import setpoint_checker
 
-class Worker(Thread):
-    def __init__(self, t, *args):
-        Thread.__init__(self, target=t, args=args)
-        self.start()
+
+class SerialWriter(Thread):
+    """ Long-lived thread that does every write to the Arduino once the control loop runs.
+
+    Poll requests and pin commands are queued with their sequence numbers.
+    Whatever piled up since the last write is coalesced (one poll request,
+    the latest status of each pin) and sent with a single write() call, pin
+    commands first so the next dump already shows them.
+    """
+
+    POLL = 'poll'
+    PIN = 'pin'
+    KEYFRAME = 'keyframe'
+
+    def __init__(self, ser, lock):
+        Thread.__init__(self, daemon=True)
+        self.ser = ser
+        self.lock = lock
+        self.commands = Queue()
+
+    def request_data(self, seq):
+        """ Queues a request for all of the Arduino data"""
+        self.commands.put((self.POLL, seq))
+
+    def set_pin(self, pin_num, status, seq):
+        """ Queues a command to turn a digital pin ON or OFF"""
+        self.commands.put((self.PIN, (pin_num, status, seq)))
+
+    def request_keyframe(self):
+        """ Queues a request for every reading in the next dump (delta reporting)"""
+        self.commands.put((self.KEYFRAME, None))
+
+    def stop(self):
+        """ Ends the thread after the commands already queued are written"""
+        self.commands.put(None)
+
+    def run(self):
+        running = True
+        while running:
+            pending = [self.commands.get()]
+            # Take everything else that is already waiting
+            while True:
+                try:
+                    pending.append(self.commands.get_nowait())
+                except Empty:
+                    break
+            if None in pending:
+                running = False
+
+            msg = self.build_message(pending)
+            if msg:
+                try:
+                    with self.lock:
+                        self.ser.write(msg)
+                except serial.SerialException as e:
+                    print("Could not write to the Arduino: {}".format(e))
+
+    def build_message(self, pending):
+        """ Coalesces the queued commands into the bytes of one write"""
+        return coalesce_commands(pending)
+
+
+def coalesce_commands(pending):
+    """ Turns a list of queued (kind, value) commands into the bytes of one write.
+
+    Only the latest status of each pin is kept, and any number of poll requests
+    become a single poll command at the end. The poll carries the newest sequence
+    number of the batch, so the sequence numbers go up along the write and the
+    answer to the poll acknowledges everything in it. A keyframe request goes
+    first. None entries are ignored.
+    """
+    pins = {}
+    poll = False
+    keyframe = False
+    last_seq = None
+    for command in pending:
+        if command is None:
+            continue
+        kind, value = command
+        if kind == SerialWriter.POLL:
+            poll = True
+            last_seq = value
+        elif kind == SerialWriter.KEYFRAME:
+            keyframe = True
+        else:
+            pin_num, status, last_seq = value
+            # Move the pin to the end, in the order of the sequence numbers
+            pins.pop(pin_num, None)
+            pins[pin_num] = (status, last_seq)
+
+    msg = b"".join(arduino_protocol.pin_command(pin_num, status, seq)
+                   for pin_num, (status, seq) in pins.items())
+    if keyframe:
+        msg = arduino_protocol.KEYFRAME_COMMAND + msg
+    if poll:
+        msg += arduino_protocol.poll_command(last_seq)
+    return msg
 
 
 class ArdControl(Process):
-    """ Class which will read and process arduino data and issue commands when needed"""
+    """ Class which will read and process arduino data and issue commands when needed
+
+    Every process talks to one Arduino board (the first one in the configuration
+    unless board is given). It reads and controls only the components wired to
+    that board, but sees the values of all of them through ard_data, so a heater
+    can be controlled by a temperature sensor on another board.
+    """
 
     # TODO: Create function that will return all of the data to be displayed in GUI
 
-    def __init__(self, ard_data, serial_port='/dev/ttyACM0'):
-        Process.__init__(self)
+    def __init__(self, ard_data, serial_port=None, use_binary=True, stream_interval=0, board=None,
+                 delta_reporting=False, control_period=0.1, ready=None, heartbeats=None):
+        if board is None:
+            board = next(iter(ard_data['boards'].keys()))
+        Process.__init__(self, name="ArdControl {}".format(board))
+        self.board = board
+        if serial_port is None:
+            serial_port = ard_data['boards'][board]['serial_port']
         self.SERIAL_PORT = serial_port
+        # Try to switch the Arduino to the binary frames when the port opens
+        self.use_binary = use_binary
+        self.binary_protocol = False
+        # When above zero (milliseconds), the Arduino pushes its data on its own and
+        # a reader thread applies it as it arrives instead of polling every cycle
+        self.stream_interval = stream_interval
+        self.reader = None
+        # When set, the Arduino only reports the readings that moved more than the deadbands,
+        # with every reading (a keyframe) every KEYFRAME_INTERVAL dumps or when one is lost
+        self.delta_reporting = delta_reporting
+        self.KEYFRAME_INTERVAL = 20
+        self.TEMP_DEADBAND = 0.1
+        self.ANALOG_DEADBAND = 2
+        self.keyframes_requested = 0
+        # Created when the process runs; does all of the writes from then on
+        self.writer = None
+        # Sequence number of the last complete text dump, and counts of the lost ones
+        self.last_dump_seq = None
+        self.dropped_dumps = 0
+        self.partial_dumps = 0
+        # Lines of the text dump being received, and the parser holding the start of a line still arriving
+        self.dump_lines = 0
+        self.line_parser = arduino_protocol.LineParser()
+        # Same for the binary frames
+        self.frame_assembler = arduino_protocol.FrameAssembler()
+        self.received_frames = deque()
+        # Sequence number of the last command sent, and of the last one the Arduino echoed back
+        self.command_seq = 0
+        self.acked_seq = None
+        # Poll waiting for its answer (sequence number, time sent) and
+        # pin commands waiting to show up in a dump {pin: (status, sequence number, time sent)}
+        self.poll_seq = None
+        self.poll_time = 0.0
+        self.pending_pins = {}
+        # Running average (seconds) of the time a poll takes to be answered, None until one is
+        self.response_time = None
         self.BAUDRATE = 9600
         self.TIMEOUT = 0.05
-        self.ARD_RETURNALL = b'!'
+        # Longest wait (seconds) for the Arduino to echo a command before it counts as lost
+        self.RESPONSE_TIMEOUT = 3.0
+        # Once polls have been answered, one counts as lost after this many times the usual
+        # response time (but no less than MIN_POLL_TIMEOUT), so a lost dump does not stop
+        # the polling for the whole RESPONSE_TIMEOUT. RESPONSE_WEIGHT is the weight of the
+        # latest response in the average.
+        self.POLL_TIMEOUT_RESPONSES = 4
+        self.MIN_POLL_TIMEOUT = 0.1
+        self.RESPONSE_WEIGHT = 0.2
         self.WRITETIMEOUT = 0.25
+        # Longest wait (seconds) for the Arduino to be ready after opening the port, and the time
+        # between probes when it does not say so; long enough to leave the bootloader alone
+        self.STARTUP_TIMEOUT = 10.0
+        self.PROBE_INTERVAL = 2.0
+        # Optional multiprocessing Event, set once the Arduino is ready and the control loop starts
+        self.ready = ready
+        # Optional Heartbeats block to publish the cycle times to, and when the Arduino last sent data
+        self.heartbeats = heartbeats
+        self.heartbeat = None
+        self.last_data_time = None
+        # The control loop runs once every CONTROL_PERIOD seconds; a cycle that overruns skips
+        # the ticks it missed instead of making the next ones run back to back
+        self.CONTROL_PERIOD = control_period
+        self.scheduler = FixedRateScheduler(self.CONTROL_PERIOD)
         self.lock = Lock()
         self.ard_data = ard_data
+        # Native representation of the brewery inside the control process.
+        # Kept in sync with ard_data at the start and end of every cycle.
+        self.components = build_components(ard_data)
+        self.state_subscription = ard_data.subscribe()
+        self.pin_controllers = None
+        self.sync_from_state()
+        # Every sensor can be read, but only the heaters and pumps on this board are controlled
+        self.tempsensors = self.components['tempsensors']
+        self.presssensors = self.components['presssensors']
+        self.heaters = {name: heater for name, heater in self.components['heaters'].items()
+                        if self.owns(heater)}
+        self.pumps = {name: pump for name, pump in self.components['pumps'].items()
+                      if self.owns(pump)}
+        # Checks the heaters and pumps when their inputs change: a plain loop for a brewery's
+        # worth of them, NumPy arrays for hundreds (see setpoints.setpoint_checker)
+        self.setpoints = setpoint_checker(self.heaters.values(), self.pumps.values(),
+                                          self.tempsensors, self.presssensors)
+        self.owned = [component for records in self.components.values()
+                      for component in records.values() if self.owns(component)]
         self.digital_pin_status = {}
         self.update_digital_pin_dict()
+        # Pins whose wanted or reported status may have changed, for check_pins
+        self.pins_to_check = set()
+        self.update_pin_controllers()
         self.ser = serial.Serial(baudrate=self.BAUDRATE,
                                  timeout=self.TIMEOUT,
                                  write_timeout=self.WRITETIMEOUT)
@@ -53,38 +244,248 @@ class ArdControl(Process):
     def update_digital_pin_dict(self):
         """ Parses through the heaters and pumps and assigns the key/value pairs to the dict"""
 
-        for heater in self.ard_data['heaters'].keys():
-            pin_num = self.ard_data['heaters'][heater]['pin_num']
-            status = self.ard_data['heaters'][heater]['status']
-            self.digital_pin_status[pin_num] = status
+        for heater in self.heaters.values():
+            self.digital_pin_status[heater.pin_num] = heater.status
+
+        for pump in self.pumps.values():
+            self.digital_pin_status[pump.pin_num] = pump.status
 
-        for pump in self.ard_data['pumps'].keys():
-            pin_num = self.ard_data['pumps'][pump]['pin_num']
-            status = self.ard_data['pumps'][pump]['status']
+    def update_pin_controllers(self):
+        """ Maps the digital pins to the heaters and pumps on them, and has all of them checked"""
+        self.pin_controllers = {controller.pin_num: controller
+                                for controller in list(self.heaters.values()) + list(self.pumps.values())}
+        self.pins_to_check.update(self.pin_controllers)
+
+    def set_digital_pin(self, pin_num, status):
+        """ Stores the status of a digital pin reported by the Arduino"""
+        if self.digital_pin_status.get(pin_num) != status:
             self.digital_pin_status[pin_num] = status
+            self.pins_to_check.add(pin_num)
+
+    def owns(self, component):
+        """ Returns True if the component is wired to this process's board"""
+        return component.board == self.board
+
+    def sync_from_state(self):
+        """ Copies the user settings that changed in ard_data into the components.
+
+        The first call loads every value, including the last known outputs.
+        Later calls also load the outputs of the components on other boards.
+        """
+        first_sync = self.state_subscription.cursor == 0
+        changes = self.state_subscription.poll()
+        settings_changed = False
+        for category, records in changes.items():
+            if category not in self.components:
+                continue
+            for name, fields in records.items():
+                component = self.components[category][name]
+                if first_sync or not self.owns(component):
+                    component.load(fields)
+                elif component.apply_settings(fields):
+                    settings_changed = True
+        if settings_changed and self.pin_controllers is not None:
+            # A heater or pump may have moved to another pin
+            self.update_pin_controllers()
+
+    def sync_to_state(self):
+        """ Publishes the outputs of this board's components to ard_data as one change"""
+        with self.ard_data.batch():
+            for component in self.owned:
+                component.store(self.ard_data)
 
     def startSerial(self):
         """ Opens the serial port to the Arduino"""
         self.ser.setPort(self.SERIAL_PORT)
         self.ser.open()
 
-    def return_serial_lines(self):
-        ard_lines = []
+    def wait_for_arduino(self):
+        """ Waits until the Arduino is ready for commands. Returns False if it never answered.
+
+        Opening the port resets most Arduinos, and the sketch prints READY_LINE at the
+        end of setup(). One that did not reset (e.g. after this process is restarted)
+        is probed every PROBE_INTERVAL instead, or at once if it is still sending the
+        binary frames of a previous process; the probe also puts it back in its
+        default modes.
+        """
+        start = time.monotonic()
+        next_probe = start + self.PROBE_INTERVAL
+        parser = arduino_protocol.LineParser()
+        with self.lock:
+            while time.monotonic() - start < self.STARTUP_TIMEOUT:
+                data = self.ser.read(self.ser.in_waiting or 1)
+                records = parser.feed(data)
+                if any(record[0] in (arduino_protocol.READY, arduino_protocol.END) for record in records):
+                    print("Arduino on {} ready after {:.1f} s".format(self.SERIAL_PORT, time.monotonic() - start))
+                    return True
+                if arduino_protocol.FRAME_MAGIC in data and next_probe > time.monotonic() + self.TIMEOUT:
+                    # It is running, not in the bootloader
+                    next_probe = time.monotonic()
+                if time.monotonic() >= next_probe:
+                    self.ser.write(arduino_protocol.probe_command(self.next_command_seq()))
+                    next_probe += self.PROBE_INTERVAL
+
+        print("Arduino on {} did not answer within {} s".format(self.SERIAL_PORT, self.STARTUP_TIMEOUT))
+        return False
+
+    def negotiate_protocol(self):
+        """ Asks the Arduino for binary frames and falls back to text lines if it does not answer"""
+        self.binary_protocol = False
+        if not self.use_binary:
+            return
 
         with self.lock:
+            self.ser.reset_input_buffer()
+            self.ser.write(arduino_protocol.BINARY_MODE_COMMAND)
             for line in self.ser.readlines():
-                ard_lines.append(line.strip().decode('utf-8'))
+                if line.strip() == arduino_protocol.BINARY_MODE_ACK:
+                    self.binary_protocol = True
 
-        return ard_lines
+        print("Arduino protocol: {}".format("binary" if self.binary_protocol else "text"))
 
-    def request_arduino_data(self):
-        """ Sends a command to the Arduino to provide all data"""
+    def start_delta_reporting(self):
+        """ Tells the Arduino to only report the readings that changed"""
+        with self.lock:
+            self.ser.write(arduino_protocol.delta_command(self.KEYFRAME_INTERVAL, self.TEMP_DEADBAND,
+                                                          self.ANALOG_DEADBAND))
 
-        # Send a command to request arduino data
+    def request_keyframe(self):
+        """ Asks for every reading in the next dump, after a delta may have been lost"""
+        if not self.delta_reporting or self.writer is None:
+            return
+        self.keyframes_requested += 1
+        self.writer.request_keyframe()
+
+    def return_serial_frame(self):
+        """ Reads one binary frame from the serial port. Returns None if none arrived.
+
+        Reads do not take the serial lock; only one thread reads at a time and
+        the writer thread must be free to send the poll request meanwhile.
+        The part of a frame that is still arriving is kept for the next call.
+        """
+        while not self.received_frames:
+            data = self.ser.read(self.ser.in_waiting or 1)
+            if not data:
+                return None
+            self.received_frames.extend(self.frame_assembler.feed(data))
+        return self.received_frames.popleft()
+
+    def return_serial_records(self, deadline=None):
+        """ Reads the lines of one dump, parsed into records (see arduino_protocol.LineParser).
+
+        Stops as soon as the end-of-dump line arrives, or early when the serial port
+        stays quiet or the deadline (time.monotonic) passes; the rest of the dump is
+        read on the next call, including the start of a line that was cut in two.
+        """
+        records = []
+
+        while deadline is None or time.monotonic() < deadline:
+            data = self.ser.read(self.ser.in_waiting or 1)
+            if not data:
+                break
+            new_records = self.line_parser.feed(data)
+            records += new_records
+            if any(record[0] == arduino_protocol.END for record in new_records):
+                break
+
+        return records
+
+    def start_streaming(self):
+        """ Tells the Arduino to push its data and starts the reader thread"""
         with self.lock:
-            self.ser.write(self.ARD_RETURNALL)
+            self.ser.write(arduino_protocol.stream_command(self.stream_interval))
+        self.reader = Thread(target=self.read_stream, daemon=True)
+        self.reader.start()
+
+    def read_stream(self):
+        """ Reader thread: applies the Arduino data as soon as it arrives.
 
-    def read_arduino_data_and_format_dictionary(self):
+        It is the only reader of the serial port while streaming.
+        """
+        while True:
+            if self.binary_protocol:
+                frame = self.return_serial_frame()
+                if frame is None:
+                    continue
+                self.process_binary_frame(frame)
+            else:
+                # Parse the lines completed by whatever bytes are waiting
+                records = self.line_parser.feed(self.ser.read(self.ser.in_waiting or 1))
+                if not records:
+                    continue
+                self.process_records(records)
+
+    def next_command_seq(self):
+        """ Returns the sequence number for a new command"""
+        self.command_seq = arduino_protocol.next_sequence(self.command_seq)
+        return self.command_seq
+
+    def request_arduino_data(self):
+        """ Sends a command to the Arduino to provide all data. Returns its sequence number.
+
+        While streaming, this gives an on-demand refresh; the reader thread handles the answer.
+        """
+
+        # Send a command to request arduino data
+        seq = self.next_command_seq()
+        if self.writer is not None:
+            self.writer.request_data(seq)
+        else:
+            with self.lock:
+                self.ser.write(arduino_protocol.poll_command(seq))
+        return seq
+
+    def poll_arduino(self):
+        """ Requests the Arduino data, unless the answer to the last request is still on its way"""
+        if self.poll_seq is None:
+            self.poll_seq = self.request_arduino_data()
+            self.poll_time = time.monotonic()
+
+    def poll_timeout(self):
+        """ Returns how long (seconds) to wait for the answer to a poll before asking again"""
+        if self.response_time is None:
+            return self.RESPONSE_TIMEOUT
+        return min(self.RESPONSE_TIMEOUT,
+                   max(self.MIN_POLL_TIMEOUT, self.POLL_TIMEOUT_RESPONSES * self.response_time))
+
+    def check_acks(self):
+        """ Forgets the poll and pin commands the Arduino has echoed back.
+
+        Pin commands that are not echoed within RESPONSE_TIMEOUT, and polls not
+        answered within poll_timeout(), are given up on, so they are sent again.
+        """
+        now = time.monotonic()
+        acked = self.acked_seq
+
+        for pin_num, (status, seq, sent) in list(self.pending_pins.items()):
+            if acked is not None and arduino_protocol.sequence_reached(acked, seq):
+                del self.pending_pins[pin_num]
+                self.pins_to_check.add(pin_num)
+            elif now - sent > self.RESPONSE_TIMEOUT:
+                print("Arduino never confirmed pin {} {}".format(pin_num, status))
+                del self.pending_pins[pin_num]
+                self.pins_to_check.add(pin_num)
+
+        if self.poll_seq is None:
+            return
+        if acked is not None and arduino_protocol.sequence_reached(acked, self.poll_seq):
+            response_time = now - self.poll_time
+            if self.response_time is None:
+                self.response_time = response_time
+            else:
+                self.response_time += self.RESPONSE_WEIGHT * (response_time - self.response_time)
+            self.poll_seq = None
+        elif now - self.poll_time > self.poll_timeout():
+            if self.dump_lines:
+                # The rest of the dump (and its end line) never came
+                self.partial_dumps += 1
+                print("Partial Arduino dump ({} lines)".format(self.dump_lines))
+                self.dump_lines = 0
+                self.request_keyframe()
+            print("Arduino never answered request #{}".format(self.poll_seq))
+            self.poll_seq = None
+
+    def read_arduino_data_and_format_dictionary(self, deadline=None):
         """ Read incoming serial data from Arduino serial and return string.
 
         The python script reads in the data in (variablename=value) pairs.
@@ -105,189 +506,196 @@ class ArdControl(Process):
         three, where the third input is the status (ON or OFF)
         For each variable, there will be a pound sign (#) between each input.
         After each variable, there will be one comma.
-        """
-
-        # Use a thread to issue command to the serial port
-        Worker(self.request_arduino_data)
 
-        # Use another thread to receive all of the serial data
-        arduino_lines = self.return_serial_lines()
-
-        if arduino_lines:
-            for line in arduino_lines:
-                self.arduinoLineToDictionary(line)
-
-    def arduinoLineToDictionary(self, line):
-        """ Takes a line of data from the Arduino and puts it into the dictionary"""
-
-        # Temperatures have the following syntax:
-        # name=TempX,serial_num=blahblah,value=50,units=F
-
-        # Analog pin outputs have the following syntax:
-        # analogpin:name=PinX,pin_num=X,value=val
-
-        # Digital pins have the following syntax:
-        # digitalpin:name=PinX,pin_num=X,value=val
-
-        # For the temperature sensors, it has to find the serial number, then populate the
-        # Temperature value in the ard_dictionary
-
-        # For the pressure sensors, it has to find an analog pin_num, then match that to the one in the ard_dictionary
-
-        # For the heaters and pumps, it has to find a digital pin_num, then match that to the one in the ard_dictionary
-
-        # Split the serial read text by colons to get the type of data and the data itself
-        serial_read_input_list = line.split(":")
+        Reading stops at the deadline (time.monotonic), if given; a dump still
+        arriving is finished in the next cycle.
+        """
 
+        # The writer thread issues the command while this thread waits for the answer
+        self.poll_arduino()
+
+        # Receive the serial data until the answer to the request is in, or the port goes quiet.
+        # Dumps answering older requests are applied on the way.
+        while self.poll_seq is not None:
+            if deadline is not None and time.monotonic() >= deadline:
+                break
+            if self.binary_protocol:
+                frame = self.return_serial_frame()
+                if frame is None:
+                    break
+                self.process_binary_frame(frame)
+            else:
+                records = self.return_serial_records(deadline)
+                if not records:
+                    break
+                self.process_records(records)
+            self.check_acks()
+
+    def process_records(self, records):
+        """ Puts the records parsed from the Arduino text lines into the components.
+
+        The records come from arduino_protocol.LineParser, which matches the received bytes directly.
+        """
+        index = self.ard_data.sensor_index
+        index.refresh()
+        for kind, key, value, extra in records:
+            if kind == arduino_protocol.TEMP:
+                tname = index.by_address.get(key)
+                if tname is not None and self.owns(self.tempsensors[tname]):
+                    self.tempsensors[tname].update_reading(value, extra / 1000.0)
+            elif kind == arduino_protocol.ANALOG:
+                pname = index.by_pin.get((self.board, key))
+                if pname is not None:
+                    self.presssensors[pname].update_voltage(float(value))
+            elif kind == arduino_protocol.DIGITAL:
+                self.set_digital_pin(key, "ON" if value == 1 else "OFF")
+            elif kind == arduino_protocol.END:
+                self.end_of_dump(key, value)
+                continue
+            else:
+                continue
+            self.dump_lines += 1
+
+    def end_of_dump(self, seq, ack):
+        """ Handles the sequence numbers ending a dump, from the end line or a binary frame
+        (ack is None if the sketch does not send it)
+        """
+        self.dump_lines = 0
+        self.last_data_time = time.monotonic()
+        # Sketches that do not echo the commands have handled all of them by now
+        self.acked_seq = ack if ack is not None else self.command_seq
+
+        if self.last_dump_seq is not None:
+            missed = (seq - self.last_dump_seq - 1) % arduino_protocol.SEQUENCE_MODULUS
+            if missed:
+                self.dropped_dumps += missed
+                print("Missed {} Arduino dump(s) before #{}".format(missed, seq))
+                self.request_keyframe()
+        self.last_dump_seq = seq
+
+    def process_binary_frame(self, frame):
+        """ Processes a binary frame from the Arduino (see arduino_protocol)
+
+        In delta mode the frame only holds the readings that changed; the others keep their values.
+        """
         try:
-            # First entry is the type, the rest is the data
-            type_of_data = serial_read_input_list[0]
-            data = serial_read_input_list[1]
-        except:
+            temps, analogs, digitals, command_seq, dump_seq = arduino_protocol.decode_frame(frame)
+        except arduino_protocol.FrameError as e:
+            print("Discarding Arduino frame: {}".format(e))
+            self.request_keyframe()
             return
 
-        if type_of_data == "tempsensor":
-            self.process_temp_data(data)
+        index = self.ard_data.sensor_index
+        index.refresh()
+        for address, hundredths, age in temps:
+            tname = index.by_address.get(address)
+            if tname is not None and self.owns(self.tempsensors[tname]):
+                self.tempsensors[tname].update_reading(hundredths / 100.0, age / 1000.0)
 
-        if type_of_data == "analogpin":
-            self.process_pressure_data(data)
+        for pin_num, value in analogs:
+            pname = index.by_pin.get((self.board, pin_num))
+            if pname is not None:
+                self.presssensors[pname].update_voltage(float(value))
 
-        if type_of_data == "digitalpin":
-            self.process_heater_pump_data(data)
+        for pin_num, value in digitals:
+            self.set_digital_pin(pin_num, "ON" if value == 1 else "OFF")
 
-    def process_temp_data(self, data):
-        """ processes a tempsensor line from the Arduino"""
-
-        # Temperatures have the following syntax:
-        # name=TempX,serial_num=blahblah,value=50,units=F
-        sensor_details = data.split(',')
-        serial_num = sensor_details[1].split('=')[1]
-        value = sensor_details[2].split('=')[1]
-
-        # ard_data has the following syntax
-        # self.ard_data['tempsensors'][t.name]['serial_num']
-
-        for tname in self.ard_data['tempsensors'].keys():
-            if self.ard_data['tempsensors'][tname]['serial_num'] == serial_num:
-                self.ard_data['tempsensors'][tname]['value'] = value
-
-    def process_pressure_data(self, data):
-        """ Process a presssensor line from the Arduino"""
-
-        # Analog pin outputs have the following syntax:
-        # name=PinX,pin_num=X,value=val
-        sensor_details = data.split(',')
-        # Pin number must be an integer; voltage is a float
-        pin_num = int(sensor_details[1].split('=')[1])
-        voltage = float(sensor_details[2].split('=')[1])
-
-        # ard data has the following syntax:
-        # self.ard_data['presssensors'][pname]
-
-        for pname in self.ard_data['presssensors'].keys():
-            if self.ard_data['presssensors'][pname]['pin_num'] == pin_num:
-                # Use the pressure sensor slope and intercept to calculate psi
-                pressure = (voltage * self.ard_data['presssensors'][pname]['volts_to_pressure_slope'] +
-                            self.ard_data['presssensors'][pname]['volts_to_pressure_intercept'])
-                self.ard_data['presssensors'][pname]['voltage'] = voltage
-                self.ard_data['presssensors'][pname]['pressure'] = pressure
-
-    def process_heater_pump_data(self, data):
-        """ Processes a digital output line from the Arduino"""
-
-        # Digital outputs have the following syntax:
-        # name=PinX,pin_num=X,value=val, where val is 0/1 for OFF/ON
-        sensor_details = data.split(',')
-        pin_num = int(sensor_details[1].split('=')[1])
-        value = sensor_details[2].split('=')[1]
-        status = "OFF"
-        if int(value) == 1:
-            status = "ON"
-
-        # Store the status of the d pins in a dictionary
-        self.digital_pin_status[pin_num] = status
+        # Same checks as the end line of a text dump; a gap asks for a keyframe
+        self.end_of_dump(dump_seq, command_seq)
 
     def check_setpoints(self):
         # TODO: Can possibly put this in the CCBC Brains
-        """ Looks at each heater and attached temperature sensor and determines pin status."""
-        for heater in self.ard_data['heaters'].keys():
-            current_temp = float(self.ard_data['tempsensors'][self.ard_data['heaters'][heater]['tsensor_name']]['value'])
-
-            # Assign the pin_status the previous value from the previous iteration
-            pin_status = self.ard_data['heaters'][heater]['status']
-
-            if current_temp > self.ard_data['heaters'][heater]['upper limit']:
-                pin_status = 'OFF'
-
-            if current_temp < self.ard_data['heaters'][heater]['lower limit']:
-                pin_status = 'ON'
+        """ Looks at each heater and attached temperature sensor and determines pin status.
 
-            if current_temp >= self.ard_data['heaters'][heater]['maxtemp']:
-                pin_status = 'OFF'
-
-            self.ard_data['heaters'][heater]['status'] = pin_status
-
-        for pump in self.ard_data['pumps'].keys():
-            pressure = float(self.ard_data['presssensors'][self.ard_data['pumps'][pump]['psensor_name']]['pressure'])
-            gallons = float(pressure * self.ard_data['pumps'][pump]['psi_to_gal_slope'] +
-                            self.ard_data['pumps'][pump]['psi_to_gal_intercept'])
-            self.ard_data['pumps'][pump]['gallons'] = gallons
-
-            # Assign the pin status the previous value from the previous cycle
-            pin_status = self.ard_data['pumps'][pump]['status']
-
-            if gallons > self.ard_data['pumps'][pump]['upper limit']:
-                # Turn the pump off when the setpoint is above the setpoint
-                pin_status = 'OFF'
-                # TODO: Account for solenoid valve control when available
-
-            if gallons < self.ard_data['pumps'][pump]['lower limit']:
-                pin_status = 'ON'
-
-            self.ard_data['pumps'][pump]['status'] = pin_status
+        Nothing is checked unless a sensor or setting changed (see setpoints). The pins
+        of the heaters and pumps that changed their minds are left for check_pins.
+        """
+        for controller in self.setpoints.check_setpoints():
+            self.pins_to_check.add(controller.pin_num)
 
     def check_pins(self):
-        # Read the status of every digital pin input in ard_data
-        for heater in self.ard_data['heaters'].keys():
-            pin_num = int(self.ard_data['heaters'][heater]['pin_num'])
-            status = self.ard_data['heaters'][heater]['status']
-            # Check against the value in the digital pin status dict
-            if self.digital_pin_status[pin_num] != status:
-                # Issue a command to be what is in the ard_data dict
-                msg = "{}={}#".format(pin_num, status)
-                with self.lock:
-                    self.ser.write(msg.encode())
-
-        for pump in self.ard_data['pumps'].keys():
-            pin_num = int(self.ard_data['pumps'][pump]['pin_num'])
-            status = self.ard_data['pumps'][pump]['status']
-            # Check against the value in the digital pin status dict
-            if self.digital_pin_status[pin_num] != status:
-                # Issue a command to be what is in the ard_data dict
-                msg = "{}={}#".format(pin_num, status)
-                with self.lock:
-                    self.ser.write(msg.encode())
+        """ Issues commands for the pins whose status differs from their heater or pump.
+
+        Only looks at the pins that may have changed: the controller changed its
+        mind, the Arduino reported something new, or a command was confirmed or given up.
+        """
+        self.check_acks()
+        # Emptied one pin at a time, so the reader thread can keep adding to it
+        while self.pins_to_check:
+            controller = self.pin_controllers.get(self.pins_to_check.pop())
+            if controller is None:
+                continue
+            # Check against the command still on its way, or else the value in the digital pin status dict
+            pending = self.pending_pins.get(controller.pin_num)
+            if pending is not None:
+                pin_status = pending[0]
+            else:
+                # None for a pin the Arduino has not reported yet (e.g. a heater moved to it)
+                pin_status = self.digital_pin_status.get(controller.pin_num)
+            if pin_status != controller.status:
+                # Issue a command to be what is in the component
+                seq = self.next_command_seq()
+                self.writer.set_pin(controller.pin_num, controller.status, seq)
+                self.pending_pins[controller.pin_num] = (controller.status, seq, time.monotonic())
+
+    def publish_heartbeat(self, duration):
+        """ Publishes the time the last cycle took, and when the Arduino last sent data"""
+        if self.heartbeat is None:
+            return
+        if self.last_data_time is not None:
+            self.heartbeat.data_received(self.last_data_time)
+        self.heartbeat.beat(duration)
 
     def run(self):
         """ Opens the serial port and begins reading the arduino data"""
         self.startSerial()
-        # Wait about five seconds before doing anything
-        time.sleep(5)
+        if not self.wait_for_arduino():
+            # Exits with an error, so a supervisor treats it as a failed start
+            raise SystemExit(1)
+        self.negotiate_protocol()
+        if self.delta_reporting:
+            self.start_delta_reporting()
+        self.writer = SerialWriter(self.ser, self.lock)
+        self.writer.start()
+        if self.stream_interval:
+            self.start_streaming()
+        if self.heartbeats is not None:
+            self.heartbeat = self.heartbeats.heartbeat(self.name, period=self.CONTROL_PERIOD)
+        if self.ready is not None:
+            self.ready.set()
         while True:
+            # Sleep until the next cycle is due
+            self.scheduler.tick()
+            if self.scheduler.cycles:
+                self.publish_heartbeat(self.scheduler.last_duration)
+
+            # Pick up any new settings from the GUI
+            self.sync_from_state()
+
             # Check setpoints against all controllers
             self.check_setpoints()
 
             # Issue any new commands as necessary
             self.check_pins()
 
-            # Receive the latest Arduino data and process into dictionary
-            self.read_arduino_data_and_format_dictionary()
+            if not self.stream_interval:
+                # Receive the latest Arduino data and process into the components.
+                # While streaming, the reader thread keeps the components up to date instead.
+                self.read_arduino_data_and_format_dictionary(self.scheduler.next_deadline())
+                # Ask for the next dump now, so it arrives while waiting for the next cycle
+                self.poll_arduino()
 
-            # Clean all of the arduino stuff to avoid incorrect inputs
-            with self.lock:
-                self.ser.reset_output_buffer()
-            with self.lock:
-                self.ser.reset_input_buffer()
+            # Publish the results of this cycle
+            self.sync_to_state()
+
+
+def board_controls(ard_data, control_class=ArdControl, **kwargs):
+    """ Returns one control process per Arduino board in ard_data.
+
+    Each board gets its own process (serial port, reader and writer threads),
+    so a slow or unplugged board does not hold up the others.
+    """
+    return [control_class(ard_data, board=board, **kwargs) for board in ard_data['boards'].keys()]
 
 
 class CCBC_Brains:
@@ -347,40 +755,26 @@ class CCBC_Brains:
                 sensor_serial = hw_sensor.returnSerial()
             except:
                 return
-            # Look through the entries in the dictionary
-            try:
-                for sensor_type, sensor_entries in self.ard_dictionary.items():
-                    for name, sensor_dict in sensor_entries.items():
-                        # Within each entry, look at the name and value
-                        for attribute, value in sensor_dict.items():
-                            # If the serial number value matches the one in the 
-                            # hw_sensor, then update the hw_sensor value
-                            if value == sensor_serial:
-                                hw_sensor.cur_temp = sensor_dict['value']
-            except:
-                return
+            # Find the entry in the dictionary with the same serial number
+            # and update the hw_sensor value
+            tname = self.ard_dictionary.sensor_index.tempsensor(sensor_serial)
+            if tname is not None:
+                hw_sensor.cur_temp = self.ard_dictionary['tempsensors'][tname]['value']
 
     def updatePresSensorValues(self):
         """ Cycle through the pressure sensors and update their values"""
 
-        # TODO: Update the logic to account for new method of using ard_dictionary
-
         # Look through each pressure sensor
         for hw_sensor in self.p_sensors:
             # Grab the analog pin number for sensor
             try:
-                sensor_pin_num = str(hw_sensor.pin_num)
-            except:
-                return
-            # Look through entries in dictionary and try to find a match
-            try:
-                for sensor_type, sensor_entries in self.ard_dictionary.items():
-                    if sensor_type == "analogpin":
-                        for name, sensor_dict in sensor_entries.items():
-                            if sensor_dict['pin_num'] == sensor_pin_num:
-                                hw_sensor.update_voltage_and_pressure(float(sensor_dict['value']))
+                sensor_pin_num = int(hw_sensor.pin_num)
             except:
                 return
+            # Find the entry in the dictionary on the same pin
+            pname = self.ard_dictionary.sensor_index.presssensor(sensor_pin_num)
+            if pname is not None:
+                hw_sensor.update_voltage_and_pressure(self.ard_dictionary['presssensors'][pname]['voltage'])
 
     def updateHeaterControllers(self):
         """ Make heaters send their commands, if applicable."""
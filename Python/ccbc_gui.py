@@ -3,17 +3,22 @@
 # Import Python standard libraries
 import sys
 import os
+import time
 from datetime import datetime
 import csv
 
 # Import third-party packages
 import numpy as np
 from PyQt5 import QtWidgets, QtCore
-from PyQt5.QtCore import QThread, QTime, QTimer, QRunnable, pyqtSlot, QThreadPool, QDateTime
+from PyQt5.QtCore import QThread, QTime, QTimer, QRunnable, pyqtSlot, QDateTime, QObject, pyqtSignal
 from PyQt5.QtWidgets import QMainWindow, QLCDNumber
 
 # Import local project modules
 from theGUI import Ui_MainWindow
+from shared_state import merge_changes, freeze_changes
+from setpoint_schedule import SetpointSchedule, SetpointProfile, parse_row
+from heartbeat import timed, summarize_heartbeats
+from widget_bindings import Binding, BindingTable
 
 # TODO: Have the GUI have some sort of table where the user can put in the heater/pump setpoints as a function of time
 # TODO: Create a universal brew time to work with the tables. Include ability to pause
@@ -28,7 +33,7 @@ class Logger(object):
         refresh_rate is in milliseconds (defaults to every five minutes)
     """
 
-    def __init__(self, ard_dict, refresh_rate=5000, filename=1):
+    def __init__(self, ard_dict, refresh_rate=5000, filename=1, heartbeat=None):
         self.filepath = os.path.join('.',
                                      'logs',
                                      datetime.today().strftime('%m-%d-%Y')
@@ -37,6 +42,8 @@ class Logger(object):
 
         self.refresh_rate = refresh_rate
         self.paused = False
+        # Optional Heartbeat timing every update
+        self.heartbeat = heartbeat
 
         # Timer used to refresh the data
         self.timer = QTimer()
@@ -45,6 +52,10 @@ class Logger(object):
         # Shared arduino dictionary with all of the brewery data
         self.ard_dict = ard_dict
 
+        # Local copy of the brewery data, kept up to date from the change feed
+        self.subscription = ard_dict.subscribe(ard_dict.version())
+        self.data = ard_dict.snapshot()
+
         # If a unique name was not given for the file, then assume a number.
         # To avoid overwriting an existing file:
         self.filename = filename
@@ -54,9 +65,8 @@ class Logger(object):
         self.full_path = os.path.join(self.filepath, self.filename)
 
         # Store the fieldnames for csv file writing
-        self.fieldnames = [name for ardtype in ard_dict.keys()
-                           for name in ard_dict[ardtype].keys()
-                           if ardtype is not "heaters"]  # Currently ignoring heaters
+        self.fieldnames = [name for ardtype in ('tempsensors', 'presssensors', 'pumps')
+                           for name in ard_dict[ardtype].keys()]  # Currently ignoring heaters
         self.fieldnames.insert(0, "Time")
 
         self.starttime = datetime.now()
@@ -72,46 +82,58 @@ class Logger(object):
             writer = csv.DictWriter(csvobj, fieldnames=self.fieldnames)
             writer.writeheader()
 
-    def _update_temp_sensor_data(self):
+    @staticmethod
+    def _update_temp_sensor_data(data):
         """ Return a dictionary of all of the temperature sensor data"""
         temp_sensor_data = {}
-        for tsensor in self.ard_dict['tempsensors'].keys():
-            temp_sensor_data[tsensor] = self.ard_dict['tempsensors'][tsensor]['value']
+        for tsensor in data['tempsensors'].keys():
+            temp_sensor_data[tsensor] = data['tempsensors'][tsensor]['value']
 
         return temp_sensor_data
 
-    def _update_press_sensor_data(self):
+    @staticmethod
+    def _update_press_sensor_data(data):
         """ Return a dictionary of all of the pressure sensor data"""
         press_sensor_data = {}
-        for psensor in self.ard_dict['presssensors'].keys():
-            press_sensor_data[psensor] = self.ard_dict['presssensors'][psensor]['pressure']
+        for psensor in data['presssensors'].keys():
+            press_sensor_data[psensor] = data['presssensors'][psensor]['pressure']
 
         return press_sensor_data
 
-    def _update_volume_data(self):
+    @staticmethod
+    def _update_volume_data(data):
         """ Return a dictionary of all of the volume data"""
         volume_data = {}
-        for pump in self.ard_dict['pumps'].keys():
-            volume_data[pump] = self.ard_dict['pumps'][pump]['gallons']
+        for pump in data['pumps'].keys():
+            volume_data[pump] = data['pumps'][pump]['gallons']
 
         return volume_data
 
     def update(self):
         """ Updates all of the data into the log file"""
-        if self.paused:
-            pass
-        else:
-            all_data = {'Time': str(datetime.now() - self.starttime)}
-            tsensor_data = self._update_temp_sensor_data()
-            psensor_data = self._update_press_sensor_data()
-            volume_data = self._update_volume_data()
+        # Beats while paused too, so it does not look stuck
+        with timed(self.heartbeat):
+            if not self.paused:
+                self._write_row()
 
-            for data in [tsensor_data, psensor_data, volume_data]:
-                all_data.update(data)
+    def _write_row(self):
+        """ Logs a new row, every refresh whether or not the data changed, so the rows stay evenly spaced.
+
+        Only the changes since the last row are read from the shared state.
+        """
+        snapshot = merge_changes(self.data, self.subscription.poll())
 
-            with open(self.full_path, 'a', newline='') as csvobj:
-                writer = csv.DictWriter(csvobj, fieldnames=self.fieldnames)
-                writer.writerow(all_data)
+        all_data = {'Time': str(datetime.now() - self.starttime)}
+        tsensor_data = self._update_temp_sensor_data(snapshot)
+        psensor_data = self._update_press_sensor_data(snapshot)
+        volume_data = self._update_volume_data(snapshot)
+
+        for data in [tsensor_data, psensor_data, volume_data]:
+            all_data.update(data)
+
+        with open(self.full_path, 'a', newline='') as csvobj:
+            writer = csv.DictWriter(csvobj, fieldnames=self.fieldnames)
+            writer.writerow(all_data)
 
     def _check_for_unique_filename(self):
         """ Prevents overwriting an existing file"""
@@ -198,10 +220,42 @@ class Worker(QRunnable):
         self.fn(*self.args, **self.kwargs)
 
 
+class StateFetcher(QObject):
+    """ Reads the brewery data for the GUI, in its own thread.
+
+    fetch() polls the change feed, which may wait on the state lock, and emits
+    fetched(snapshot, changes). Both are read-only copies (see freeze_changes),
+    so the GUI thread can use them while the next fetch is running. A fetch
+    that fails emits failed(message) instead, so every fetch gets an answer.
+    """
+
+    fetched = pyqtSignal(object, object)
+    failed = pyqtSignal(str)
+
+    def __init__(self, ard_dictionary):
+        super(StateFetcher, self).__init__()
+        self.subscription = ard_dictionary.subscribe()
+        self.snapshot = freeze_changes(None, {})
+
+    @pyqtSlot()
+    def fetch(self):
+        try:
+            changes = freeze_changes(None, self.subscription.poll())
+        except Exception as e:
+            self.failed.emit("Could not read the brewery data: {}".format(e))
+            return
+        if changes:
+            self.snapshot = freeze_changes(self.snapshot, changes)
+        self.fetched.emit(self.snapshot, changes)
+
+
 class ccbcGUI(QMainWindow, Ui_MainWindow):
     # TODO: Make generalized dictionary look up that includes exception handling
 
-    def __init__(self, ard_dictionary, tsensor_names, psensor_names, heater_names, pump_names):
+    # Asks the StateFetcher thread for the latest data
+    fetch_requested = pyqtSignal()
+
+    def __init__(self, ard_dictionary, tsensor_names, psensor_names, heater_names, pump_names, heartbeats=None):
         super(self.__class__, self).__init__()
         self.setupUi(self)
         self.ard_dictionary = ard_dictionary
@@ -209,9 +263,31 @@ class ccbcGUI(QMainWindow, Ui_MainWindow):
         self.psensor_names = psensor_names
         self.heater_names = heater_names
         self.pump_names = pump_names
-        self.thread = QThread()
-        self.threadpool = QThreadPool()
-        self.logger = Logger(self.ard_dictionary)
+        # The brewery data is read in self.fetch_thread and shown here, on the GUI thread.
+        # A refresh due while the last one is still being read is dropped.
+        self.fetch_thread = QThread()
+        self.fetcher = StateFetcher(self.ard_dictionary)
+        self.fetcher.moveToThread(self.fetch_thread)
+        self.fetch_requested.connect(self.fetcher.fetch)
+        self.fetcher.fetched.connect(self.update_labels)
+        self.fetcher.failed.connect(self.fetch_failed)
+        self.fetch_in_flight = False
+        self.fetch_requested_at = 0.0
+        # Latest data read by the fetcher, for the GUI thread to read without taking the state lock
+        self.data = self.fetcher.snapshot
+        self.dropped_refreshes = 0
+        # Optional Heartbeats block: the GUI and logger publish theirs, and the ones of the
+        # control processes are shown in the status bar, with the sensors they feed marked stale
+        self.heartbeats = heartbeats
+        self.heartbeat = None
+        logger_heartbeat = None
+        if heartbeats is not None:
+            self.heartbeat = heartbeats.heartbeat("GUI", period=0.25)
+            logger_heartbeat = heartbeats.heartbeat("Logger", period=30.0)
+        self.stale_labels = set()
+        self.heartbeat_timer = QTimer()
+        self.heartbeat_timer.timeout.connect(self.update_process_status)
+        self.logger = Logger(self.ard_dictionary, heartbeat=logger_heartbeat)
         self.logger_timer = QTimer()
         self.CBHeater1TSensor.addItems(tsensor_names)
         self.CBHeater2TSensor.addItems(tsensor_names)
@@ -225,12 +301,6 @@ class ccbcGUI(QMainWindow, Ui_MainWindow):
         self.CBPump1PSensor.currentIndexChanged.connect(self.update_pump1_psensor)
         self.CBPump2PSensor.currentIndexChanged.connect(self.update_pump2_psensor)
         self.CBPump3PSensor.currentIndexChanged.connect(self.update_pump3_psensor)
-        self.LabelHeater1TSensor.setText('Controlling Temperature Sensor: {}'.format(
-            self.ard_dictionary['heaters'][heater_names[0]]['tsensor_name']))
-        self.LabelHeater2TSensor.setText('Controlling Temperature Sensor: {}'.format(
-            self.ard_dictionary['heaters'][heater_names[1]]['tsensor_name']))
-        self.LabelHeater3TSensor.setText('Controlling Temperature Sensor: {}'.format(
-            self.ard_dictionary['heaters'][heater_names[2]]['tsensor_name']))
         self.Button_startSerial.clicked.connect(self.start_everything)
         self.ButtonUpdateHeater1Setpoints.clicked.connect(self.update_heater1_setpoint)
         self.ButtonUpdateHeater2Setpoints.clicked.connect(self.update_heater2_setpoint)
@@ -244,8 +314,17 @@ class ccbcGUI(QMainWindow, Ui_MainWindow):
         self.ButtonUpdatePump1VolCalcInputs.clicked.connect(self.update_pump1_vol_calc_inputs)
         self.ButtonUpdatePump2VolCalcInputs.clicked.connect(self.update_pump2_vol_calc_inputs)
         self.ButtonUpdatePump3VolCalcInputs.clicked.connect(self.update_pump3_vol_calc_inputs)
+        # Timed setpoints from the heater tables
+        self.setpoint_schedule = SetpointSchedule(self.ard_dictionary)
+        self.Heater1Setpoints.itemChanged.connect(self.heater1_table_setpoint)
+        self.Heater2Setpoints.itemChanged.connect(self.heater2_table_setpoint)
+        self.Heater3Setpoints.itemChanged.connect(self.heater3_table_setpoint)
+        self.Heater1TableAddRowButton.clicked.connect(self.add_heater1_table_row)
+        self.Heater2TableAddRowButton.clicked.connect(self.add_heater2_table_row)
+        self.Heater3TableAddRowButton.clicked.connect(self.add_heater3_table_row)
+        # What every live label shows; update_labels only sets the texts that change
+        self.label_bindings = BindingTable(self.dynamic_bindings())
         self.update_static_labels()
-        self.update_labels()
         self.label_timer = QTimer()
         self.Clock = Clock(parent=self.centralwidget)
         self.Clock.setGeometry(QtCore.QRect(840, 10, 161, 61))
@@ -253,17 +332,41 @@ class ccbcGUI(QMainWindow, Ui_MainWindow):
         self.BrewingTime = BrewingTime(parent=self.centralwidget)
         self.BrewingTime.setGeometry(QtCore.QRect(840, 60, 161, 61))
         self.BrewingTimeWidget.setObjectName("BrewingTime")
+        # Runs right after the brew time counts up
+        self.BrewingTime.timer.timeout.connect(self.check_table_setpoints)
         self.start_time_edit.setDateTime(QDateTime.currentDateTime())
         self.PausePushButton.clicked.connect(self.pause_or_resume_brew_time)
         self.StartNowButton.clicked.connect(self.start_brew_time)
         self.show()
+        self.fetch_thread.start()
         self.start_everything()
-        print("Multithreading with maximum {} threads".format(self.threadpool.maxThreadCount()))
 
     def check_table_setpoints(self):
         """ This routine looks up the setpoint tables and updates the values accordingly
+
+        The schedule only does any work when the brew time reaches its next change.
         """
-        pass
+        if self.BrewingTime.active:
+            self.setpoint_schedule.tick(self.BrewingTime.brew_time)
+
+    def update_table_setpoint(self, table, heater_name):
+        """ Compiles a heater setpoint table into its profile. Rows that are incomplete or not numbers are skipped"""
+        points = []
+        for row in range(table.rowCount()):
+            cells = [table.item(row, column) for column in range(2)]
+            time_text, setpoint_text = [cell.text().strip() if cell is not None else "" for cell in cells]
+            if time_text == "" or setpoint_text == "":
+                continue
+            try:
+                points.append(parse_row(time_text, setpoint_text))
+            except ValueError:
+                print("Skipping row {} of the {} setpoints: {}, {}".format(row + 1, heater_name,
+                                                                         time_text, setpoint_text))
+        self.setpoint_schedule.set_profile(heater_name, SetpointProfile(points))
+
+    def add_table_row(self, table):
+        """ Adds an empty row at the bottom of a setpoint table"""
+        table.insertRow(table.rowCount())
 
     def update_heater1_tsensor(self, i):
         """ Updates the heater 1 sensor to be the name given in the drop down menu"""
@@ -315,9 +418,9 @@ class ccbcGUI(QMainWindow, Ui_MainWindow):
         upper_limit, lower_limit = self.check_component_setpoints(pump_name,
                                                                   upper_limit, lower_limit)
 
-        # Set the values in the ard_dictionary
-        self.ard_dictionary['pumps'][pump_name]['upper limit'] = upper_limit
-        self.ard_dictionary['pumps'][pump_name]['lower limit'] = lower_limit
+        # Set both values in the ard_dictionary at once
+        self.ard_dictionary['pumps'][pump_name].update({'upper limit': upper_limit,
+                                                        'lower limit': lower_limit})
 
         # Clear the inputs
         for setpoint_input in [upper_input_text, lower_input_text]:
@@ -353,8 +456,8 @@ class ccbcGUI(QMainWindow, Ui_MainWindow):
         else:
             intercept = float(intercept)
 
-        self.ard_dictionary['pumps'][pump_name]['psi_to_gal_slope'] = round(slope, 2)
-        self.ard_dictionary['pumps'][pump_name]['psi_to_gal_intercept'] = round(intercept, 2)
+        self.ard_dictionary['pumps'][pump_name].update({'psi_to_gal_slope': round(slope, 2),
+                                                        'psi_to_gal_intercept': round(intercept, 2)})
 
         # clear the inputs
         for setpoint_input in [slope_obj, intercept_obj]:
@@ -396,9 +499,9 @@ class ccbcGUI(QMainWindow, Ui_MainWindow):
         upper_limit, lower_limit = self.check_component_setpoints(heater_name,
                                                                   upper_limit, lower_limit)
 
-        # Set the values in the ard_dictionary
-        self.ard_dictionary['heaters'][heater_name]['upper limit'] = float(upper_limit)
-        self.ard_dictionary['heaters'][heater_name]['lower limit'] = float(lower_limit)
+        # Set both values in the ard_dictionary at once
+        self.ard_dictionary['heaters'][heater_name].update({'upper limit': float(upper_limit),
+                                                            'lower limit': float(lower_limit)})
 
         # Clear the inputs
         for setpoint_input in [upper_input_text, lower_input_text]:
@@ -438,189 +541,124 @@ class ccbcGUI(QMainWindow, Ui_MainWindow):
 
     def update_heater1_maxtemp(self):
         setpoint = self.InputHeater1MaxTemp.toPlainText()
-        self.ard_dictionary['heaters'][self.heater_names[0]]['maxtemp'] = setpoint
+        if setpoint != "":
+            self.ard_dictionary['heaters'][self.heater_names[0]]['maxtemp'] = float(setpoint)
         self.InputHeater1MaxTemp.clear()
 
     def update_heater2_maxtemp(self):
         setpoint = self.InputHeater2MaxTemp.toPlainText()
-        self.ard_dictionary['heaters'][self.heater_names[1]]['maxtemp'] = setpoint
+        if setpoint != "":
+            self.ard_dictionary['heaters'][self.heater_names[1]]['maxtemp'] = float(setpoint)
         self.InputHeater2MaxTemp.clear()
 
     def update_heater3_maxtemp(self):
         setpoint = self.InputHeater3MaxTemp.toPlainText()
-        self.ard_dictionary['heaters'][self.heater_names[2]]['maxtemp'] = setpoint
+        if setpoint != "":
+            self.ard_dictionary['heaters'][self.heater_names[2]]['maxtemp'] = float(setpoint)
         self.InputHeater3MaxTemp.clear()
 
+    def static_bindings(self):
+        """ Returns the bindings of the labels that only change with the configuration"""
+        tlabels = [self.LabelT1, self.LabelT2, self.LabelT3, self.LabelT4, self.LabelT5,
+                   self.LabelT6, self.LabelT7, self.LabelT8, self.LabelT9]
+        plabels = [self.LabelPress1, self.LabelPress2, self.LabelPress3, self.LabelPress4]
+        hlabels = [self.LabelH1, self.LabelH2, self.LabelH3]
+        pumplabels = [self.LabelPump1, self.LabelPump2, self.LabelPump3]
+
+        bindings = []
+        for category, names, labels in (('tempsensors', self.tsensor_names, tlabels),
+                                        ('presssensors', self.psensor_names, plabels),
+                                        ('heaters', self.heater_names, hlabels),
+                                        ('pumps', self.pump_names, pumplabels)):
+            bindings += [Binding(label, (category, name, 'name')) for name, label in zip(names, labels)]
+        return bindings
+
+    def dynamic_bindings(self):
+        """ Returns the bindings of the labels showing the live brewery data"""
+        tlabels = [self.VariableT1, self.VariableT2, self.VariableT3, self.VariableT4, self.VariableT5,
+                   self.VariableT6, self.VariableT7, self.VariableT8, self.VariableT9]
+        plabels = [self.VariablePress1, self.VariablePress2, self.VariablePress3, self.VariablePress4]
+        bindings = [Binding(label, ('tempsensors', name, 'value')) for name, label in zip(self.tsensor_names, tlabels)]
+        bindings += [Binding(label, ('presssensors', name, 'pressure'))
+                     for name, label in zip(self.psensor_names, plabels)]
+
+        # Status page and heater pages
+        heater_widgets = [
+            (self.VariableH1, self.VariableH1SetPoint, self.VariableHeater1Temp, self.VariableHeater1Status,
+             self.VariableHeater1Upper, self.VariableHeater1Lower, self.VariableHeater1MaxTemp,
+             self.LabelHeater1TSensor),
+            (self.VariableH2, self.VariableH2SetPoint, self.VariableHeater2Temp, self.VariableHeater2Status,
+             self.VariableHeater2Upper, self.VariableHeater2Lower, self.VariableHeater2MaxTemp,
+             self.LabelHeater2TSensor),
+            (self.VariableH3, self.VariableH3SetPoint, self.VariableHeater3Temp, self.VariableHeater3Status,
+             self.VariableHeater3Upper, self.VariableHeater3Lower, self.VariableHeater3MaxTemp,
+             self.LabelHeater3TSensor)]
+        for name, (status, setpoint, temp, page_status, upper, lower, maxtemp, tsensor) in zip(self.heater_names,
+                                                                                             heater_widgets):
+            bindings += [Binding(status, ('heaters', name, 'status')),
+                         Binding(setpoint, ('heaters', name, 'upper limit')),
+                         Binding(temp, ('tempsensors', ('heaters', name, 'tsensor_name'), 'value')),
+                         Binding(page_status, ('heaters', name, 'status')),
+                         Binding(upper, ('heaters', name, 'upper limit')),
+                         Binding(lower, ('heaters', name, 'lower limit')),
+                         Binding(maxtemp, ('heaters', name, 'maxtemp')),
+                         Binding(tsensor, ('heaters', name, 'tsensor_name'),
+                                 'Controlling Temperature Sensor: {}'.format)]
+
+        # Status page and pump pages
+        pump_widgets = [
+            (self.VariablePump1, self.VariablePump1Volume, self.LabelPump1Status, self.VariablePump1Upper,
+             self.VariablePump1Lower, self.VariablePump1Pressure, self.VariablePump1VolSlope,
+             self.VariablePump1VolIntercept, self.LabelPump1PSensor),
+            (self.VariablePump2, self.VariablePump2Volume, self.LabelPump2Status, self.VariablePump2Upper,
+             self.VariablePump2Lower, self.VariablePump2Pressure, self.VariablePump2VolSlope,
+             self.VariablePump2VolIntercept, self.LabelPump2PSensor),
+            (self.VariablePump3, self.VariablePump3Volume, self.LabelPump3Status, self.VariablePump3Upper,
+             self.VariablePump3Lower, self.VariablePump3Pressure, self.VariablePump3VolSlope,
+             self.VariablePump3VolIntercept, self.LabelPump3PSensor)]
+        for name, (status, volume, page_status, upper, lower, pressure, slope, intercept,
+                   psensor) in zip(self.pump_names, pump_widgets):
+            bindings += [Binding(status, ('pumps', name, 'status')),
+                         Binding(volume, ('pumps', name, 'gallons')),
+                         Binding(page_status, ('pumps', name, 'status')),
+                         Binding(upper, ('pumps', name, 'upper limit')),
+                         Binding(lower, ('pumps', name, 'lower limit')),
+                         Binding(pressure, ('presssensors', ('pumps', name, 'psensor_name'), 'pressure')),
+                         Binding(slope, ('pumps', name, 'psi_to_gal_slope')),
+                         Binding(intercept, ('pumps', name, 'psi_to_gal_intercept')),
+                         Binding(psensor, ('pumps', name, 'psensor_name'),
+                                 'Controlling Pressure Sensor: {}'.format)]
+        return bindings
+
     def update_static_labels(self):
         # Update the status page text variables
-
-        self.LabelT1.setText(self.ard_dictionary['tempsensors'][self.tsensor_names[0]]['name'])
-        self.LabelT2.setText(self.ard_dictionary['tempsensors'][self.tsensor_names[1]]['name'])
-        self.LabelT3.setText(self.ard_dictionary['tempsensors'][self.tsensor_names[2]]['name'])
-        self.LabelT4.setText(self.ard_dictionary['tempsensors'][self.tsensor_names[3]]['name'])
-        self.LabelT5.setText(self.ard_dictionary['tempsensors'][self.tsensor_names[4]]['name'])
-        self.LabelT6.setText(self.ard_dictionary['tempsensors'][self.tsensor_names[5]]['name'])
-        self.LabelT7.setText(self.ard_dictionary['tempsensors'][self.tsensor_names[6]]['name'])
-        self.LabelT8.setText(self.ard_dictionary['tempsensors'][self.tsensor_names[7]]['name'])
-        self.LabelT9.setText(self.ard_dictionary['tempsensors'][self.tsensor_names[8]]['name'])
-
-        self.LabelPress1.setText(self.ard_dictionary['presssensors'][self.psensor_names[0]]['name'])
-        self.LabelPress2.setText(self.ard_dictionary['presssensors'][self.psensor_names[1]]['name'])
-        self.LabelPress3.setText(self.ard_dictionary['presssensors'][self.psensor_names[2]]['name'])
-        self.LabelPress4.setText(self.ard_dictionary['presssensors'][self.psensor_names[3]]['name'])
-
-        self.VariablePress1.setText(str(self.ard_dictionary['presssensors'][self.psensor_names[0]]['pressure']))
-        self.VariablePress2.setText(str(self.ard_dictionary['presssensors'][self.psensor_names[1]]['pressure']))
-        self.VariablePress3.setText(str(self.ard_dictionary['presssensors'][self.psensor_names[2]]['pressure']))
-        self.VariablePress4.setText(str(self.ard_dictionary['presssensors'][self.psensor_names[3]]['pressure']))
-
-        self.LabelH1.setText(self.ard_dictionary['heaters'][self.heater_names[0]]['name'])
-        self.LabelH2.setText(self.ard_dictionary['heaters'][self.heater_names[1]]['name'])
-        self.LabelH3.setText(self.ard_dictionary['heaters'][self.heater_names[2]]['name'])
-
-        self.VariableH1.setText(self.ard_dictionary['heaters'][self.heater_names[0]]['status'])
-        self.VariableH2.setText(self.ard_dictionary['heaters'][self.heater_names[1]]['status'])
-        self.VariableH3.setText(self.ard_dictionary['heaters'][self.heater_names[2]]['status'])
-
-        self.LabelPump1.setText(self.ard_dictionary['pumps'][self.pump_names[0]]['name'])
-        self.LabelPump2.setText(self.ard_dictionary['pumps'][self.pump_names[1]]['name'])
-        self.LabelPump3.setText(self.ard_dictionary['pumps'][self.pump_names[2]]['name'])
-
-        self.VariablePump1.setText(self.ard_dictionary['pumps'][self.pump_names[0]]['status'])
-        self.VariablePump2.setText(self.ard_dictionary['pumps'][self.pump_names[1]]['status'])
-        self.VariablePump3.setText(self.ard_dictionary['pumps'][self.pump_names[2]]['status'])
-
-        self.VariableH1SetPoint.setText(str(self.ard_dictionary['heaters'][self.heater_names[0]]['upper limit']))
-        self.VariableH2SetPoint.setText(str(self.ard_dictionary['heaters'][self.heater_names[1]]['upper limit']))
-        self.VariableH3SetPoint.setText(str(self.ard_dictionary['heaters'][self.heater_names[2]]['upper limit']))
-
-        # Heater 1 Page
-        self.VariableHeater1Temp.setText(str(((self.ard_dictionary['tempsensors'][self.ard_dictionary['heaters']
-                                         [self.heater_names[0]]['tsensor_name']]['value']))))
-        self.VariableHeater1Status.setText(self.ard_dictionary['heaters'][self.heater_names[0]]['status'])
-        self.VariableHeater1Upper.setText(str(self.ard_dictionary['heaters'][self.heater_names[0]]['upper limit']))
-        self.VariableHeater1Lower.setText(str(self.ard_dictionary['heaters'][self.heater_names[0]]['lower limit']))
-        self.VariableHeater1MaxTemp.setText(str(self.ard_dictionary['heaters'][self.heater_names[0]]['maxtemp']))
-
-        # Heater 2 Page
-        self.VariableHeater2Temp.setText(str(((self.ard_dictionary['tempsensors'][self.ard_dictionary['heaters']
-                                         [self.heater_names[1]]['tsensor_name']]['value']))))
-        self.VariableHeater2Status.setText(self.ard_dictionary['heaters'][self.heater_names[1]]['status'])
-        self.VariableHeater2Upper.setText(str(self.ard_dictionary['heaters'][self.heater_names[1]]['upper limit']))
-        self.VariableHeater2Lower.setText(str(self.ard_dictionary['heaters'][self.heater_names[1]]['lower limit']))
-        self.VariableHeater2MaxTemp.setText(str(self.ard_dictionary['heaters'][self.heater_names[1]]['maxtemp']))
-
-        # Heater 3 Page
-        self.VariableHeater3Temp.setText(str(((self.ard_dictionary['tempsensors'][self.ard_dictionary['heaters']
-                                         [self.heater_names[2]]['tsensor_name']]['value']))))
-        self.VariableHeater3Status.setText(self.ard_dictionary['heaters'][self.heater_names[2]]['status'])
-        self.VariableHeater3Upper.setText(str(self.ard_dictionary['heaters'][self.heater_names[2]]['upper limit']))
-        self.VariableHeater3Lower.setText(str(self.ard_dictionary['heaters'][self.heater_names[2]]['lower limit']))
-        self.VariableHeater3MaxTemp.setText(str(self.ard_dictionary['heaters'][self.heater_names[2]]['maxtemp']))
-
-    def update_labels(self):
-
-        # Utilize the shared ccbc.ard_dictionary to populate these numbers
-        # ccbc.ard_dictionary['tempsensors'][t_sensor.name]['value']
-        self.VariableT1.setText(str(self.ard_dictionary['tempsensors'][self.tsensor_names[0]]['value']))
-        self.VariableT2.setText(str(self.ard_dictionary['tempsensors'][self.tsensor_names[1]]['value']))
-        self.VariableT3.setText(str(self.ard_dictionary['tempsensors'][self.tsensor_names[2]]['value']))
-        self.VariableT4.setText(str(self.ard_dictionary['tempsensors'][self.tsensor_names[3]]['value']))
-        self.VariableT5.setText(str(self.ard_dictionary['tempsensors'][self.tsensor_names[4]]['value']))
-        self.VariableT6.setText(str(self.ard_dictionary['tempsensors'][self.tsensor_names[5]]['value']))
-        self.VariableT7.setText(str(self.ard_dictionary['tempsensors'][self.tsensor_names[6]]['value']))
-        self.VariableT8.setText(str(self.ard_dictionary['tempsensors'][self.tsensor_names[7]]['value']))
-        self.VariableT9.setText(str(self.ard_dictionary['tempsensors'][self.tsensor_names[8]]['value']))
-
-        self.VariablePress1.setText(str(self.ard_dictionary['presssensors'][self.psensor_names[0]]['pressure']))
-        self.VariablePress2.setText(str(self.ard_dictionary['presssensors'][self.psensor_names[1]]['pressure']))
-        self.VariablePress3.setText(str(self.ard_dictionary['presssensors'][self.psensor_names[2]]['pressure']))
-        self.VariablePress4.setText(str(self.ard_dictionary['presssensors'][self.psensor_names[3]]['pressure']))
-
-        self.VariableH1.setText(self.ard_dictionary['heaters'][self.heater_names[0]]['status'])
-        self.VariableH2.setText(self.ard_dictionary['heaters'][self.heater_names[1]]['status'])
-        self.VariableH3.setText(self.ard_dictionary['heaters'][self.heater_names[2]]['status'])
-
-        self.VariablePump1.setText(self.ard_dictionary['pumps'][self.pump_names[0]]['status'])
-        self.VariablePump2.setText(self.ard_dictionary['pumps'][self.pump_names[1]]['status'])
-        self.VariablePump3.setText(self.ard_dictionary['pumps'][self.pump_names[2]]['status'])
-
-        self.VariableH1SetPoint.setText(str(self.ard_dictionary['heaters'][self.heater_names[0]]['upper limit']))
-        self.VariableH2SetPoint.setText(str(self.ard_dictionary['heaters'][self.heater_names[1]]['upper limit']))
-        self.VariableH3SetPoint.setText(str(self.ard_dictionary['heaters'][self.heater_names[2]]['upper limit']))
-
-        # Heater 1 Page
-        self.VariableHeater1Temp.setText(str(((self.ard_dictionary['tempsensors'][self.ard_dictionary['heaters']
-                                         [self.heater_names[0]]['tsensor_name']]['value']))))
-        self.VariableHeater1Status.setText(self.ard_dictionary['heaters'][self.heater_names[0]]['status'])
-        self.VariableHeater1Upper.setText(str(self.ard_dictionary['heaters'][self.heater_names[0]]['upper limit']))
-        self.VariableHeater1Lower.setText(str(self.ard_dictionary['heaters'][self.heater_names[0]]['lower limit']))
-        self.VariableHeater1MaxTemp.setText(str(self.ard_dictionary['heaters'][self.heater_names[0]]['maxtemp']))
-        self.LabelHeater1TSensor.setText('Controlling Temperature Sensor: {}'.format(
-            self.ard_dictionary['heaters'][self.heater_names[0]]['tsensor_name']))
-
-        # Heater 2 Page
-        self.VariableHeater2Temp.setText(str(((self.ard_dictionary['tempsensors'][self.ard_dictionary['heaters']
-                                         [self.heater_names[1]]['tsensor_name']]['value']))))
-        self.VariableHeater2Status.setText(self.ard_dictionary['heaters'][self.heater_names[1]]['status'])
-        self.VariableHeater2Upper.setText(str(self.ard_dictionary['heaters'][self.heater_names[1]]['upper limit']))
-        self.VariableHeater2Lower.setText(str(self.ard_dictionary['heaters'][self.heater_names[1]]['lower limit']))
-        self.VariableHeater2MaxTemp.setText(str(self.ard_dictionary['heaters'][self.heater_names[1]]['maxtemp']))
-        self.LabelHeater2TSensor.setText('Controlling Temperature Sensor: {}'.format(
-            self.ard_dictionary['heaters'][self.heater_names[1]]['tsensor_name']))
-
-        # Heater 3 Page
-        self.VariableHeater3Temp.setText(str(((self.ard_dictionary['tempsensors'][self.ard_dictionary['heaters']
-                                         [self.heater_names[2]]['tsensor_name']]['value']))))
-        self.VariableHeater3Status.setText(self.ard_dictionary['heaters'][self.heater_names[2]]['status'])
-        self.VariableHeater3Upper.setText(str(self.ard_dictionary['heaters'][self.heater_names[2]]['upper limit']))
-        self.VariableHeater3Lower.setText(str(self.ard_dictionary['heaters'][self.heater_names[2]]['lower limit']))
-        self.VariableHeater3MaxTemp.setText(str(self.ard_dictionary['heaters'][self.heater_names[2]]['maxtemp']))
-        self.LabelHeater3TSensor.setText('Controlling Temperature Sensor: {}'.format(
-            self.ard_dictionary['heaters'][self.heater_names[2]]['tsensor_name']))
-
-        # Pump 1 Page
-        self.VariablePump1Volume.setText(str(self.ard_dictionary['pumps'][self.pump_names[0]]['gallons']))
-        self.LabelPump1Status.setText(str(self.ard_dictionary['pumps'][self.pump_names[0]]['status']))
-        self.VariablePump1Upper.setText(str(self.ard_dictionary['pumps'][self.pump_names[0]]['upper limit']))
-        self.VariablePump1Lower.setText(str(self.ard_dictionary['pumps'][self.pump_names[0]]['lower limit']))
-        self.VariablePump1Pressure.setText((str(self.ard_dictionary['presssensors'][self.ard_dictionary['pumps']
-                                            [self.pump_names[0]]['psensor_name']]['pressure'])))
-        self.VariablePump1VolSlope.setText(str(self.ard_dictionary['pumps'][self.pump_names[0]]['psi_to_gal_slope']))
-        self.VariablePump1VolIntercept.setText((str(self.ard_dictionary['pumps']
-                                                    [self.pump_names[0]]['psi_to_gal_intercept'])))
-        self.LabelPump1PSensor.setText('Controlling Pressure Sensor: {}'.format(
-            self.ard_dictionary['pumps'][self.pump_names[0]]['psensor_name']))
-
-        # Pump 2 Page
-        self.VariablePump2Volume.setText(str(self.ard_dictionary['pumps'][self.pump_names[1]]['gallons']))
-        self.LabelPump2Status.setText(str(self.ard_dictionary['pumps'][self.pump_names[1]]['status']))
-        self.VariablePump2Upper.setText(str(self.ard_dictionary['pumps'][self.pump_names[1]]['upper limit']))
-        self.VariablePump2Lower.setText(str(self.ard_dictionary['pumps'][self.pump_names[1]]['lower limit']))
-        self.VariablePump2Pressure.setText((str(self.ard_dictionary['presssensors'][self.ard_dictionary['pumps']
-        [self.pump_names[1]]['psensor_name']]['pressure'])))
-        self.VariablePump2VolSlope.setText(str(self.ard_dictionary['pumps'][self.pump_names[1]]['psi_to_gal_slope']))
-        self.VariablePump2VolIntercept.setText((str(self.ard_dictionary['pumps']
-                                                    [self.pump_names[1]]['psi_to_gal_intercept'])))
-        self.LabelPump2PSensor.setText('Controlling Pressure Sensor: {}'.format(
-            self.ard_dictionary['pumps'][self.pump_names[1]]['psensor_name']))
-
-        # Pump 3 Page
-        self.VariablePump3Volume.setText(str(self.ard_dictionary['pumps'][self.pump_names[2]]['gallons']))
-        self.LabelPump3Status.setText(str(self.ard_dictionary['pumps'][self.pump_names[2]]['status']))
-        self.VariablePump3Upper.setText(str(self.ard_dictionary['pumps'][self.pump_names[2]]['upper limit']))
-        self.VariablePump3Lower.setText(str(self.ard_dictionary['pumps'][self.pump_names[2]]['lower limit']))
-        self.VariablePump3Pressure.setText((str(self.ard_dictionary['presssensors'][self.ard_dictionary['pumps']
-        [self.pump_names[2]]['psensor_name']]['pressure'])))
-        self.VariablePump3VolSlope.setText(str(self.ard_dictionary['pumps'][self.pump_names[2]]['psi_to_gal_slope']))
-        self.VariablePump3VolIntercept.setText((str(self.ard_dictionary['pumps']
-                                                    [self.pump_names[2]]['psi_to_gal_intercept'])))
-        self.LabelPump3PSensor.setText('Controlling Pressure Sensor: {}'.format(
-            self.ard_dictionary['pumps'][self.pump_names[2]]['psensor_name']))
+        data = self.ard_dictionary.snapshot()
+        for widget, text in BindingTable(self.static_bindings()).render(data):
+            widget.setText(text)
+
+    @pyqtSlot(object, object)
+    def update_labels(self, data, changes):
+        """ Shows the data read by the fetcher thread. Only the texts that are different are set"""
+        self.fetch_in_flight = False
+        self.data = data
+        if changes:
+            for widget, text in self.label_bindings.render(data, changes):
+                widget.setText(text)
+        # From the request to the labels showing the data
+        if self.heartbeat is not None:
+            self.heartbeat.beat(time.monotonic() - self.fetch_requested_at)
+
+    @pyqtSlot(str)
+    def fetch_failed(self, message):
+        """ Shows why the fetcher thread could not read the data; the next refresh tries again"""
+        self.fetch_in_flight = False
+        print(message)
+        self.statusbar.showMessage(message)
 
     def start_brew_time(self):
         self.BrewingTime.brew_time = 0
         self.BrewingTime.active = True
+        self.setpoint_schedule.reset()
         self.logger.start()
         self.logger_timer.timeout.connect(self._update_logger)
         self.logger_timer.start(30000)
@@ -635,19 +673,80 @@ class ccbcGUI(QMainWindow, Ui_MainWindow):
             self.BrewingTime.change_status()
             self.PausePushButton.setText("Pause")
 
-    def heater1_table_setpoint(self):
-        pass
+    def heater1_table_setpoint(self, item):
+        self.update_table_setpoint(self.Heater1Setpoints, self.heater_names[0])
+
+    def heater2_table_setpoint(self, item):
+        self.update_table_setpoint(self.Heater2Setpoints, self.heater_names[1])
+
+    def heater3_table_setpoint(self, item):
+        self.update_table_setpoint(self.Heater3Setpoints, self.heater_names[2])
+
+    def add_heater1_table_row(self):
+        self.add_table_row(self.Heater1Setpoints)
+
+    def add_heater2_table_row(self):
+        self.add_table_row(self.Heater2Setpoints)
+
+    def add_heater3_table_row(self):
+        self.add_table_row(self.Heater3Setpoints)
 
     def refresh_dynamic_labels(self):
-        worker = Worker(self.update_labels)
-        self.threadpool.start(worker)
+        """ Asks the fetcher thread for the latest data, unless it is still reading the last one"""
+        if self.fetch_in_flight:
+            self.dropped_refreshes += 1
+            return
+        self.fetch_in_flight = True
+        self.fetch_requested_at = time.monotonic()
+        self.fetch_requested.emit()
+
+    def sensor_labels(self):
+        """ Returns (category, sensor name, label) for the labels showing sensor readings"""
+        tlabels = [self.VariableT1, self.VariableT2, self.VariableT3, self.VariableT4, self.VariableT5,
+                   self.VariableT6, self.VariableT7, self.VariableT8, self.VariableT9]
+        plabels = [self.VariablePress1, self.VariablePress2, self.VariablePress3, self.VariablePress4]
+        return ([('tempsensors', name, label) for name, label in zip(self.tsensor_names, tlabels)] +
+                [('presssensors', name, label) for name, label in zip(self.psensor_names, plabels)])
+
+    def update_process_status(self):
+        """ Shows the heartbeats in the status bar and marks the readings of the boards whose
+        control process is stale (stuck, dead or not hearing from its Arduino)
+        """
+        records = self.heartbeats.read()
+        self.statusbar.showMessage(summarize_heartbeats(records))
+
+        for category, sensor_name, label in self.sensor_labels():
+            sensor = self.data.get(category, {}).get(sensor_name)
+            if sensor is None:
+                # Not fetched yet
+                continue
+            board = sensor['board']
+            record = records.get("ArdControl {}".format(board))
+            stale = record is None or record['stale']
+            if stale == (label in self.stale_labels):
+                continue
+            if stale:
+                self.stale_labels.add(label)
+                label.setStyleSheet("color: red")
+                label.setToolTip("No new data from {}".format(board))
+            else:
+                self.stale_labels.discard(label)
+                label.setStyleSheet("")
+                label.setToolTip("")
 
     def _update_logger(self):
         self.logger.update()
 
+    def closeEvent(self, event):
+        self.fetch_thread.quit()
+        self.fetch_thread.wait()
+        super(self.__class__, self).closeEvent(event)
+
     def start_everything(self):
         self.label_timer.timeout.connect(self.refresh_dynamic_labels)
         self.label_timer.start(250)
+        if self.heartbeats is not None:
+            self.heartbeat_timer.start(1000)
 
 
 
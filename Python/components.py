@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+
+""" Brewery components used inside the control process
+
+    Compact record types for the temperature sensors, pressure sensors,
+    heaters and pumps. The control loop works on their attributes and
+    only copies values from/to the shared state at the cycle boundaries.
+
+    """
+
+# Import standard Python modules
+import time
+
+# Import third-party libraries
+
+# Import relative files
+
+
+class Component(object):
+    """ Base class for the control process records.
+
+    SETTINGS are the values chosen by the user (through the GUI), and OUTPUTS
+    are the values measured or decided by the control process. Both are
+    listed as (attribute, key in the shared state) pairs. board is the name
+    of the Arduino the component is wired to.
+
+    watcher is an optional set; the component adds its name to it whenever a
+    value the control logic depends on (a setting or a new reading) changes.
+    """
+
+    __slots__ = ('watcher',)
+
+    CATEGORY = None
+    SETTINGS = ()
+    OUTPUTS = ()
+
+    def __init__(self, name):
+        for attr, key in self.SETTINGS + self.OUTPUTS:
+            setattr(self, attr, None)
+        self.name = name
+        self.watcher = None
+
+    def changed(self):
+        """ Tells the watcher (if any) that this component changed"""
+        if self.watcher is not None:
+            self.watcher.add(self.name)
+
+    def load(self, fields):
+        """ Copies every known value found in fields (a dictionary from the shared state)"""
+        changed = False
+        for attr, key in self.SETTINGS + self.OUTPUTS:
+            if key in fields:
+                setattr(self, attr, fields[key])
+                changed = True
+        if changed:
+            self.changed()
+
+    def apply_settings(self, fields):
+        """ Copies only the user settings found in fields. Returns True if there were any"""
+        changed = False
+        for attr, key in self.SETTINGS:
+            if key in fields:
+                setattr(self, attr, fields[key])
+                changed = True
+        if changed:
+            self.changed()
+        return changed
+
+    def store(self, state):
+        """ Writes the outputs of this component into the shared state"""
+        record = state[self.CATEGORY][self.name]
+        for attr, key in self.OUTPUTS:
+            record[key] = getattr(self, attr)
+
+
+class TemperatureSensor(Component):
+    """ DS18B20 temperature probe, matched to the Arduino data by serial number"""
+
+    __slots__ = ('name', 'board', 'serial_num', 'units', 'value', 'read_time')
+
+    CATEGORY = 'tempsensors'
+    SETTINGS = (('board', 'board'),
+                ('serial_num', 'serial_num'),
+                ('units', 'units'))
+    OUTPUTS = (('value', 'value'),)
+
+    def __init__(self, name):
+        Component.__init__(self, name)
+        # time.monotonic() when the current value was measured on the Arduino
+        self.read_time = None
+
+    def update_reading(self, value, age=0.0):
+        """ Stores a reading taken age seconds ago, unless a newer one is already stored"""
+        read_time = time.monotonic() - age
+        if self.read_time is not None and read_time < self.read_time:
+            return
+        if value != self.value:
+            self.value = value
+            self.changed()
+        self.read_time = read_time
+
+
+class PressureSensor(Component):
+    """ Analog pressure transducer, matched to the Arduino data by pin number"""
+
+    __slots__ = ('name', 'board', 'pin_num', 'slope', 'intercept', 'units', 'voltage', 'pressure')
+
+    CATEGORY = 'presssensors'
+    SETTINGS = (('board', 'board'),
+                ('pin_num', 'pin_num'),
+                ('slope', 'volts_to_pressure_slope'),
+                ('intercept', 'volts_to_pressure_intercept'),
+                ('units', 'units'))
+    OUTPUTS = (('voltage', 'voltage'),
+               ('pressure', 'pressure'))
+
+    def update_voltage(self, voltage):
+        """ Stores a new voltage and the pressure calculated from it"""
+        self.voltage = voltage
+        pressure = voltage * self.slope + self.intercept
+        if pressure != self.pressure:
+            self.pressure = pressure
+            self.changed()
+
+
+class Heater(Component):
+    """ Heating element switched on a digital pin, controlled by a temperature sensor"""
+
+    __slots__ = ('name', 'board', 'pin_num', 'tsensor_name', 'lower_limit', 'upper_limit', 'maxtemp', 'status')
+
+    CATEGORY = 'heaters'
+    SETTINGS = (('board', 'board'),
+                ('pin_num', 'pin_num'),
+                ('tsensor_name', 'tsensor_name'),
+                ('lower_limit', 'lower limit'),
+                ('upper_limit', 'upper limit'),
+                ('maxtemp', 'maxtemp'))
+    OUTPUTS = (('status', 'status'),)
+
+
+class Pump(Component):
+    """ Pump switched on a digital pin, controlled by the volume from a pressure sensor"""
+
+    __slots__ = ('name', 'board', 'pin_num', 'psensor_name', 'psi_to_gal_slope', 'psi_to_gal_intercept',
+                 'lower_limit', 'upper_limit', 'gallons', 'status')
+
+    CATEGORY = 'pumps'
+    SETTINGS = (('board', 'board'),
+                ('pin_num', 'pin_num'),
+                ('psensor_name', 'psensor_name'),
+                ('psi_to_gal_slope', 'psi_to_gal_slope'),
+                ('psi_to_gal_intercept', 'psi_to_gal_intercept'),
+                ('lower_limit', 'lower limit'),
+                ('upper_limit', 'upper limit'))
+    OUTPUTS = (('gallons', 'gallons'),
+               ('status', 'status'))
+
+
+# Record class used for each category of the shared state
+COMPONENT_TYPES = {component.CATEGORY: component
+                   for component in (TemperatureSensor, PressureSensor, Heater, Pump)}
+
+
+def build_components(state):
+    """ Returns {category: {name: record}} for every component in the shared state"""
+    return {category: {name: component(name) for name in state[category].keys()}
+            for category, component in COMPONENT_TYPES.items()}
@@ -0,0 +1,283 @@
+#!/usr/bin/env python3
+
+""" Process heartbeats
+
+    Every process of the brewery (one ArdControl per board, the GUI, the
+    logger, the website writer) publishes a heartbeat: how many cycles it
+    ran, how long the last one took, the median (p50) and 99th percentile
+    (p99) of its recent cycle times and, for the control processes, when
+    the Arduino last sent data.
+
+    The heartbeats live in their own small shared memory block, one fixed
+    size slot per process, apart from the brewery state: a beat is a few
+    plain memory writes, without the lock or the change feed. Each slot has
+    a single writer, and a counter that is odd while the slot is being
+    written, so readers can tell a torn read and try again.
+
+        heartbeats = Heartbeats()             # in the main process
+        heartbeat = heartbeats.heartbeat("ArdControl Board1")
+        with heartbeat.cycle():               # around one cycle of work
+            ...
+
+    Run this file to print the heartbeats of the running brewery:
+
+        python3 heartbeat.py --watch 1
+
+    """
+
+# Import standard Python modules
+import argparse
+import os
+import struct
+import time
+from collections import deque
+from contextlib import contextmanager, nullcontext
+from multiprocessing import Lock, resource_tracker
+from multiprocessing.shared_memory import SharedMemory
+
+# Import third-party libraries
+
+# Import relative files
+from shared_state import STRING_SIZE
+
+# Name of the shared memory block, so the command line can find it
+HEARTBEAT_SHM_NAME = 'ccbc_heartbeats'
+# Number of processes that can publish a heartbeat
+MAX_PROCESSES = 16
+# Cycle times kept for the percentiles, and how often (seconds) the percentiles are worked out again
+HISTORY_SIZE = 1000
+PERCENTILE_INTERVAL = 1.0
+# Reads of a slot caught in the middle of a write before taking it as it is
+# (its process may have died while writing)
+READ_ATTEMPTS = 100
+# Data (or a heartbeat) older than this many seconds is stale
+STALE_AFTER = 5.0
+# A process is also stale after missing this many of its beats
+STALE_PERIODS = 3
+
+# Number of slots in use
+HEADER = struct.Struct('Q')
+# Write counter, then name, pid, period, cycles, beat time, last cycle time, p50, p99, data time (nan if none)
+SLOT_COUNTER = struct.Struct('Q')
+SLOT_FIELDS = struct.Struct('{}sqdQddddd'.format(STRING_SIZE))
+SLOT_SIZE = SLOT_COUNTER.size + SLOT_FIELDS.size
+FIELD_NAMES = ('name', 'pid', 'period', 'cycles', 'beat_time', 'last_duration', 'p50', 'p99', 'data_time')
+
+
+def percentile(ordered, fraction):
+    """ Returns the value below which a fraction of the sorted values fall (nearest rank)"""
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+class Heartbeats(object):
+    """ Shared block holding the heartbeats of up to MAX_PROCESSES processes.
+
+    Create it once in the main process and hand it to the others like the
+    SharedState; they re-attach to the same block.
+    """
+
+    def __init__(self, shm_name=HEARTBEAT_SHM_NAME, create=True, lock=None):
+        self.lock = lock if lock is not None else Lock()
+        self.size = HEADER.size + MAX_PROCESSES * SLOT_SIZE
+        if create:
+            try:
+                self.shm = SharedMemory(name=shm_name, create=True, size=self.size)
+            except FileExistsError:
+                # Left behind by a brewery that did not shut down cleanly
+                SharedMemory(name=shm_name).unlink()
+                self.shm = SharedMemory(name=shm_name, create=True, size=self.size)
+            self.shm.buf[:self.size] = bytes(self.size)
+        else:
+            self.shm = SharedMemory(name=shm_name)
+        self.buf = self.shm.buf
+
+    def __getstate__(self):
+        return {'shm_name': self.shm.name, 'lock': self.lock}
+
+    def __setstate__(self, state):
+        self.__init__(state['shm_name'], create=False, lock=state['lock'])
+
+    def slot_offset(self, slot):
+        return HEADER.size + slot * SLOT_SIZE
+
+    def heartbeat(self, name, period=0.0):
+        """ Returns the Heartbeat publishing to the slot of the named process, which
+        should beat every period seconds.
+
+        A restarted process gets the slot of the one it replaces.
+        """
+        with self.lock:
+            count = HEADER.unpack_from(self.buf, 0)[0]
+            for slot in range(count):
+                if self.read_slot(slot)['name'] == name:
+                    heartbeat = Heartbeat(self, slot, name, period)
+                    heartbeat.publish()
+                    return heartbeat
+            if count == MAX_PROCESSES:
+                raise ValueError("No heartbeat slot left for {}".format(name))
+            heartbeat = Heartbeat(self, count, name, period)
+            heartbeat.publish()
+            HEADER.pack_into(self.buf, 0, count + 1)
+            return heartbeat
+
+    def write_slot(self, slot, fields):
+        """ Writes the fields of a slot. Only the slot's own process calls this"""
+        offset = self.slot_offset(slot)
+        # Left odd if the previous owner died in the middle of a write
+        counter = SLOT_COUNTER.unpack_from(self.buf, offset)[0]
+        counter += counter % 2
+        SLOT_COUNTER.pack_into(self.buf, offset, counter + 1)
+        SLOT_FIELDS.pack_into(self.buf, offset + SLOT_COUNTER.size, *fields)
+        SLOT_COUNTER.pack_into(self.buf, offset, counter + 2)
+
+    def read_slot(self, slot):
+        """ Returns the fields of a slot as a dictionary"""
+        offset = self.slot_offset(slot)
+        for attempt in range(READ_ATTEMPTS):
+            counter = SLOT_COUNTER.unpack_from(self.buf, offset)[0]
+            fields = SLOT_FIELDS.unpack_from(self.buf, offset + SLOT_COUNTER.size)
+            if counter % 2 == 0 and SLOT_COUNTER.unpack_from(self.buf, offset)[0] == counter:
+                break
+        record = dict(zip(FIELD_NAMES, fields))
+        record['name'] = record['name'].rstrip(b'\0').decode('utf-8', 'replace')
+        return record
+
+    def read(self, stale_after=STALE_AFTER):
+        """ Returns {process name: heartbeat fields}, with how old (seconds) the last
+        beat and the last data are, and whether either is stale.
+
+        A process is stale when it missed STALE_PERIODS beats (and stale_after seconds
+        went by), or its data is older than stale_after. One that has not run a cycle
+        yet is not.
+        """
+        now = time.monotonic()
+        records = {}
+        for slot in range(HEADER.unpack_from(self.buf, 0)[0]):
+            record = self.read_slot(slot)
+            record['age'] = now - record['beat_time'] if record['cycles'] else None
+            # nan (no data yet) compares as not a number, so it is None here
+            record['data_age'] = now - record['data_time'] if record['data_time'] == record['data_time'] else None
+            record['stale'] = ((record['age'] is not None and
+                                record['age'] > max(stale_after, STALE_PERIODS * record['period'])) or
+                               (record['data_age'] is not None and record['data_age'] > stale_after))
+            records[record['name']] = record
+        return records
+
+    def close(self):
+        """ Detaches this process from the shared memory block"""
+        self.buf = None
+        self.shm.close()
+
+    def unlink(self):
+        """ Frees the shared memory block. Only the creating process should call this."""
+        self.shm.unlink()
+
+
+class Heartbeat(object):
+    """ Heartbeat of one process. Keeps the statistics and writes them to the process's slot"""
+
+    def __init__(self, heartbeats, slot, name, period=0.0):
+        self.heartbeats = heartbeats
+        self.slot = slot
+        self.name = name
+        self.period = period
+        self.cycles = 0
+        self.beat_time = 0.0
+        self.last_duration = 0.0
+        self.durations = deque(maxlen=HISTORY_SIZE)
+        self.p50 = 0.0
+        self.p99 = 0.0
+        self.next_percentiles = 0.0
+        self.data_time = float('nan')
+
+    def beat(self, duration):
+        """ Publishes the end of a cycle that took duration seconds"""
+        self.beat_time = time.monotonic()
+        self.cycles += 1
+        self.last_duration = duration
+        self.durations.append(duration)
+        if self.beat_time >= self.next_percentiles:
+            ordered = sorted(self.durations)
+            self.p50 = percentile(ordered, 0.5)
+            self.p99 = percentile(ordered, 0.99)
+            self.next_percentiles = self.beat_time + PERCENTILE_INTERVAL
+        self.publish()
+
+    @contextmanager
+    def cycle(self):
+        """ Times the body of the with statement as one cycle"""
+        start = time.monotonic()
+        try:
+            yield self
+        finally:
+            self.beat(time.monotonic() - start)
+
+    def data_received(self, when=None):
+        """ Notes that new data came in (published with the next beat)"""
+        self.data_time = time.monotonic() if when is None else when
+
+    def publish(self):
+        self.heartbeats.write_slot(self.slot, (self.name.encode('utf-8'), os.getpid(), self.period, self.cycles,
+                                               self.beat_time, self.last_duration, self.p50, self.p99,
+                                               self.data_time))
+
+
+def timed(heartbeat):
+    """ Returns heartbeat.cycle(), or a context doing nothing when there is no heartbeat"""
+    if heartbeat is None:
+        return nullcontext()
+    return heartbeat.cycle()
+
+
+def summarize_heartbeats(records):
+    """ Returns the heartbeats on one line"""
+    parts = []
+    for name, record in records.items():
+        if record['stale']:
+            parts.append("{}: STALE".format(name))
+        elif record['cycles']:
+            parts.append("{}: p50 {:.1f} ms, p99 {:.1f} ms".format(name, record['p50'] * 1000, record['p99'] * 1000))
+        else:
+            parts.append("{}: starting".format(name))
+    return " | ".join(parts)
+
+
+def format_heartbeats(records):
+    """ Returns the heartbeats as a table"""
+    lines = ["{:<24} {:>7} {:>9} {:>8} {:>9} {:>9} {:>9} {:>9}  {}".format(
+        "Process", "PID", "Cycles", "Beat (s)", "Last (ms)", "p50 (ms)", "p99 (ms)", "Data (s)", "")]
+    for name, record in records.items():
+        lines.append("{:<24} {:>7} {:>9} {:>8} {:>9.1f} {:>9.1f} {:>9.1f} {:>9}  {}".format(
+            name, record['pid'], record['cycles'],
+            "-" if record['age'] is None else "{:.1f}".format(record['age']),
+            record['last_duration'] * 1000, record['p50'] * 1000, record['p99'] * 1000,
+            "-" if record['data_age'] is None else "{:.1f}".format(record['data_age']),
+            "STALE" if record['stale'] else ""))
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Prints the heartbeats of the running brewery processes")
+    parser.add_argument('--watch', type=float, default=0, help="print again every this many seconds")
+    parser.add_argument('--stale-after', type=float, default=STALE_AFTER,
+                        help="seconds without a beat or new data before a process is stale")
+    args = parser.parse_args()
+
+    try:
+        heartbeats = Heartbeats(create=False)
+    except FileNotFoundError:
+        raise SystemExit("The brewery is not running (no {} block)".format(HEARTBEAT_SHM_NAME))
+    # The block belongs to the brewery; keep this process from freeing it on exit
+    resource_tracker.unregister(heartbeats.shm._name, 'shared_memory')
+    try:
+        while True:
+            print(format_heartbeats(heartbeats.read(args.stale_after)))
+            if not args.watch:
+                break
+            print()
+            time.sleep(args.watch)
+    except KeyboardInterrupt:
+        pass
+    heartbeats.close()
@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+
+""" Text protocol parsing benchmark
+
+    Times how long ArdControl takes to apply one text dump to its components:
+
+    1) the line path, the parser ArdControl used to have, kept here as the
+       reference: LineAssembler decodes every line to a string and
+       apply_line splits it on ':', ',' and '='
+    2) the bytes path ArdControl uses: LineParser matches the received bytes
+       directly and process_records applies the (kind, key, value, extra) records
+
+    Run it with the number(s) of temperature sensors to try, e.g.:
+
+        python3 parser_benchmark.py --temps 9 64 200
+
+    """
+
+# Import standard Python modules
+import argparse
+import os
+import random
+import tempfile
+import timeit
+
+# Import third-party libraries
+
+# Import relative files
+import arduino_protocol
+import setup_configuration
+from ccbc_control import ArdControl
+
+
+class LineAssembler(object):
+    """ Splits bytes received in arbitrary pieces into complete text lines"""
+
+    def __init__(self):
+        self.buffer = bytearray()
+
+    def feed(self, data):
+        """ Adds received bytes and returns the lines they completed (decoded and stripped)"""
+        self.buffer += data
+        if b'\n' not in data:
+            return []
+        lines = self.buffer.split(b'\n')
+        self.buffer = lines.pop()
+        return [line.strip().decode('utf-8', 'replace') for line in lines if line.strip()]
+
+
+def apply_line(control, line):
+    """ Takes a line of data from the Arduino and puts it into the components of an ArdControl"""
+
+    # Split the serial read text by colons to get the type of data and the data itself
+    serial_read_input_list = line.split(":")
+
+    try:
+        # First entry is the type, the rest is the data
+        type_of_data = serial_read_input_list[0]
+        data = serial_read_input_list[1]
+    except IndexError:
+        return
+
+    if type_of_data == "tempsensor":
+        apply_temp_data(control, data)
+
+    if type_of_data == "analogpin":
+        apply_pressure_data(control, data)
+
+    if type_of_data == "digitalpin":
+        apply_heater_pump_data(control, data)
+
+    if type_of_data == arduino_protocol.END_OF_DUMP:
+        apply_end_of_dump(control, data)
+    else:
+        control.dump_lines += 1
+
+
+def apply_end_of_dump(control, data):
+    """ Processes an end line: seq=X,ack=Y"""
+    fields = dict(field.split('=', 1) for field in data.split(',') if '=' in field)
+    try:
+        seq = int(fields['seq'])
+        ack = int(fields['ack']) if 'ack' in fields else None
+    except (KeyError, ValueError):
+        return
+    control.end_of_dump(seq, ack)
+
+
+def apply_temp_data(control, data):
+    """ Processes a tempsensor line: name=TempX,serial_num=blahblah,value=50,units=F,age=420"""
+    sensor_details = dict(detail.split('=', 1) for detail in data.split(',') if '=' in detail)
+    serial_num = sensor_details['serial_num']
+    value = float(sensor_details['value'])
+    age = int(sensor_details.get('age', 0)) / 1000.0
+
+    # Look up the sensor with this serial number
+    tname = control.ard_data.sensor_index.tempsensor(serial_num)
+    if tname is not None and control.owns(control.tempsensors[tname]):
+        control.tempsensors[tname].update_reading(value, age)
+
+
+def apply_pressure_data(control, data):
+    """ Processes an analogpin line: name=PinX,pin_num=X,value=val"""
+    sensor_details = data.split(',')
+    pin_num = int(sensor_details[1].split('=')[1])
+    voltage = float(sensor_details[2].split('=')[1])
+
+    # Look up the sensor on this analog pin
+    pname = control.ard_data.sensor_index.presssensor(pin_num, control.board)
+    if pname is not None:
+        control.presssensors[pname].update_voltage(voltage)
+
+
+def apply_heater_pump_data(control, data):
+    """ Processes a digitalpin line: name=PinX,pin_num=X,value=val, where val is 0/1 for OFF/ON"""
+    sensor_details = data.split(',')
+    pin_num = int(sensor_details[1].split('=')[1])
+    value = sensor_details[2].split('=')[1]
+    control.set_digital_pin(pin_num, "ON" if int(value) == 1 else "OFF")
+
+
+def make_config(temps, analog_pins):
+    """ Writes a configuration file with made-up sensors and returns its name and the serial numbers"""
+    serials = ["28{:014X}".format(random.getrandbits(56)) for i in range(temps)]
+    fileobj = tempfile.NamedTemporaryFile('w', suffix='.txt', delete=False)
+    with fileobj:
+        for i, serial_num in enumerate(serials):
+            fileobj.write("TemperatureSensor,Temp Sensor {},{}\n".format(i + 1, serial_num))
+        for pin_num in range(analog_pins):
+            fileobj.write("PressureSensor,Pressure Sensor {},{}\n".format(pin_num + 1, pin_num))
+        fileobj.write("Heater,Heater 1,5\n")
+        fileobj.write("Pump,Pump 1,9\n")
+    return fileobj.name, serials
+
+
+def make_dump(serials, analog_pins, digital_pins, seq=0):
+    """ Returns the bytes of one text dump, as sent by the sketch"""
+    lines = []
+    for i, serial_num in enumerate(serials):
+        lines.append("tempsensor:name=Temp{},serial_num={},value={:.2f},units=F,age={}".format(
+            i, serial_num, random.uniform(60, 212), random.randrange(750)))
+    for pin_num in range(analog_pins):
+        lines.append("analogpin:name=Pin{0},pin_num={0},value={1}".format(pin_num, random.randrange(1024)))
+    for pin_num in digital_pins:
+        lines.append("digitalpin:name=Pin{0},pin_num={0},value={1}".format(pin_num, random.randrange(2)))
+    lines.append("{}:seq={},ack=0,key=1".format(arduino_protocol.END_OF_DUMP, seq))
+    return "".join(line + "\r\n" for line in lines).encode()
+
+
+def benchmark(temps, analog_pins=6, digital_pins=range(2, 10), number=2000):
+    """ Prints the time per dump of both paths for a number of temperature sensors"""
+    config_file, serials = make_config(temps, analog_pins)
+    try:
+        (ard_shm, ard_dict,
+         tsensor_names, psensor_names,
+         heater_names, pump_names) = setup_configuration.return_configuration(config_file)
+    finally:
+        os.remove(config_file)
+
+    try:
+        # The serial port is never opened
+        control = ArdControl(ard_dict)
+        dump = make_dump(serials, analog_pins, digital_pins)
+        assembler = LineAssembler()
+        parser = arduino_protocol.LineParser()
+
+        # The same dump is applied over and over, so its sequence number must not look like a gap
+        def line_path():
+            control.last_dump_seq = None
+            for line in assembler.feed(dump):
+                apply_line(control, line)
+
+        def bytes_path():
+            control.last_dump_seq = None
+            control.process_records(parser.feed(dump))
+
+        def parse_only():
+            parser.feed(dump)
+
+        # Both paths have to give the same components
+        line_path()
+        expected = [sensor.value for sensor in control.tempsensors.values()]
+        for sensor in control.tempsensors.values():
+            sensor.value = sensor.read_time = None
+        bytes_path()
+        if [sensor.value for sensor in control.tempsensors.values()] != expected:
+            print("The two paths disagree!")
+
+        results = []
+        for path in (line_path, bytes_path, parse_only):
+            seconds = min(timeit.repeat(path, number=number, repeat=3)) / number
+            results.append(seconds * 1e6)
+        print("{:4d} temps ({:5d} bytes): line path {:7.1f} us, bytes path {:7.1f} us "
+              "({:.1f}x), of which parsing {:7.1f} us".format(temps, len(dump), results[0], results[1],
+                                                             results[0] / results[1], results[2]))
+    finally:
+        ard_dict.close()
+        ard_dict.unlink()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Times the text protocol parsing paths of ArdControl")
+    parser.add_argument('--temps', type=int, nargs='+', default=[9, 64, 200],
+                        help="numbers of temperature sensors in the dump")
+    parser.add_argument('--number', type=int, default=2000, help="dumps per timing run")
+    args = parser.parse_args()
+
+    for temps in args.temps:
+        benchmark(temps, number=args.number)
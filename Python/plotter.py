@@ -8,6 +8,7 @@ import pyqtgraph as pg
 import numpy as np
 
 # Import local modules
+from shared_state import merge_changes
 
 
 class Plotter(object):
@@ -35,24 +36,29 @@ class Plotter(object):
         # Backfill a numpy array with previous time inputs
         self.time = np.arange(-total_plot_span, 0.0 + plot_freq, plot_freq)
 
+        # Local copy of the shared data, kept up to date from the change feed
+        self.subscription = self.ard_dict.subscribe()
+        self.data = {}
+        data = merge_changes(self.data, self.subscription.poll())
+
         # Fill a numpy array with heater data for heater plot
         self.heater1_current_temp = np.full((len(self.time), ),
-                                            self.ard_dict['tempsensors'][self.ard_dict['heaters']
+                                            data['tempsensors'][data['heaters']
                                             [heater_names[0]]['tsensor_name']]['value'])
 
         self.heater1_lower = np.full((len(self.time), ),
-                                     self.ard_dict['heaters'][self.heater_names[0]]['lower limit'])
+                                     data['heaters'][self.heater_names[0]]['lower limit'])
 
         self.heater1_upper = np.full((len(self.time), ),
-                                     self.ard_dict['heaters'][self.heater_names[0]]['upper limit'])
+                                     data['heaters'][self.heater_names[0]]['upper limit'])
 
         # Fill numpy array with pump 1 data
         self.pump1_gallons = np.full((len(self.time), ),
-                                     self.ard_dict['pumps'][pump_names[0]]['gallons'])
+                                     data['pumps'][pump_names[0]]['gallons'])
         self.pump1_lower = np.full((len(self.time), ),
-                                   self.ard_dict['pumps'][pump_names[0]]['lower limit'])
+                                   data['pumps'][pump_names[0]]['lower limit'])
         self.pump1_upper = np.full((len(self.time),),
-                                   self.ard_dict['pumps'][pump_names[0]]['upper limit'])
+                                   data['pumps'][pump_names[0]]['upper limit'])
 
         # Create a graphics window for plots
         self.win = pg.GraphicsWindow()
@@ -94,13 +100,16 @@ class Plotter(object):
         self.time[:-1] = self.time[1:]
         self.time[-1] = delta
 
+        # Merge whatever changed since the last sample into the local copy
+        data = merge_changes(self.data, self.subscription.poll())
+
         # Update the heater plots
-        self._update_heater1_plot()
+        self._update_heater1_plot(data)
 
         # Update the pump plots
-        self._update_pump1_plot()
+        self._update_pump1_plot(data)
 
-    def _update_heater1_plot(self):
+    def _update_heater1_plot(self, data):
         """ Heater plot
 
         1) Lower bound (red line)
@@ -115,10 +124,10 @@ class Plotter(object):
         self.heater1_upper[:-1] = self.heater1_upper[1:]
 
         # Append the latest value
-        self.heater1_current_temp[-1] = (self.ard_dict['tempsensors']
-                                         [self.ard_dict['heaters'][self.heater_names[0]]['tsensor_name']]['value'])
-        self.heater1_lower[-1] = self.ard_dict['heaters'][self.heater_names[0]]['lower limit']
-        self.heater1_upper[-1] = self.ard_dict['heaters'][self.heater_names[0]]['upper limit']
+        self.heater1_current_temp[-1] = (data['tempsensors']
+                                         [data['heaters'][self.heater_names[0]]['tsensor_name']]['value'])
+        self.heater1_lower[-1] = data['heaters'][self.heater_names[0]]['lower limit']
+        self.heater1_upper[-1] = data['heaters'][self.heater_names[0]]['upper limit']
 
         # Update the plot to use this current data
         self.heater1_cur_temp_curve.setData(self.time, self.heater1_current_temp)
@@ -130,7 +139,7 @@ class Plotter(object):
         self.heater1_low_curve.setPos(self.time[-1], 0)
         self.heater1_high_curve.setPos(self.time[-1], 0)
 
-    def _update_pump1_plot(self):
+    def _update_pump1_plot(self, data):
         """ Pump plot
 
         1) Lower bound (red line)
@@ -145,9 +154,9 @@ class Plotter(object):
         self.pump1_upper[:-1] = self.pump1_upper[1:]
 
         # Append the latest value
-        self.pump1_gallons[-1] = self.ard_dict['pumps'][self.pump_names[0]]['gallons']
-        self.pump1_lower[-1] = self.ard_dict['pumps'][self.pump_names[0]]['lower limit']
-        self.pump1_upper[-1] = self.ard_dict['pumps'][self.pump_names[0]]['upper limit']
+        self.pump1_gallons[-1] = data['pumps'][self.pump_names[0]]['gallons']
+        self.pump1_lower[-1] = data['pumps'][self.pump_names[0]]['lower limit']
+        self.pump1_upper[-1] = data['pumps'][self.pump_names[0]]['upper limit']
 
         # Update the plot to use the current data
         self.pump1_gal_curve.setData(self.time, self.pump1_gallons)
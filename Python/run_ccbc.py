@@ -1,15 +1,20 @@
 #!/usr/bin/env python3
 
 # Python Library Imports
-import time
+import argparse
+import os
 import random
 import sys
 from PyQt5.QtWidgets import QApplication
-from multiprocessing import Manager, Process
+from multiprocessing import Process
 
 # Other Imports
 from ccbc_gui import ccbcGUI
 from ccbc_control import CCBC_Brains, ArdControl
+from ccbc_async_control import AsyncArdControl
+from supervisor import Supervisor
+from WebsiteDisplay import WebsiteUpdate, html_dir
+from heartbeat import Heartbeats
 import setup_configuration
 
 # TODO: Create a class that acts as a Brewer, where certain parts of the process can be grouped together
@@ -17,43 +22,61 @@ import setup_configuration
 
 # Defined Functions:
 
-def process_gui(ard_dictionary, tsensor_names, psensor_names, heater_names, pump_names):
+def process_gui(ard_dictionary, tsensor_names, psensor_names, heater_names, pump_names, heartbeats=None,
+                ready=None):
     print("Starting the GUI...")
     app = QApplication(sys.argv)
-    c = ccbcGUI(ard_dictionary, tsensor_names, psensor_names, heater_names, pump_names)
+    c = ccbcGUI(ard_dictionary, tsensor_names, psensor_names, heater_names, pump_names, heartbeats)
+    # The window is shown by now
+    if ready is not None:
+        ready.set()
     app.exec()
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Runs the brewery: the GUI and one control process per Arduino")
+    parser.add_argument('--async', dest='use_async', action='store_true',
+                        help="control the Arduinos from an asyncio event loop (AsyncArdControl)")
+    parser.add_argument('--html-dir', default=html_dir,
+                        help="directory of the CCBC webpage, where ccbc.json is written")
+    args = parser.parse_args()
+    control_class = AsyncArdControl if args.use_async else ArdControl
+
     # Define the sensors
-    (ard_manager, ard_dict,
+    (ard_shm, ard_dict,
      tsensor_names, psensor_names,
      heater_names, pump_names) = setup_configuration.return_configuration()
 
+    # Every process publishes its cycle times here; see heartbeat.py to print them
+    heartbeats = Heartbeats()
+    supervisor = Supervisor(state=ard_dict)
+
     print("Spawning a process for the GUI")
-    gui_process = Process(target=process_gui, args=(ard_dict, tsensor_names,
-                                                    psensor_names, heater_names, pump_names))
-    gui_process.start()
-
-    print("Spawning a process to control the arduino")
-    ard_process = ArdControl(ard_dict)
-    ard_process.start()
-
-    while True:
-        print("Checking to see if the processes are still alive...")
-        #if not ard_process.isalive():
-        #    print("Arduino process is down. Trying to restart.")
-        #    try:
-        #        ard_process = ArdControl(ard_dict, ard_command_dict)
-        #        ard_process.start()
-        #    except:
-        #        print("Could not restart Arduino process")
-        if not gui_process.is_alive():
-            print("GUI is down. Attempting to restart")
-            try:
-                gui_process = Process(target=process_gui, args=(ard_dict, tsensor_names,
-                                                                psensor_names, heater_names, pump_names))
-                gui_process.start()
-            except:
-                print("Could not restart the gui process!")
-        time.sleep(30)
+    supervisor.add("GUI", lambda ready: Process(target=process_gui, args=(ard_dict, tsensor_names, psensor_names,
+                                                                          heater_names, pump_names, heartbeats,
+                                                                          ready)))
+
+    print("Spawning a process to control each arduino")
+    for board in ard_dict['boards'].keys():
+        # A restarted process picks up the last state published to the shared memory
+        supervisor.add("Arduino {}".format(board),
+                       lambda ready, board=board: control_class(ard_dict, board=board, ready=ready,
+                                                                heartbeats=heartbeats))
+
+    if os.path.isdir(args.html_dir):
+        print("Spawning a process to write the website data")
+        supervisor.add("Website", lambda ready: Process(target=WebsiteUpdate.write_json_on_change,
+                                                        args=(ard_dict, args.html_dir, heartbeats, ready)))
+    else:
+        print("No webpage directory {}; not writing the website data".format(args.html_dir))
+
+    # Restarts any process as soon as it dies, until Ctrl+C
+    try:
+        supervisor.run()
+    except KeyboardInterrupt:
+        print("Stopping the processes")
+    finally:
+        # Free the shared memory blocks, or they outlive the brewery
+        heartbeats.unlink()
+        ard_dict.close()
+        ard_dict.unlink()
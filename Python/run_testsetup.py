@@ -7,7 +7,7 @@ from PyQt5.QtWidgets import QApplication
 from ccbc_gui import ccbcGUI
 from ccbc_control import CCBC_Brains, ArdControl
 import setup_configuration
-from multiprocessing import Manager, Process
+from multiprocessing import Process
 
 
 def process_gui(ard_dictionary, tsensor_names, psensor_names, heater_names, pump_names):
@@ -50,7 +50,7 @@ if __name__ == "__main__":
         for line in pump_lines:
             fileobj.write(line + "\n")
 
-    (ard_manager, ard_dict,
+    (ard_shm, ard_dict,
      tsensor_names, psensor_names,
      heater_names, pump_names) = setup_configuration.return_configuration("config_testsetup.txt")
 
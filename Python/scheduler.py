@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+
+""" Fixed-rate scheduler for control loops
+
+    Paces a loop to one cycle per period:
+
+        scheduler = FixedRateScheduler(0.1)
+        while True:
+            scheduler.tick()
+            ... one cycle of work ...
+
+    tick() ends the previous cycle and sleeps until the next deadline. A
+    cycle that overruns its period does not make the following ones pile
+    up: the ticks it missed are skipped, and the loop carries on from the
+    latest one. Every cycle's duration and lateness (how long after its
+    deadline it started) are recorded, along with the overruns and skips.
+
+    """
+
+# Import standard Python modules
+import time
+from collections import deque
+
+# Import third-party libraries
+
+# Import relative files
+
+# Number of cycle durations kept for the statistics
+HISTORY_SIZE = 1000
+
+
+class FixedRateScheduler(object):
+    """ Deadline-based pacing of a loop at a fixed period (seconds)"""
+
+    def __init__(self, period, clock=time.monotonic, sleep=time.sleep):
+        self.period = period
+        self.clock = clock
+        self.sleep = sleep
+        # Deadline of the current cycle and when it actually started
+        self.deadline = None
+        self.cycle_start = None
+
+        # Statistics
+        self.cycles = 0
+        self.overruns = 0
+        self.skipped_ticks = 0
+        self.last_duration = 0.0
+        self.last_lateness = 0.0
+        self.max_lateness = 0.0
+        self.durations = deque(maxlen=HISTORY_SIZE)
+
+    def tick(self):
+        """ Ends the current cycle (if any) and sleeps until the next one is due"""
+        now = self.clock()
+        if self.cycle_start is not None:
+            self.end_cycle(now)
+
+        if self.deadline is None:
+            self.deadline = now
+        else:
+            self.deadline += self.period
+            if now - self.deadline >= self.period:
+                # Skip the ticks that went by and start from the latest one
+                missed = int((now - self.deadline) // self.period)
+                self.skipped_ticks += missed
+                self.deadline += missed * self.period
+
+        # Sleep in pieces until the deadline; sleep() can return a bit early
+        while now < self.deadline:
+            self.sleep(self.deadline - now)
+            now = self.clock()
+
+        self.last_lateness = now - self.deadline
+        self.max_lateness = max(self.max_lateness, self.last_lateness)
+        self.cycle_start = now
+
+    def end_cycle(self, now):
+        """ Records the duration of the cycle that just ended"""
+        self.last_duration = now - self.cycle_start
+        self.durations.append(self.last_duration)
+        self.cycles += 1
+        if self.last_duration > self.period:
+            self.overruns += 1
+
+    def next_deadline(self):
+        """ Returns the clock time the next cycle is due (None before the first tick)"""
+        if self.deadline is None:
+            return None
+        return self.deadline + self.period
+
+    def stats(self):
+        """ Returns the cycle statistics as a dictionary"""
+        return {'period': self.period,
+                'cycles': self.cycles,
+                'overruns': self.overruns,
+                'skipped_ticks': self.skipped_ticks,
+                'last_duration': self.last_duration,
+                'last_lateness': self.last_lateness,
+                'max_lateness': self.max_lateness}
+
+
+if __name__ == "__main__":
+    scheduler = FixedRateScheduler(0.02)
+    for i in range(100):
+        scheduler.tick()
+        # Every tenth cycle overruns by a couple of periods
+        time.sleep(0.05 if i % 10 == 9 else 0.005)
+    scheduler.tick()
+    print(scheduler.stats())
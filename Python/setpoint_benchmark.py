@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+
+""" Setpoint checking benchmark
+
+    Times the heater and pump decisions of one control cycle:
+
+    1) one by one: the Python loop over every controller
+    2) full pass: SetpointArrays checking every controller with whole arrays
+    3) vectorized: SetpointArrays, a few NumPy operations for the
+       controllers whose sensors changed since the last cycle
+
+    with none, some and all of the sensors drifting a little before every
+    cycle, as in a brew (all of them, with noisy sensors). It reports the
+    cases where 3) is slower than 2), and checks that 1) and 3) make the same decisions over
+    random readings and settings, including readings that sit exactly on a
+    limit. Run it with the number(s) of
+    heaters (and as many pumps) to try, e.g.:
+
+        python3 setpoint_benchmark.py --controllers 10 100 1000 --changed 0 0.1 1
+
+    """
+
+# Import standard Python modules
+import argparse
+import random
+import time
+
+# Import third-party libraries
+
+# Import relative files
+from components import TemperatureSensor, PressureSensor, Heater, Pump
+from setpoints import SetpointArrays, check_one_by_one
+
+# Timing runs per case (the best one counts), and how much slower than the full pass
+# the incremental check may be (timing noise) before it is reported
+REPEATS = 5
+SLOWER_THAN_FULL_PASS = 1.25
+
+
+def make_brewery(controllers, sensors_per_controller=0.5):
+    """ Returns made-up heaters, pumps, temperature sensors and pressure sensors (the last two as dictionaries)"""
+    sensor_count = max(1, int(controllers * sensors_per_controller))
+    tempsensors = {}
+    presssensors = {}
+    for i in range(sensor_count):
+        tsensor = TemperatureSensor("Temp Sensor {}".format(i))
+        tsensor.update_reading(random.uniform(50.0, 220.0))
+        tempsensors[tsensor.name] = tsensor
+        psensor = PressureSensor("Pressure Sensor {}".format(i))
+        psensor.slope = random.uniform(0.5, 2.0)
+        psensor.intercept = random.uniform(-1.0, 1.0)
+        psensor.update_voltage(random.uniform(0.0, 5.0))
+        presssensors[psensor.name] = psensor
+
+    heaters = []
+    pumps = []
+    for i in range(controllers):
+        heater = Heater("Heater {}".format(i))
+        heater.tsensor_name = random.choice(list(tempsensors))
+        heater.lower_limit = float(random.randrange(60, 200))
+        heater.upper_limit = heater.lower_limit + random.choice((0.5, 1.0, 2.0))
+        heater.maxtemp = float(random.randrange(180, 215))
+        heater.status = random.choice(('ON', 'OFF'))
+        heaters.append(heater)
+
+        pump = Pump("Pump {}".format(i))
+        pump.psensor_name = random.choice(list(presssensors))
+        pump.psi_to_gal_slope = random.uniform(1.0, 5.0)
+        pump.psi_to_gal_intercept = random.uniform(-2.0, 2.0)
+        pump.lower_limit = random.uniform(0.0, 10.0)
+        pump.upper_limit = pump.lower_limit + random.uniform(0.0, 5.0)
+        pump.status = random.choice(('ON', 'OFF'))
+        pumps.append(pump)
+
+    return heaters, pumps, tempsensors, presssensors
+
+
+def new_readings(heaters, tempsensors, presssensors, fraction=1.0):
+    """ Gives a fraction of the sensors a new reading, some of them exactly on a heater limit"""
+    limits = [limit for heater in heaters for limit in (heater.lower_limit, heater.upper_limit, heater.maxtemp)]
+    for sensor in random.sample(list(tempsensors.values()), int(len(tempsensors) * fraction)):
+        sensor.update_reading(random.choice(limits) if random.random() < 0.3 else random.uniform(50.0, 220.0))
+    for sensor in random.sample(list(presssensors.values()), int(len(presssensors) * fraction)):
+        sensor.update_voltage(random.uniform(0.0, 5.0))
+
+
+def new_settings(heaters, pumps, tempsensors, presssensors):
+    """ Gives a few controllers new limits or another sensor, the way the GUI does"""
+    for heater in random.sample(heaters, max(1, len(heaters) // 20)):
+        lower_limit = float(random.randrange(60, 200))
+        heater.apply_settings({'tsensor_name': random.choice(list(tempsensors)),
+                               'lower limit': lower_limit,
+                               'upper limit': lower_limit + 1.0})
+    for pump in random.sample(pumps, max(1, len(pumps) // 20)):
+        pump.apply_settings({'psensor_name': random.choice(list(presssensors)),
+                             'psi_to_gal_slope': random.uniform(1.0, 5.0)})
+
+
+def outputs(heaters, pumps):
+    """ Returns the decisions made for the controllers"""
+    return ([heater.status for heater in heaters],
+            [(pump.gallons, pump.status) for pump in pumps])
+
+
+def drift_readings(tempsensors, presssensors, fraction):
+    """ Moves the readings of a fraction of the sensors a little"""
+    for sensor in random.sample(list(tempsensors.values()), int(len(tempsensors) * fraction)):
+        sensor.update_reading(sensor.value + random.uniform(-0.2, 0.2))
+    for sensor in random.sample(list(presssensors.values()), int(len(presssensors) * fraction)):
+        sensor.update_voltage(sensor.voltage + random.uniform(-0.01, 0.01))
+
+
+def time_cycle(check, change, number):
+    """ Returns the average time (us) of check, with a call to change before each one"""
+    total = 0.0
+    for i in range(number):
+        change()
+        start = time.perf_counter()
+        check()
+        total += time.perf_counter() - start
+    return total / number * 1e6
+
+
+def benchmark(controllers, fractions=(0.0, 0.1, 1.0), trials=200, number=200):
+    """ Checks both ways agree, then prints the time per cycle of each"""
+    heaters, pumps, tempsensors, presssensors = make_brewery(controllers)
+    setpoints = SetpointArrays(heaters, pumps, tempsensors, presssensors)
+
+    # Both ways have to make the same decisions, starting from the same statuses
+    for trial in range(trials):
+        new_readings(heaters, tempsensors, presssensors, random.choice((0.05, 0.5, 1.0)))
+        new_settings(heaters, pumps, tempsensors, presssensors)
+        before = outputs(heaters, pumps)
+        check_one_by_one(heaters, pumps, tempsensors, presssensors)
+        expected = outputs(heaters, pumps)
+        for heater, status in zip(heaters, before[0]):
+            heater.status = status
+        for pump, (gallons, status) in zip(pumps, before[1]):
+            pump.gallons, pump.status = gallons, status
+        setpoints.check_setpoints()
+        if outputs(heaters, pumps) != expected:
+            print("The two ways disagree!")
+            break
+
+    def one_by_one():
+        check_one_by_one(heaters, pumps, tempsensors, presssensors)
+
+    def full_pass():
+        setpoints.check_setpoints(check_all=True)
+
+    for fraction in fractions:
+        def change():
+            drift_readings(tempsensors, presssensors, fraction)
+
+        # Best of a few runs, to keep the comparison below from tripping over a busy machine
+        results = [min(time_cycle(check, change, number) for run in range(REPEATS))
+                   for check in (one_by_one, full_pass, setpoints.check_setpoints)]
+        print("{:5d} heaters + {:5d} pumps, {:4.0%} of the sensors changed: one by one {:8.1f} us, "
+              "full pass {:8.1f} us, vectorized {:8.1f} us ({:.1f}x)".format(
+                  controllers, controllers, fraction, results[0], results[1], results[2],
+                  results[0] / results[2]))
+        if results[2] > results[1] * SLOWER_THAN_FULL_PASS:
+            print("Checking only the changed controllers is slower than checking them all!")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Times the setpoint checks of ArdControl")
+    parser.add_argument('--controllers', type=int, nargs='+', default=[10, 100, 1000],
+                        help="numbers of heaters (and of pumps)")
+    parser.add_argument('--changed', type=float, nargs='+', default=[0.0, 0.1, 1.0],
+                        help="fractions of the sensors with a new reading every cycle")
+    parser.add_argument('--number', type=int, default=200, help="cycles per timing run")
+    args = parser.parse_args()
+
+    for controllers in args.controllers:
+        benchmark(controllers, args.changed, number=args.number)
@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+
+""" Timed heater setpoints
+
+    Turns the setpoint tables of the GUI (rows of brew time in seconds and
+    setpoint in F) into profiles, and applies them as the brew time goes by.
+
+    A row holds its setpoint from its time on (a step). A setpoint ending in
+    RAMP_SUFFIX (e.g. "152r") is reached at the row's time instead, moving in
+    a straight line from the row before (a ramp).
+
+    Every profile is compiled once into sorted tuples, so finding the setpoint
+    at any time is a binary search. The schedule also knows the brew time of
+    the next change, and does nothing until then.
+
+    """
+
+# Import standard Python modules
+import math
+from bisect import bisect_right
+
+# Import third-party libraries
+
+# Import relative files
+
+# Marks a setpoint that is ramped to instead of stepped to
+RAMP_SUFFIX = 'r'
+# Ramps move in steps of this many seconds (the brew time counts whole seconds)
+RAMP_RESOLUTION = 1.0
+
+
+def parse_row(time_text, setpoint_text):
+    """ Returns (time, setpoint, ramp) from the text of a table row. Raises ValueError if it is not valid"""
+    setpoint_text = setpoint_text.strip()
+    ramp = setpoint_text.lower().endswith(RAMP_SUFFIX)
+    if ramp:
+        setpoint_text = setpoint_text[:-len(RAMP_SUFFIX)]
+    time = float(time_text)
+    if time < 0:
+        raise ValueError("Negative brew time {}".format(time))
+    return time, float(setpoint_text), ramp
+
+
+class SetpointProfile(object):
+    """ Setpoints of one heater as a function of the brew time (seconds).
+
+    points is a list of (time, setpoint, ramp). The profile is sorted by time
+    (a later row wins over an earlier one at the same time) and never changes
+    afterwards.
+    """
+
+    __slots__ = ('times', 'setpoints', 'ramps')
+
+    def __init__(self, points):
+        points = sorted(points, key=lambda point: point[0])
+        self.times = tuple(point[0] for point in points)
+        self.setpoints = tuple(point[1] for point in points)
+        self.ramps = tuple(point[2] for point in points)
+
+    def __len__(self):
+        return len(self.times)
+
+    def ramping(self, i):
+        """ Returns True if the setpoint moves between points i and i + 1"""
+        return (0 <= i < len(self.times) - 1 and self.ramps[i + 1] and
+                self.setpoints[i + 1] != self.setpoints[i])
+
+    def setpoint_at(self, brew_time):
+        """ Returns the setpoint at brew_time, or None before the first point"""
+        i = bisect_right(self.times, brew_time) - 1
+        if i < 0:
+            return None
+        if not self.ramping(i):
+            return self.setpoints[i]
+
+        start, end = self.times[i], self.times[i + 1]
+        elapsed = math.floor((brew_time - start) / RAMP_RESOLUTION) * RAMP_RESOLUTION
+        return self.setpoints[i] + (self.setpoints[i + 1] - self.setpoints[i]) * elapsed / (end - start)
+
+    def next_change(self, brew_time):
+        """ Returns the first brew time after brew_time where the setpoint changes (math.inf if it never does)"""
+        i = bisect_right(self.times, brew_time) - 1
+        if i + 1 >= len(self.times):
+            return math.inf
+        if self.ramping(i):
+            start = self.times[i]
+            step = start + (math.floor((brew_time - start) / RAMP_RESOLUTION) + 1) * RAMP_RESOLUTION
+            return min(step, self.times[i + 1])
+        return self.times[i + 1]
+
+
+class SetpointSchedule(object):
+    """ Setpoint profiles of the heaters, written to the shared state as the brew time goes by.
+
+    A setpoint becomes the heater's lower and upper limits, band (F) apart.
+    """
+
+    def __init__(self, state, band=1.0):
+        self.state = state
+        self.band = band
+        self.profiles = {}
+        # Setpoints last written, and the brew time they have to be looked at again
+        self.applied = {}
+        self.next_change = 0.0
+
+    def set_profile(self, heater_name, profile):
+        """ Replaces the profile of a heater (an empty one removes it). It is applied on the next tick"""
+        if len(profile):
+            self.profiles[heater_name] = profile
+        else:
+            self.profiles.pop(heater_name, None)
+        self.applied.pop(heater_name, None)
+        self.next_change = 0.0
+
+    def reset(self):
+        """ Starts over, e.g. when the brew time goes back to zero"""
+        self.applied.clear()
+        self.next_change = 0.0
+
+    def setpoints(self, brew_time):
+        """ Returns {heater name: setpoint} at brew_time, for the heaters whose profile has started"""
+        setpoints = {}
+        for heater_name, profile in self.profiles.items():
+            setpoint = profile.setpoint_at(brew_time)
+            if setpoint is not None:
+                setpoints[heater_name] = setpoint
+        return setpoints
+
+    def limits(self, setpoint):
+        """ Returns the heater fields for a setpoint"""
+        return {'lower limit': setpoint - self.band / 2.0,
+                'upper limit': setpoint + self.band / 2.0}
+
+    def tick(self, brew_time):
+        """ Writes the setpoints that changed by brew_time, in one batch.
+
+        Returns the brew time of the next change (math.inf if there is none);
+        calls before then return right away.
+        """
+        if brew_time < self.next_change:
+            return self.next_change
+
+        changed = {heater_name: setpoint for heater_name, setpoint in self.setpoints(brew_time).items()
+                   if self.applied.get(heater_name) != setpoint}
+        if changed:
+            with self.state.batch():
+                for heater_name, setpoint in changed.items():
+                    self.state.update_record('heaters', heater_name, self.limits(setpoint))
+            self.applied.update(changed)
+
+        self.next_change = min([profile.next_change(brew_time) for profile in self.profiles.values()],
+                               default=math.inf)
+        return self.next_change
+
+
+if __name__ == "__main__":
+    # Mash in at 122 F, rest until 10 minutes, ramp to 152 F by 60 minutes, then mash out at 168 F
+    mash = SetpointProfile([parse_row("0", "122"), parse_row("600", "122"),
+                            parse_row("3600", "152r"), parse_row("4500", "168")])
+    for brew_time in (0, 599, 600, 601, 2100, 3599, 3600, 4500):
+        print("{:5d} s: {:.2f} F, next change at {} s".format(brew_time, mash.setpoint_at(brew_time),
+                                                              mash.next_change(brew_time)))
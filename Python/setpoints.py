@@ -0,0 +1,378 @@
+#!/usr/bin/env python3
+
+""" Vectorized setpoint checks
+
+    Makes the ON/OFF decisions of the heaters and pumps with a few NumPy
+    operations per cycle instead of a Python loop over the controllers.
+    The limits, calibrations, sensor readings and statuses are kept in
+    arrays. The components report their changes (see Component.watcher),
+    so every cycle only loads the new readings and settings and checks the
+    controllers that depend on them; the others cannot have changed their
+    minds. When many sensors changed, as with noisy sensors, or there are
+    few controllers, checking all of them with whole arrays is quicker than
+    working out which ones to check, and is done instead. Only the statuses
+    and gallons that changed are written back.
+
+    The decisions are the same as checking each controller in turn:
+
+        heater: OFF above the upper limit, ON below the lower limit,
+                OFF at or above the max temperature, else unchanged
+        pump:   gallons = pressure * slope + intercept
+                OFF above the upper limit, ON below the lower limit,
+                else unchanged
+
+    """
+
+# Import standard Python modules
+from itertools import chain
+from operator import attrgetter
+
+# Import third-party libraries
+import numpy as np
+
+# Import relative files
+
+# What to do with each controller
+KEEP = 0
+TURN_ON = 1
+TURN_OFF = 2
+STATUS = {TURN_ON: 'ON', TURN_OFF: 'OFF'}
+# Same codes for the statuses stored in the components (anything else is KEEP)
+STATUS_CODE = {'ON': TURN_ON, 'OFF': TURN_OFF}
+# Index of every controller: checking them all with whole arrays
+ALL = slice(None)
+# Above this fraction of the sensors changed, or with any change for fewer controllers
+# than this, it is faster to check every controller
+FULL_PASS_FRACTION = 0.15
+FULL_PASS_CONTROLLERS = 200
+# Number of heaters and pumps from which the NumPy checks beat the Python loop
+VECTORIZE_CONTROLLERS = 200
+
+
+def watch(components):
+    """ Returns the set the components will add their names to when they change"""
+    watcher = set()
+    for component in components:
+        component.watcher = watcher
+    return watcher
+
+
+def drain(changes):
+    """ Empties a set of changes and returns what was in it.
+
+    Only the names taken out are removed, so a reader thread can keep adding to it.
+    """
+    names = list(changes)
+    changes.difference_update(names)
+    return names
+
+
+def status_code(controller):
+    """ Returns the code of a controller's status"""
+    return STATUS_CODE.get(controller.status, KEEP)
+
+
+def positions(index, selected):
+    """ Returns the controller numbers of the selected entries of index (an array of them, or ALL)"""
+    return selected if index is ALL else index[selected]
+
+
+def apply_actions(controllers, statuses, index, actions):
+    """ Carries out the actions of the controllers at index. Returns the controllers whose status changed"""
+    old_statuses = statuses[index]
+    new_statuses = np.where(actions != KEEP, actions, old_statuses)
+    flipped = np.flatnonzero(new_statuses != old_statuses)
+    statuses[index] = new_statuses
+    changed = [controllers[i] for i in positions(index, flipped).tolist()]
+    for controller, status in zip(changed, new_statuses[flipped].tolist()):
+        controller.status = STATUS[status]
+    return changed
+
+
+def check_one_by_one(heaters, pumps, tempsensors, presssensors):
+    """ Same decisions as SetpointArrays.check_setpoints, one controller at a time.
+
+    Returns the controllers whose status changed.
+    """
+    changed = []
+    for heater in heaters:
+        current_temp = tempsensors[heater.tsensor_name].value
+
+        # Assign the pin_status the previous value from the previous iteration
+        pin_status = heater.status
+
+        if current_temp > heater.upper_limit:
+            pin_status = 'OFF'
+
+        if current_temp < heater.lower_limit:
+            pin_status = 'ON'
+
+        if current_temp >= heater.maxtemp:
+            pin_status = 'OFF'
+
+        if pin_status != heater.status:
+            changed.append(heater)
+        heater.status = pin_status
+
+    for pump in pumps:
+        pressure = presssensors[pump.psensor_name].pressure
+        gallons = pressure * pump.psi_to_gal_slope + pump.psi_to_gal_intercept
+        pump.gallons = gallons
+
+        # Assign the pin status the previous value from the previous cycle
+        pin_status = pump.status
+
+        if gallons > pump.upper_limit:
+            # Turn the pump off when the setpoint is above the setpoint
+            pin_status = 'OFF'
+            # TODO: Account for solenoid valve control when available
+
+        if gallons < pump.lower_limit:
+            pin_status = 'ON'
+
+        if pin_status != pump.status:
+            changed.append(pump)
+        pump.status = pin_status
+
+    return changed
+
+
+def setpoint_checker(heaters, pumps, tempsensors, presssensors):
+    """ Returns the quicker setpoint checker for this many controllers (same arguments as SetpointArrays)"""
+    heaters = list(heaters)
+    pumps = list(pumps)
+    if len(heaters) + len(pumps) < VECTORIZE_CONTROLLERS:
+        return SetpointLoop(heaters, pumps, tempsensors, presssensors)
+    return SetpointArrays(heaters, pumps, tempsensors, presssensors)
+
+
+class SetpointLoop(object):
+    """ Same as SetpointArrays, with the Python loop of check_one_by_one.
+
+    NumPy's overhead per call is more than the whole loop over a brewery's
+    worth of controllers, so this is the quicker one below VECTORIZE_CONTROLLERS.
+    Nothing is checked in the cycles where no input changed.
+    """
+
+    def __init__(self, heaters, pumps, tempsensors, presssensors):
+        self.heaters = list(heaters)
+        self.pumps = list(pumps)
+        self.tempsensors = tempsensors
+        self.presssensors = presssensors
+        self.changes = [watch(self.heaters), watch(self.pumps), watch(tempsensors.values()),
+                        watch(presssensors.values())]
+        self.check_all = True
+
+    def check_setpoints(self, check_all=False):
+        """ Decides the status of every heater and pump, if any input changed since the last call
+        (always with check_all).
+
+        Returns the controllers whose status changed.
+        """
+        if not (check_all or self.check_all or any(self.changes)):
+            return []
+        # Emptied before the components are read, so a change made meanwhile is not missed
+        for changes in self.changes:
+            drain(changes)
+        self.check_all = False
+        return check_one_by_one(self.heaters, self.pumps, self.tempsensors, self.presssensors)
+
+
+class SensorReadings(object):
+    """ Latest readings of the sensors used by a set of controllers, and which controller uses which.
+
+    sensors is {name: component} and attr the attribute holding the reading. Every
+    controller uses one sensor; the controllers using a sensor are found without
+    looking at the others.
+    """
+
+    def __init__(self, sensors, attr, controller_count):
+        self.sensors = sensors
+        self.attr = attr
+        self.get_reading = attrgetter(attr)
+        # Sensors in use, by slot
+        self.slots = {}
+        self.names = []
+        self.readings = np.zeros(0)
+        # Slot of the sensor used by each controller
+        self.controller_slots = np.zeros(controller_count, dtype=np.intp)
+        # Controllers using each slot; filled in by update_dependents
+        self.users = []
+
+    def use(self, i, name):
+        """ Makes controller i use sensor name. Call update_dependents after the last one"""
+        slot = self.slots.get(name)
+        if slot is None:
+            slot = self.slots[name] = len(self.names)
+            self.names.append(name)
+            self.readings = np.append(self.readings, getattr(self.sensors[name], self.attr))
+        self.controller_slots[i] = slot
+
+    def update_dependents(self):
+        """ Lists the controllers using each sensor, so they are found without looking at the others"""
+        self.users = [[] for name in self.names]
+        for i, slot in enumerate(self.controller_slots.tolist()):
+            self.users[slot].append(i)
+
+    def update(self, names):
+        """ Loads the new readings of the sensors. Returns the indexes of the controllers using them"""
+        slots = [self.slots[name] for name in names if name in self.slots]
+        if not slots:
+            return np.zeros(0, dtype=np.intp)
+        for slot in slots:
+            self.readings[slot] = self.get_reading(self.sensors[self.names[slot]])
+        return np.fromiter(chain.from_iterable(map(self.users.__getitem__, slots)), dtype=np.intp)
+
+    def update_all(self):
+        """ Loads the readings of every sensor in use"""
+        self.readings = np.fromiter(map(self.get_reading, map(self.sensors.__getitem__, self.names)),
+                                    dtype=float, count=len(self.names))
+
+    def controller_readings(self, index):
+        """ Returns the readings of the sensors used by the controllers at index"""
+        return self.readings[self.controller_slots[index]]
+
+
+class SetpointArrays(object):
+    """ Settings and inputs of a set of heaters and pumps, laid out in arrays.
+
+    heaters and pumps are lists of components; tempsensors and presssensors
+    are {name: component} and must hold every sensor the controllers use.
+    All of these components are watched for changes (which replaces any
+    watcher they had).
+    """
+
+    def __init__(self, heaters, pumps, tempsensors, presssensors):
+        self.heaters = list(heaters)
+        self.pumps = list(pumps)
+        self.tempsensors = tempsensors
+        self.presssensors = presssensors
+        # Names of the components that changed since the last check
+        self.changed_heaters = watch(self.heaters)
+        self.changed_pumps = watch(self.pumps)
+        self.changed_tempsensors = watch(tempsensors.values())
+        self.changed_presssensors = watch(presssensors.values())
+        self.load_settings()
+
+    def load_settings(self):
+        """ Loads everything from the components; the next check covers every controller"""
+        heater_count = len(self.heaters)
+        self.heater_index = {heater.name: i for i, heater in enumerate(self.heaters)}
+        self.temps = SensorReadings(self.tempsensors, 'value', heater_count)
+        self.heater_lower = np.zeros(heater_count)
+        self.heater_upper = np.zeros(heater_count)
+        self.heater_max = np.zeros(heater_count)
+        for i in range(heater_count):
+            self.load_heater(i)
+        self.temps.update_dependents()
+        self.heater_status = np.array([status_code(heater) for heater in self.heaters], dtype=np.int8)
+
+        pump_count = len(self.pumps)
+        self.pump_index = {pump.name: i for i, pump in enumerate(self.pumps)}
+        self.pressures = SensorReadings(self.presssensors, 'pressure', pump_count)
+        self.pump_slope = np.zeros(pump_count)
+        self.pump_intercept = np.zeros(pump_count)
+        self.pump_lower = np.zeros(pump_count)
+        self.pump_upper = np.zeros(pump_count)
+        for i in range(pump_count):
+            self.load_pump(i)
+        self.pressures.update_dependents()
+        self.pump_status = np.array([status_code(pump) for pump in self.pumps], dtype=np.int8)
+        # Unknown volumes are nan, so the first result is always stored
+        self.gallons = np.array([np.nan if pump.gallons is None else pump.gallons for pump in self.pumps],
+                                dtype=float)
+
+        self.check_all = True
+
+    def load_heater(self, i):
+        """ Copies the settings of heater i"""
+        heater = self.heaters[i]
+        self.temps.use(i, heater.tsensor_name)
+        self.heater_lower[i] = heater.lower_limit
+        self.heater_upper[i] = heater.upper_limit
+        self.heater_max[i] = heater.maxtemp
+
+    def load_pump(self, i):
+        """ Copies the settings of pump i"""
+        pump = self.pumps[i]
+        self.pressures.use(i, pump.psensor_name)
+        self.pump_slope[i] = pump.psi_to_gal_slope
+        self.pump_intercept[i] = pump.psi_to_gal_intercept
+        self.pump_lower[i] = pump.lower_limit
+        self.pump_upper[i] = pump.upper_limit
+
+    def to_check(self, changed_controllers, controller_index, load_controller, changed_sensors, readings):
+        """ Loads the new settings and readings for one type of controller.
+
+        Returns the indexes of the controllers whose inputs changed, or ALL when
+        so many sensors changed that checking every controller is quicker.
+        """
+        settings = [controller_index[name] for name in drain(changed_controllers) if name in controller_index]
+        for i in settings:
+            load_controller(i)
+        if settings:
+            # They may use other sensors now
+            readings.update_dependents()
+
+        if (self.check_all or len(changed_sensors) > FULL_PASS_FRACTION * len(readings.names) or
+                (changed_sensors and len(controller_index) < FULL_PASS_CONTROLLERS)):
+            # Skips the bookkeeping of which controller uses which sensor. Emptied before
+            # the readings are loaded, so a sensor changing meanwhile is not missed
+            changed_sensors.clear()
+            readings.update_all()
+            return ALL
+        index = readings.update(drain(changed_sensors))
+        if settings:
+            index = np.union1d(index, settings)
+        return index
+
+    def heaters_to_check(self):
+        """ Returns the indexes of the heaters whose inputs changed (or ALL), after loading the new inputs"""
+        return self.to_check(self.changed_heaters, self.heater_index, self.load_heater,
+                             self.changed_tempsensors, self.temps)
+
+    def pumps_to_check(self):
+        """ Returns the indexes of the pumps whose inputs changed (or ALL), after loading the new inputs"""
+        return self.to_check(self.changed_pumps, self.pump_index, self.load_pump,
+                             self.changed_presssensors, self.pressures)
+
+    def check_heaters(self, index):
+        """ Decides the status of the heaters at index. Returns the heaters whose status changed"""
+        temps = self.temps.controller_readings(index)
+        # Later rules win, as in a sequence of if statements
+        actions = np.where(temps > self.heater_upper[index], TURN_OFF, KEEP)
+        actions[temps < self.heater_lower[index]] = TURN_ON
+        actions[temps >= self.heater_max[index]] = TURN_OFF
+        return apply_actions(self.heaters, self.heater_status, index, actions)
+
+    def check_pumps(self, index):
+        """ Updates the gallons and decides the status of the pumps at index. Returns the pumps whose status changed"""
+        gallons = self.pressures.controller_readings(index) * self.pump_slope[index] + self.pump_intercept[index]
+        moved = np.flatnonzero(gallons != self.gallons[index])
+        for i, pump_gallons in zip(positions(index, moved).tolist(), gallons[moved].tolist()):
+            self.pumps[i].gallons = pump_gallons
+        self.gallons[index] = gallons
+
+        actions = np.where(gallons > self.pump_upper[index], TURN_OFF, KEEP)
+        actions[gallons < self.pump_lower[index]] = TURN_ON
+        return apply_actions(self.pumps, self.pump_status, index, actions)
+
+    def check_setpoints(self, check_all=False):
+        """ Decides the status of the heaters and pumps whose inputs changed since the last call
+        (all of them with check_all).
+
+        Returns the controllers whose status changed.
+        """
+        if check_all:
+            self.check_all = True
+        changed = []
+        if self.changed_heaters or self.changed_tempsensors or self.check_all:
+            index = self.heaters_to_check()
+            if index is ALL or len(index):
+                changed += self.check_heaters(index)
+        if self.changed_pumps or self.changed_presssensors or self.check_all:
+            index = self.pumps_to_check()
+            if index is ALL or len(index):
+                changed += self.check_pumps(index)
+        self.check_all = False
+        return changed
@@ -1,11 +1,11 @@
 #!/usr/bin/env python3
 
 # Import standard Python modules
-from multiprocessing import Manager
 
 # Import third-party libraries
 
 # Import relative files
+from shared_state import SharedState
 
 # Global File
 CONFIG_FILE = "config.txt"
@@ -17,94 +17,140 @@ DEFAULT_PSI_TO_GAL_SLOPE = 8.2759
 DEFAULT_PSI_TO_GAL_INT = 0.0
 DEFAULT_GALLON_LIMIT = 14.0
 
+# Board used when the configuration file does not list any
+DEFAULT_BOARD_NAME = "Arduino"
+DEFAULT_SERIAL_PORT = "/dev/ttyACM0"
+
 
 def return_configuration(config_file=CONFIG_FILE):
     """ Reads a configuration file and builds sensor structures
 
     Returns:
-        multiprocessing Manager
-        multiprocessing dictionary (used to pass and update brewery info)
+        shared memory block holding the brewery info (keep a reference until shutdown)
+        SharedState dictionary (used to pass and update brewery info)
         list of sensor names
     """
 
     # Information to return:
-    manager = Manager()
     tsensornames = []
     psensornames = []
     heaternames = []
     pumpnames = []
 
-    # Create mp dictionary and fill first level
-    d = manager.dict()
-    for first_level in ['tempsensors', 'presssensors', 'heaters', 'pumps']:
-        d[first_level] = manager.dict()
-
-    # Read configuration file and fill dictionary with data
+    # Read configuration file and gather the component definitions.
+    # The names have to be known up front to lay out the shared memory block.
     with open(config_file) as fileobj:
         config_lines = fileobj.readlines()
 
+    board_ports = {}
+    component_boards = {}
+    tsensor_serials = {}
+    psensor_pins = {}
+    heater_pins = {}
+    pump_pins = {}
     for line in config_lines:
         # Skip commented lines
         if line.startswith('#'):
             continue
+        # Add Arduino board info
+        if line.startswith('Board'):
+            split_line = line.split(',')
+            board_ports[split_line[1]] = split_line[2].strip()
+            continue
+        # Sensors, heaters and pumps can name the board they are wired to (blank for the default one)
+        split_line = line.split(',')
+        board = split_line[3].strip() if len(split_line) > 3 else ''
+        category = None
         # Add temperature sensor info
         if line.startswith("TemperatureSensor"):
-            split_line = line.split(',')
+            category = 'tempsensors'
             name = split_line[1]
-            serial_num = split_line[2].strip()
-            d['tempsensors'][name] = manager.dict()
-            d['tempsensors'][name]['value'] = 32.0
-            d['tempsensors'][name]['name'] = name
-            d['tempsensors'][name]['units'] = 'F'
-            d['tempsensors'][name]['serial_num'] = serial_num
+            tsensor_serials[name] = split_line[2].strip()
             tsensornames.append(name)
         if line.startswith('PressureSensor'):
-            split_line = line.split(',')
+            category = 'presssensors'
             name = split_line[1]
-            pin = split_line[2].strip()
-            d['presssensors'][name] = manager.dict()
-            d['presssensors'][name]['name'] = name
-            d['presssensors'][name]['voltage'] = 0.0
-            d['presssensors'][name]['pressure'] = 0.0
-            d['presssensors'][name]['volts_to_pressure_slope'] = DEFAULT_VOLT_TO_PRESSURE_SLOPE
-            d['presssensors'][name]['volts_to_pressure_intercept'] = DEFAULT_VOLT_TO_PRESSURE_INT
-            d['presssensors'][name]['pin_num'] = int(pin)
-            d['presssensors'][name]['units'] = 'psig'
+            psensor_pins[name] = int(split_line[2].strip())
             psensornames.append(name)
         if line.startswith('Heater'):
-            split_line = line.split(',')
+            category = 'heaters'
             name = split_line[1]
-            pin = split_line[2].strip()
-            d['heaters'][name] = manager.dict()
-            d['heaters'][name]['name'] = name
-            d['heaters'][name]['pin_num'] = int(pin)
-            d['heaters'][name]['status'] = 'OFF'
-            d['heaters'][name]['tsensor_name'] = tsensornames[0]
-            d['heaters'][name]['lower limit'] = 32.0
-            d['heaters'][name]['upper limit'] = 32.0
-            d['heaters'][name]['maxtemp'] = 212.0
+            heater_pins[name] = int(split_line[2].strip())
             heaternames.append(name)
         if line.startswith('Pump'):
-            split_line = line.split(',')
+            category = 'pumps'
             name = split_line[1]
-            pin = split_line[2].strip()
-            d['pumps'][name] = manager.dict()
-            d['pumps'][name]['pin_num'] = int(pin)
-            d['pumps'][name]['name'] = name
-            d['pumps'][name]['psensor_name'] = psensornames[0]
-            d['pumps'][name]['psi_to_gal_slope'] = DEFAULT_PSI_TO_GAL_SLOPE
-            d['pumps'][name]['psi_to_gal_intercept'] = DEFAULT_PSI_TO_GAL_INT
-            d['pumps'][name]['gallons'] = 0.0
-            d['pumps'][name]['upper limit'] = DEFAULT_GALLON_LIMIT
-            d['pumps'][name]['lower limit'] = DEFAULT_GALLON_LIMIT * 0.95
-            d['pumps'][name]['status'] = 'OFF'
+            pump_pins[name] = int(split_line[2].strip())
             pumpnames.append(name)
-
-    return manager, d, tsensornames, psensornames, heaternames, pumpnames
+        # Keyed by category too, since a sensor and a heater may share a name
+        if category is not None and board:
+            component_boards[(category, name)] = board
+
+    if not board_ports:
+        board_ports[DEFAULT_BOARD_NAME] = DEFAULT_SERIAL_PORT
+    boardnames = list(board_ports.keys())
+    for (category, name), board in component_boards.items():
+        if board not in board_ports:
+            raise ValueError("{} is wired to an unknown board: {}".format(name, board))
+
+    # Create the shared state and fill it with the default data
+    d = SharedState({'boards': boardnames,
+                     'tempsensors': tsensornames,
+                     'presssensors': psensornames,
+                     'heaters': heaternames,
+                     'pumps': pumpnames})
+
+    for name in boardnames:
+        d['boards'][name]['name'] = name
+        d['boards'][name]['serial_port'] = board_ports[name]
+    # Anything not assigned to a board goes on the first one
+    default_board = boardnames[0]
+    for name in tsensornames:
+        d['tempsensors'][name]['value'] = 32.0
+        d['tempsensors'][name]['name'] = name
+        d['tempsensors'][name]['board'] = component_boards.get(('tempsensors', name), default_board)
+        d['tempsensors'][name]['units'] = 'F'
+        d['tempsensors'][name]['serial_num'] = tsensor_serials[name]
+    for name in psensornames:
+        d['presssensors'][name]['name'] = name
+        d['presssensors'][name]['board'] = component_boards.get(('presssensors', name), default_board)
+        d['presssensors'][name]['voltage'] = 0.0
+        d['presssensors'][name]['pressure'] = 0.0
+        d['presssensors'][name]['volts_to_pressure_slope'] = DEFAULT_VOLT_TO_PRESSURE_SLOPE
+        d['presssensors'][name]['volts_to_pressure_intercept'] = DEFAULT_VOLT_TO_PRESSURE_INT
+        d['presssensors'][name]['pin_num'] = psensor_pins[name]
+        d['presssensors'][name]['units'] = 'psig'
+    for name in heaternames:
+        d['heaters'][name]['name'] = name
+        d['heaters'][name]['board'] = component_boards.get(('heaters', name), default_board)
+        d['heaters'][name]['pin_num'] = heater_pins[name]
+        d['heaters'][name]['status'] = 'OFF'
+        d['heaters'][name]['tsensor_name'] = tsensornames[0]
+        d['heaters'][name]['lower limit'] = 32.0
+        d['heaters'][name]['upper limit'] = 32.0
+        d['heaters'][name]['maxtemp'] = 212.0
+    for name in pumpnames:
+        d['pumps'][name]['pin_num'] = pump_pins[name]
+        d['pumps'][name]['name'] = name
+        d['pumps'][name]['board'] = component_boards.get(('pumps', name), default_board)
+        d['pumps'][name]['psensor_name'] = psensornames[0]
+        d['pumps'][name]['psi_to_gal_slope'] = DEFAULT_PSI_TO_GAL_SLOPE
+        d['pumps'][name]['psi_to_gal_intercept'] = DEFAULT_PSI_TO_GAL_INT
+        d['pumps'][name]['gallons'] = 0.0
+        d['pumps'][name]['upper limit'] = DEFAULT_GALLON_LIMIT
+        d['pumps'][name]['lower limit'] = DEFAULT_GALLON_LIMIT * 0.95
+        d['pumps'][name]['status'] = 'OFF'
+
+    # Build the serial number and pin number lookups now that the sensors are known
+    d.sensor_index.rebuild()
+
+    return d.shm, d, tsensornames, psensornames, heaternames, pumpnames
 
 
 if __name__ == "__main__":
-    (manager, ard_dict, tsensornames,
+    (ard_shm, ard_dict, tsensornames,
     psensornames, heaternames, pumpnames) = return_configuration()
+    ard_dict.close()
+    ard_dict.unlink()
 
     print("Script complete")
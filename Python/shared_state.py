@@ -0,0 +1,544 @@
+#!/usr/bin/env python3
+
+""" Shared brewery state
+
+    Holds the brewery information (Arduino boards, temperature sensors,
+    pressure sensors, heaters and pumps) in a single multiprocessing shared
+    memory block.
+    Every field of every component has a typed, fixed size slot, so reading
+    or writing a value is a plain memory access inside the calling process
+    instead of a round trip to a Manager server process.
+
+    The SharedState object behaves like the old two level dictionary:
+
+        state['heaters']['Heater 1']['status'] = 'ON'
+        temp = state['tempsensors']['Mash Tun Hi']['value']
+
+    """
+
+# Import standard Python modules
+import struct
+from collections.abc import Mapping
+from contextlib import contextmanager
+from multiprocessing import RLock, Condition
+from multiprocessing.shared_memory import SharedMemory
+from types import MappingProxyType
+
+# Import third-party libraries
+
+# Import relative files
+from arduino_protocol import serial_to_address
+
+# Size (in bytes) of every string slot (names, serial numbers, statuses)
+STRING_SIZE = 64
+
+# Longest wait (seconds) for the lock. It is only ever held for a moment, so waiting longer
+# means the process holding it died (e.g. was killed) and will never let go of it
+LOCK_TIMEOUT = 5.0
+
+# Number of changes the feed remembers. Subscribers that fall further behind get the whole state.
+CHANGE_FEED_SIZE = 1024
+
+# Change feed header (latest version, number of entries ever written) and entries (version, slot index)
+FEED_HEADER = struct.Struct('QQ')
+FEED_ENTRY = struct.Struct('QQ')
+
+# Counter bumped whenever a field used by the SensorIndex changes
+INDEX_HEADER = struct.Struct('Q')
+INDEX_OFFSET = FEED_HEADER.size
+INDEX_KEYS = ('serial_num', 'pin_num', 'tsensor_name', 'psensor_name', 'board')
+
+FEED_OFFSET = INDEX_OFFSET + INDEX_HEADER.size
+
+# Struct formats used for each kind of field
+FIELD_FORMATS = {'f': 'd',
+                 'i': 'q',
+                 's': '{}s'.format(STRING_SIZE)}
+
+# Fields (and their kinds) held for every component type
+# f = float, i = integer, s = string
+CATEGORY_FIELDS = {
+    'boards': (('name', 's'),
+               ('serial_port', 's')),
+    'tempsensors': (('name', 's'),
+                    ('board', 's'),
+                    ('serial_num', 's'),
+                    ('value', 'f'),
+                    ('units', 's')),
+    'presssensors': (('name', 's'),
+                     ('board', 's'),
+                     ('voltage', 'f'),
+                     ('pressure', 'f'),
+                     ('volts_to_pressure_slope', 'f'),
+                     ('volts_to_pressure_intercept', 'f'),
+                     ('pin_num', 'i'),
+                     ('units', 's')),
+    'heaters': (('name', 's'),
+                ('board', 's'),
+                ('pin_num', 'i'),
+                ('status', 's'),
+                ('tsensor_name', 's'),
+                ('lower limit', 'f'),
+                ('upper limit', 'f'),
+                ('maxtemp', 'f')),
+    'pumps': (('pin_num', 'i'),
+              ('name', 's'),
+              ('board', 's'),
+              ('psensor_name', 's'),
+              ('psi_to_gal_slope', 'f'),
+              ('psi_to_gal_intercept', 'f'),
+              ('gallons', 'f'),
+              ('upper limit', 'f'),
+              ('lower limit', 'f'),
+              ('status', 's')),
+}
+
+
+class LockTimeout(RuntimeError):
+    """ Raised when the lock of the state could not be taken within LOCK_TIMEOUT"""
+    pass
+
+
+class SharedState(Mapping):
+    """ Array-backed state store living in a shared memory block.
+
+    layout is a dictionary of category -> list of component names, in the
+    same order as the configuration file. The store can be handed to a
+    multiprocessing.Process like any other argument.
+
+    Every change to a field is also published on a change feed: a ring of
+    (version, slot) entries in the same block. Consumers call subscribe()
+    and only receive the fields that changed since their cursor.
+    """
+
+    def __init__(self, layout, shm_name=None, lock=None, changed=None):
+        self.layout = {category: list(layout.get(category, []))
+                       for category in CATEGORY_FIELDS}
+        self.lock = lock if lock is not None else RLock()
+        # Signalled every time a batch of changes is published
+        self.changed = changed if changed is not None else Condition(self.lock)
+
+        # slots[category][name][key] -> (offset, struct.Struct, kind, slot index)
+        # slot_keys[slot index] -> (category, name, key)
+        self.slots = {}
+        self.slot_keys = []
+        offset = FEED_OFFSET + CHANGE_FEED_SIZE * FEED_ENTRY.size
+        self.data_offset = offset
+        for category, fields in CATEGORY_FIELDS.items():
+            self.slots[category] = {}
+            for name in self.layout[category]:
+                self.slots[category][name] = {}
+                for key, kind in fields:
+                    packer = struct.Struct(FIELD_FORMATS[kind])
+                    self.slots[category][name][key] = (offset, packer, kind, len(self.slot_keys))
+                    self.slot_keys.append((category, name, key))
+                    offset += packer.size
+        self.size = offset
+
+        if shm_name is None:
+            self.shm = SharedMemory(create=True, size=self.size)
+        else:
+            self.shm = SharedMemory(name=shm_name)
+        self.buf = self.shm.buf
+
+        # Batches are tracked per process; the lock is held for the whole batch
+        self._batch_depth = 0
+        self._batch_version = None
+
+        self._views = {category: _CategoryView(self, category)
+                       for category in CATEGORY_FIELDS}
+
+        # Lookup tables for incoming Arduino data, private to this process
+        self.sensor_index = SensorIndex(self)
+
+    def __getstate__(self):
+        # Only the name of the block is sent to child processes; they re-attach to it
+        return {'layout': self.layout, 'shm_name': self.shm.name,
+                'lock': self.lock, 'changed': self.changed}
+
+    def __setstate__(self, state):
+        self.__init__(state['layout'], shm_name=state['shm_name'],
+                      lock=state['lock'], changed=state['changed'])
+
+    def __getitem__(self, category):
+        return self._views[category]
+
+    def __iter__(self):
+        return iter(self._views)
+
+    def __len__(self):
+        return len(self._views)
+
+    @contextmanager
+    def locked(self):
+        """ Holds the lock. Raises LockTimeout instead of waiting forever for a dead holder"""
+        if not self.lock.acquire(timeout=LOCK_TIMEOUT):
+            raise LockTimeout("The shared state lock was not released within {} s".format(LOCK_TIMEOUT))
+        try:
+            yield self
+        finally:
+            self.lock.release()
+
+    def lock_is_stuck(self, timeout=1.0):
+        """ Returns True if the lock cannot be taken within timeout (seconds)"""
+        if not self.lock.acquire(timeout=timeout):
+            return True
+        self.lock.release()
+        return False
+
+    def replace_lock(self):
+        """ Gives the state a new lock, e.g. when a process died holding the old one.
+
+        Only the processes started afterwards get it; the running ones keep the old
+        lock and have to be restarted.
+        """
+        self.lock = RLock()
+        self.changed = Condition(self.lock)
+
+    def read(self, category, name, key):
+        """ Returns the value of a single field"""
+        offset, packer, kind, index = self.slots[category][name][key]
+        with self.locked():
+            raw = packer.unpack_from(self.buf, offset)[0]
+        if kind == 's':
+            return raw.rstrip(b'\0').decode('utf-8')
+        return raw
+
+    def write(self, category, name, key, value):
+        """ Stores the value of a single field, converting it to the slot type
+
+        The change is published to subscribers only if the stored value actually changed.
+        """
+        offset, packer, kind, index = self.slots[category][name][key]
+        new = packer.pack(_convert(value, kind, key))
+        with self.batch():
+            if self.buf[offset:offset + packer.size] != new:
+                self.buf[offset:offset + packer.size] = new
+                self._publish(index)
+
+    def update_record(self, category, name, fields):
+        """ Writes several fields of one component as a single transaction.
+
+        All of the values are converted before anything is written, so a bad value
+        leaves the component untouched, and readers see either all of the new
+        values or none of them.
+        """
+        slots = self.slots[category][name]
+        packed = []
+        for key, value in fields.items():
+            offset, packer, kind, index = slots[key]
+            packed.append((offset, packer.size, packer.pack(_convert(value, kind, key)), index))
+
+        with self.batch():
+            for offset, size, new, index in packed:
+                if self.buf[offset:offset + size] != new:
+                    self.buf[offset:offset + size] = new
+                    self._publish(index)
+
+    @contextmanager
+    def batch(self):
+        """ Groups several writes under one lock hold and one feed version.
+
+        Subscribers are woken up once, when the outermost batch ends.
+        """
+        with self.locked():
+            self._batch_depth += 1
+            try:
+                yield self
+            finally:
+                self._batch_depth -= 1
+                if self._batch_depth == 0 and self._batch_version is not None:
+                    self._batch_version = None
+                    self.changed.notify_all()
+
+    def _publish(self, index):
+        """ Appends a changed slot to the change feed. Must be called inside a batch."""
+        version, head = FEED_HEADER.unpack_from(self.buf, 0)
+        if self._batch_version is None:
+            self._batch_version = version + 1
+        FEED_ENTRY.pack_into(self.buf, FEED_OFFSET + (head % CHANGE_FEED_SIZE) * FEED_ENTRY.size,
+                             self._batch_version, index)
+        FEED_HEADER.pack_into(self.buf, 0, self._batch_version, head + 1)
+        if self.slot_keys[index][2] in INDEX_KEYS:
+            INDEX_HEADER.pack_into(self.buf, INDEX_OFFSET,
+                                   INDEX_HEADER.unpack_from(self.buf, INDEX_OFFSET)[0] + 1)
+
+    def version(self):
+        """ Returns the version of the latest published change"""
+        with self.locked():
+            return FEED_HEADER.unpack_from(self.buf, 0)[0]
+
+    def index_version(self):
+        """ Returns a counter that changes every time a sensor is renumbered or reassigned"""
+        with self.locked():
+            return INDEX_HEADER.unpack_from(self.buf, INDEX_OFFSET)[0]
+
+    def subscribe(self, cursor=0):
+        """ Returns a Subscription to the change feed.
+
+        With the default cursor of 0, the first poll returns the whole state.
+        """
+        return Subscription(self, cursor)
+
+    def changes_since(self, cursor):
+        """ Returns (version, changes) for everything published after cursor.
+
+        changes has the same nested layout as snapshot() but only holds the
+        fields that changed. If the cursor is too old for the feed, the whole
+        state is returned instead.
+        """
+        with self.locked():
+            version, head = FEED_HEADER.unpack_from(self.buf, 0)
+            if version == cursor:
+                return version, {}
+
+            indexes = set()
+            complete = cursor != 0
+            position = head - 1
+            while complete:
+                if position < 0:
+                    break
+                if position < head - CHANGE_FEED_SIZE:
+                    # The entries after the cursor were overwritten; fall back to everything
+                    complete = False
+                    break
+                entry_version, index = FEED_ENTRY.unpack_from(
+                    self.buf, FEED_OFFSET + (position % CHANGE_FEED_SIZE) * FEED_ENTRY.size)
+                if entry_version <= cursor:
+                    break
+                indexes.add(index)
+                position -= 1
+
+            if not complete:
+                return version, self.snapshot()
+
+            changes = {}
+            for index in indexes:
+                category, name, key = self.slot_keys[index]
+                changes.setdefault(category, {}).setdefault(name, {})[key] = self.read(category, name, key)
+            return version, changes
+
+    def snapshot(self):
+        """ Returns a consistent plain-Python copy of the whole state.
+
+        The values (from data_offset on; the change feed and index header come
+        before) are copied in one go while holding the lock, so a snapshot
+        never mixes values from before and after an update.
+        """
+        start = self.data_offset
+        with self.locked():
+            raw = bytes(self.buf[start:self.size])
+
+        data = {}
+        for category, records in self.slots.items():
+            data[category] = {}
+            for name, fields in records.items():
+                data[category][name] = {}
+                for key, (offset, packer, kind, index) in fields.items():
+                    value = packer.unpack_from(raw, offset - start)[0]
+                    if kind == 's':
+                        value = value.rstrip(b'\0').decode('utf-8')
+                    data[category][name][key] = value
+        return data
+
+    def close(self):
+        """ Detaches this process from the shared memory block"""
+        self._views = {}
+        self.buf = None
+        self.shm.close()
+
+    def unlink(self):
+        """ Frees the shared memory block. Only the creating process should call this."""
+        self.shm.unlink()
+
+
+class Subscription(object):
+    """ Cursor into the change feed of a SharedState.
+
+    poll() returns immediately; wait() blocks until something changes.
+    Both return a nested dictionary holding only the changed fields.
+    """
+
+    def __init__(self, state, cursor=0):
+        self.state = state
+        self.cursor = cursor
+
+    def poll(self):
+        """ Returns the fields that changed since the last call (empty if nothing did)"""
+        self.cursor, changes = self.state.changes_since(self.cursor)
+        return changes
+
+    def wait(self, timeout=None):
+        """ Blocks until there are new changes (or the timeout expires) and returns them"""
+        with self.state.locked():
+            if self.state.version() == self.cursor:
+                self.state.changed.wait(timeout)
+            return self.poll()
+
+
+class SensorIndex(object):
+    """ Maps incoming Arduino data to sensors without scanning the state.
+
+    by_serial: temperature sensor serial number -> sensor name
+    by_address: temperature sensor address bytes (binary protocol) -> sensor name
+    by_pin: (board name, analog pin number) -> pressure sensor name
+    heater_tsensor / pump_psensor: controller name -> controlling sensor name
+
+    The tables are rebuilt on the next lookup whenever a serial number, pin
+    number or controlling sensor is changed from any process (e.g. the GUI).
+    """
+
+    def __init__(self, state):
+        self.state = state
+        self.version = None
+        self.by_serial = {}
+        self.by_address = {}
+        self.by_pin = {}
+        self.default_board = None
+        self.heater_tsensor = {}
+        self.pump_psensor = {}
+
+    def refresh(self):
+        """ Rebuilds the tables if the indexed fields changed since the last build"""
+        version = self.state.index_version()
+        if version != self.version:
+            self.rebuild(version)
+
+    def rebuild(self, version=None):
+        """ Builds all of the tables from one snapshot of the state"""
+        if version is None:
+            version = self.state.index_version()
+        data = self.state.snapshot()
+
+        by_serial = {}
+        for name, sensor in data['tempsensors'].items():
+            # Placeholder sensors without a serial number never match, and the first
+            # sensor wins if a serial number is listed twice
+            if sensor['serial_num'] and sensor['serial_num'] not in by_serial:
+                by_serial[sensor['serial_num']] = name
+
+        by_address = {}
+        for serial_num, name in by_serial.items():
+            address = serial_to_address(serial_num)
+            if address is not None:
+                by_address[address] = name
+
+        by_pin = {}
+        for name, sensor in data['presssensors'].items():
+            # Every board has its own analog pins
+            by_pin.setdefault((sensor['board'], sensor['pin_num']), name)
+
+        self.by_serial = by_serial
+        self.by_address = by_address
+        self.by_pin = by_pin
+        self.default_board = next(iter(data['boards']), None)
+        self.heater_tsensor = {name: heater['tsensor_name'] for name, heater in data['heaters'].items()}
+        self.pump_psensor = {name: pump['psensor_name'] for name, pump in data['pumps'].items()}
+        self.version = version
+
+    def tempsensor(self, serial_num):
+        """ Returns the name of the temperature sensor with the serial number (or None)"""
+        self.refresh()
+        return self.by_serial.get(serial_num)
+
+    def presssensor(self, pin_num, board=None):
+        """ Returns the name of the pressure sensor on the analog pin of the board (or None).
+
+        Without a board, the first board in the configuration is used.
+        """
+        self.refresh()
+        if board is None:
+            board = self.default_board
+        return self.by_pin.get((board, pin_num))
+
+
+class _CategoryView(Mapping):
+    """ Dictionary-like view of one category (e.g. 'heaters') of the SharedState"""
+
+    def __init__(self, state, category):
+        self.state = state
+        self.category = category
+        self._records = {name: _RecordView(state, category, name)
+                         for name in state.layout[category]}
+
+    def __getitem__(self, name):
+        return self._records[name]
+
+    def __iter__(self):
+        return iter(self._records)
+
+    def __len__(self):
+        return len(self._records)
+
+
+class _RecordView(Mapping):
+    """ Dictionary-like view of a single component inside the SharedState"""
+
+    def __init__(self, state, category, name):
+        self.state = state
+        self.category = category
+        self.name = name
+        self._keys = [key for key, kind in CATEGORY_FIELDS[category]]
+
+    def __getitem__(self, key):
+        return self.state.read(self.category, self.name, key)
+
+    def __setitem__(self, key, value):
+        self.state.write(self.category, self.name, key, value)
+
+    def update(self, fields):
+        """ Writes several fields at once (see SharedState.update_record)"""
+        self.state.update_record(self.category, self.name, fields)
+
+    def __iter__(self):
+        return iter(self._keys)
+
+    def __len__(self):
+        return len(self._keys)
+
+
+def merge_changes(data, changes):
+    """ Merges the output of a Subscription into a local copy of the state"""
+    for category, records in changes.items():
+        for name, fields in records.items():
+            data.setdefault(category, {}).setdefault(name, {}).update(fields)
+    return data
+
+
+def freeze_changes(snapshot, changes):
+    """ Returns a read-only copy of snapshot with the output of a Subscription merged in.
+
+    snapshot is None or the result of an earlier call, and is left untouched. The
+    components that did not change are shared between the two, so the copy costs
+    as much as the changes; either one can be handed to another thread.
+    """
+    categories = dict(snapshot) if snapshot is not None else {}
+    for category, records in changes.items():
+        new_records = dict(categories.get(category, {}))
+        for name, fields in records.items():
+            record = dict(new_records.get(name, {}))
+            record.update(fields)
+            new_records[name] = MappingProxyType(record)
+        categories[category] = MappingProxyType(new_records)
+    return MappingProxyType(categories)
+
+
+def _convert(value, kind, key):
+    """ Converts a value into something that fits into a slot of the given kind"""
+    if kind == 'f':
+        return float(value)
+    if kind == 'i':
+        return int(value)
+    encoded = str(value).encode('utf-8')
+    if len(encoded) > STRING_SIZE:
+        raise ValueError("Value for '{}' is longer than {} bytes: {}".format(key, STRING_SIZE, value))
+    return encoded
+
+
+if __name__ == "__main__":
+    state = SharedState({'tempsensors': ['Temp 1'], 'heaters': ['Heater 1']})
+    state['tempsensors']['Temp 1']['value'] = '55.5'
+    state['heaters']['Heater 1']['status'] = 'ON'
+    print(state['tempsensors']['Temp 1']['value'], state['heaters']['Heater 1']['status'])
+    state.close()
+    state.unlink()
@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+
+""" Process supervisor
+
+    Keeps the brewery processes (the GUI and one ArdControl per board)
+    running. Instead of checking on them every so often, it waits on their
+    sentinels with multiprocessing.connection.wait, so it hears about a
+    process dying within milliseconds, and restarts it:
+
+        supervisor = Supervisor()
+        supervisor.add("GUI", lambda ready: Process(target=process_gui, args=...))
+        supervisor.add("Arduino", lambda ready: ArdControl(ard_dict, ready=ready))
+        supervisor.run()
+
+    Every start gets a fresh multiprocessing Event (ready) the process can
+    set once it is up (ArdControl sets it once the Arduino answered), so
+    the supervisor can tell a process that never got going from one that
+    crashed later. A process that dies soon after starting is restarted
+    after a growing delay (backoff) so a process that cannot start does not
+    spin; one that had been running for a while is restarted right away.
+
+    The shared state outlives the processes, so a restarted ArdControl
+    starts from the last values its predecessor published. A process killed
+    while holding the lock of the shared state would leave it locked for
+    good; when the supervisor is given the state, it checks the lock after
+    every death, and if it is stuck, gives the state a new lock and restarts
+    every process with it.
+
+    """
+
+# Import standard Python modules
+import time
+from multiprocessing import Event
+from multiprocessing.connection import wait
+
+# Import third-party libraries
+
+# Import relative files
+
+
+class Service(object):
+    """ One supervised process. factory(ready) returns a new, unstarted process"""
+
+    def __init__(self, name, factory):
+        self.name = name
+        self.factory = factory
+        self.process = None
+        self.ready = None
+        self.started = None
+        self.restarts = 0
+        # Delay before the next restart, and when it is due (None while running)
+        self.backoff = 0.0
+        self.restart_at = None
+
+    def start(self):
+        """ Starts a new process"""
+        self.ready = Event()
+        self.process = self.factory(self.ready)
+        self.process.start()
+        self.started = time.monotonic()
+        self.restart_at = None
+
+    def alive(self):
+        return self.process is not None and self.restart_at is None
+
+
+class Supervisor(object):
+    """ Starts processes and restarts them as soon as they die.
+
+    min_backoff and max_backoff (seconds) bound the delay before a restart;
+    it doubles every time a process dies less than stable_time seconds after
+    starting. state is the SharedState the processes use, if any.
+    """
+
+    def __init__(self, min_backoff=0.5, max_backoff=30.0, stable_time=60.0, state=None):
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+        self.stable_time = stable_time
+        self.state = state
+        self.services = []
+
+    def add(self, name, factory):
+        """ Adds a process and starts it"""
+        service = Service(name, factory)
+        service.backoff = self.min_backoff
+        self.services.append(service)
+        service.start()
+        return service
+
+    def process_died(self, service):
+        """ Schedules the restart of a process that died"""
+        now = time.monotonic()
+        service.process.join()
+        lifetime = now - service.started
+        if lifetime >= self.stable_time:
+            # It was running fine; get it back right away
+            service.backoff = self.min_backoff
+            delay = 0.0
+        else:
+            delay = service.backoff
+            service.backoff = min(service.backoff * 2, self.max_backoff)
+        service.restart_at = now + delay
+        print("{} died (exit code {}) after {:.1f} s{}. Restarting in {:.1f} s".format(
+            service.name, service.process.exitcode, lifetime,
+            "" if service.ready.is_set() else ", before it was ready", delay))
+
+        if self.state is not None and self.state.lock_is_stuck():
+            self.recover_lock()
+
+    def recover_lock(self):
+        """ Replaces the lock of the shared state and restarts every process with the new one"""
+        print("The shared state lock is stuck (held by a process that died). Restarting everything with a new lock")
+        self.state.replace_lock()
+        now = time.monotonic()
+        for service in self.services:
+            if service.alive():
+                service.process.terminate()
+                service.process.join()
+                service.restart_at = now
+
+    def restart_due(self):
+        """ Restarts the processes whose delay is over"""
+        now = time.monotonic()
+        for service in self.services:
+            if service.restart_at is not None and now >= service.restart_at:
+                service.restarts += 1
+                try:
+                    service.start()
+                except Exception as e:
+                    print("Could not restart {}: {}".format(service.name, e))
+                    service.restart_at = now + service.backoff
+                    service.backoff = min(service.backoff * 2, self.max_backoff)
+
+    def step(self, timeout=None):
+        """ Waits until a process dies, a restart is due or timeout (seconds) passes, and handles it"""
+        running = {service.process.sentinel: service for service in self.services if service.alive()}
+        restarts = [service.restart_at for service in self.services if service.restart_at is not None]
+        if restarts:
+            until_restart = max(0.0, min(restarts) - time.monotonic())
+            timeout = until_restart if timeout is None else min(timeout, until_restart)
+
+        for sentinel in wait(list(running), timeout):
+            # Skip the processes a lock recovery already stopped
+            if running[sentinel].alive():
+                self.process_died(running[sentinel])
+        self.restart_due()
+
+    def run(self):
+        """ Supervises the processes until interrupted, then stops them"""
+        try:
+            while True:
+                self.step()
+        finally:
+            self.stop()
+
+    def stop(self):
+        """ Terminates every process"""
+        for service in self.services:
+            if service.alive() and service.process.is_alive():
+                service.process.terminate()
+        for service in self.services:
+            if service.process is not None:
+                service.process.join()
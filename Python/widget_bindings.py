@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+
+""" Widget bindings
+
+    Ties GUI widgets to fields of the brewery state, so a window says once
+    what every label shows instead of rebuilding every text on every refresh:
+
+        table = BindingTable([
+            Binding(window.VariableT1, ('tempsensors', 'Mash Tun Hi', 'value')),
+            Binding(window.LabelHeater1TSensor, ('heaters', 'Heater 1', 'tsensor_name'),
+                    'Controlling Temperature Sensor: {}'.format),
+            # The name in a path can itself be a path: the temperature of the
+            # sensor currently controlling Heater 1
+            Binding(window.VariableHeater1Temp,
+                    ('tempsensors', ('heaters', 'Heater 1', 'tsensor_name'), 'value')),
+        ])
+        for widget, text in table.render(data, changes):
+            widget.setText(text)
+
+    render() is given the fields that changed (the nested dictionaries of
+    the change feed), and only works out the bindings that read one of them.
+    It returns only the widgets whose text is different from what they show,
+    so a steady brewery costs next to nothing.
+
+    """
+
+# Import standard Python modules
+
+# Import third-party libraries
+
+# Import relative files
+
+# Text shown when a binding points at a component or field that does not exist
+MISSING_TEXT = '-'
+
+
+def resolve(data, path, sources):
+    """ Returns the value at path (category, name, key) in data, adding every field read to sources.
+
+    name may itself be a path, giving the name of the component.
+    """
+    category, name, key = path
+    if isinstance(name, tuple):
+        name = resolve(data, name, sources)
+    sources.append((category, name, key))
+    return data[category][name][key]
+
+
+class Binding(object):
+    """ A widget showing formatter(value of the field at path)"""
+
+    __slots__ = ('widget', 'path', 'formatter')
+
+    def __init__(self, widget, path, formatter=str):
+        self.widget = widget
+        self.path = path
+        self.formatter = formatter
+
+    def evaluate(self, data):
+        """ Returns the text of the widget and the fields (category, name, key) it was made from"""
+        sources = []
+        try:
+            text = self.formatter(resolve(data, self.path, sources))
+        except KeyError:
+            text = MISSING_TEXT
+        return text, sources
+
+
+class BindingTable(object):
+    """ A set of bindings, and the text each widget was last given"""
+
+    def __init__(self, bindings):
+        self.bindings = list(bindings)
+        self.rendered = [None] * len(self.bindings)
+        # Bindings reading each field {(category, name, key): set of binding indexes},
+        # and the fields each binding read the last time
+        self.dependents = {}
+        self.sources = [()] * len(self.bindings)
+        # Bindings not worked out yet
+        self.pending = set(range(len(self.bindings)))
+
+    def to_render(self, changes):
+        """ Returns the indexes of the bindings reading any of the changed fields"""
+        if changes is None:
+            return set(range(len(self.bindings)))
+        index = set(self.pending)
+        for category, records in changes.items():
+            for name, fields in records.items():
+                for key in fields:
+                    index.update(self.dependents.get((category, name, key), ()))
+        return index
+
+    def render(self, data, changes=None):
+        """ Returns [(widget, text)] for the widgets whose text changed.
+
+        data is the whole state (nested dictionaries); changes holds the fields
+        that changed since the last call (None to look at every binding).
+        """
+        updates = []
+        for i in sorted(self.to_render(changes)):
+            binding = self.bindings[i]
+            text, sources = binding.evaluate(data)
+            if sources != self.sources[i]:
+                # The binding follows a reference that changed, e.g. a heater's sensor
+                for source in self.sources[i]:
+                    self.dependents[source].discard(i)
+                for source in sources:
+                    self.dependents.setdefault(source, set()).add(i)
+                self.sources[i] = sources
+            if text != self.rendered[i]:
+                self.rendered[i] = text
+                updates.append((binding.widget, text))
+        self.pending.clear()
+        return updates